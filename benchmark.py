@@ -0,0 +1,267 @@
+"""
+Benchmark the analysis pipeline on synthetic data at multiples of the published size.
+
+For each scale (multiple of the published 2000 repetitions) and country, synthetic datasets are
+generated (see synthetic_data.py) within a working folder and the following stages are timed and
+memory-profiled:
+
+* read_csv_cold : parse the simulation output CSV and build its binary cache (data_cache.py)
+* read_csv_cached : read the simulation output from the binary cache
+* tensor : convert the simulation output to a SimulationTensor
+* bootstrap : bootstrap counts of the optimal control for every cell (bootstrap.py, one process)
+* ranking : rank controls by their mean and median total culls (ranking.py)
+* risk : risk of onward transmission for every parameter draw (risk_engine.py)
+* render_three_panel : render the three-panel plot (plot_three_panel_plot.py)
+* render_risk : render the risk of onward transmission plot (plot_risk_measure_individual.py)
+
+Wall time, CPU time and the peak of memory allocated during each stage (traced using
+tracemalloc) are written as JSON, along with the number of rows of simulation output (rows) and
+details of the platform and package versions, so that results can be tracked over time.  The
+output is rewritten as each stage finishes; a stage that fails is recorded with its error (and
+the remaining stages are still run).  Scripts read from and write to the `data` and `graphics`
+folders of the working directory, so stages are run from within the working folder.
+
+Usage:
+
+python benchmark.py [--scales 1 10 100] [--countries uk japan] [--stages ...] [--nboot <n>] [--workdir <folder>] [--output <file>]
+
+
+Parameters
+----------
+--scales : list of floats (default "1 10 100")
+    Multiples of the published number of repetitions
+
+--countries : list of str (default "uk")
+    Countries for which to benchmark the pipeline
+
+--stages : list of str
+    Stages to run (default is all stages in STAGES)
+
+--nboot : int (default 1000)
+    Number of bootstrap samples per week and parameter set
+
+--workdir : str
+    Folder in which to generate data and figures (default is a temporary folder, removed after
+    the benchmark)
+
+--output : str (default "benchmark.json")
+    Output JSON file
+"""
+
+import os, sys, time, json, shutil, platform, tempfile, argparse, tracemalloc, traceback
+from os.path import join, abspath
+from datetime import datetime
+import numpy as np, pandas as pd
+
+import synthetic_data
+from data_cache import read_csv, clear_cache
+from simulation_tensor import SimulationTensor, CTRL_ORDER, tie_order
+from bootstrap import objective_counts, cell_rng
+from ranking import rank_table
+from risk_engine import risk_by_week
+
+# Stages of the pipeline, in the order in which they are run
+STAGES = ['read_csv_cold', 'read_csv_cached', 'tensor', 'bootstrap', 'ranking', 'risk',
+    'render_three_panel', 'render_risk']
+
+
+def measure(func, *args, **kwargs):
+    """
+    Run a function, measuring wall time, CPU time and peak traced memory.
+    
+    Returns
+    -------
+    (object, dict)
+        Value returned by `func` and the measurements (wall_s, cpu_s, peak_mb)
+    """
+    tracemalloc.reset_peak()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    start_wall = time.perf_counter(); start_cpu = time.process_time()
+    
+    value = func(*args, **kwargs)
+    
+    wall = time.perf_counter() - start_wall; cpu = time.process_time() - start_cpu
+    peak = tracemalloc.get_traced_memory()[1] - start_memory
+    
+    return value, {'wall_s': wall, 'cpu_s': cpu, 'peak_mb': peak/2.**20}
+
+
+def bootstrap_all(tensor, nboot):
+    """
+    Bootstrap counts of the optimal control for every (parameter set, week) cell of a tensor.
+    """
+    output = []
+    for ip in range(len(tensor.params_used)):
+        for iw, w in enumerate(tensor.weeks):
+            nreps = tensor.nreps[ip, iw]
+            present = (nreps > 0)
+            if present.any():
+                output.append(objective_counts(tensor.values[ip, iw][present], nboot,
+                    nreps = nreps[present], rng = cell_rng(100, ip, w),
+                    order = tie_order(np.array(tensor.controls)[present])))
+    return output
+
+
+def render(module_name, argv, **datasets):
+    """
+    Render a figure using the plot() function of a plotting script.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+    import importlib
+    
+    module = importlib.import_module(module_name)
+    module.plot(module.make_parser().parse_args(argv), **datasets)
+    plt.close('all')
+
+
+def write_results(filename, results, nboot):
+    """
+    Write the measurements made so far (and the details of the platform) as JSON.
+    """
+    with open(filename, 'w') as f:
+        json.dump({'metadata': metadata(), 'nboot': nboot, 'results': results}, f, indent = 2)
+
+
+def run(scale, country, stages = STAGES, nboot = 1000, results = None, output = None):
+    """
+    Generate synthetic data and benchmark each stage (from within the working folder).
+    
+    Measurements are appended to `results` and, if `output` is given, written to this JSON file
+    as each stage finishes.  A stage that raises an error is recorded with the error instead of
+    measurements.  
+    
+    Returns
+    -------
+    list of dicts
+        Measurements of each stage
+    """
+    sys.stdout.write("Scale " + str(scale) + ", " + country + ": generating data\n")
+    filenames = synthetic_data.generate(country, join('.', 'data'), scale = scale)
+    
+    rows = int(round(scale*synthetic_data.REPS))*len(CTRL_ORDER[country])* \
+        len(synthetic_data.WEEKS[country])*2
+    
+    weeks = synthetic_data.WEEKS[country]
+    plot_weeks = [str(w) for w in weeks[:5] + weeks[-1:]]
+    
+    if results is None:
+        results = []
+    
+    def record(stage, func, *args, **kwargs):
+        if stage not in stages:
+            return None
+        sys.stdout.write("Scale " + str(scale) + ", " + country + ": " + stage + "\n")
+        
+        try:
+            value, m = measure(func, *args, **kwargs)
+        except Exception as e:
+            sys.stdout.write("Scale " + str(scale) + ", " + country + ": " + stage + 
+                " failed\n" + traceback.format_exc())
+            value, m = None, {'error': type(e).__name__ + ": " + str(e)}
+        
+        m.update({'scale': scale, 'country': country, 'stage': stage, 'rows': rows})
+        results.append(m)
+        
+        if output is not None:
+            write_results(output, results, nboot)
+        return value
+    
+    simfile = filenames['simulation_output']
+    clear_cache(simfile)
+    
+    record('read_csv_cold', read_csv, simfile)
+    full = record('read_csv_cached', read_csv, simfile)
+    if full is None:
+        full = read_csv(simfile)
+    
+    tensor = record('tensor', SimulationTensor.from_frame, full, CTRL_ORDER[country])
+    if tensor is None:
+        tensor = SimulationTensor.from_frame(full, CTRL_ORDER[country])
+    
+    record('bootstrap', bootstrap_all, tensor, nboot)
+    record('ranking', rank_table, tensor, ['mean', 'median'])
+    
+    params = read_csv(filenames['parameters'])
+    record('risk', risk_by_week, params, (country == 'japan'))
+    
+    counts_full = read_csv(filenames['counts'])
+    record('render_three_panel', render, 'plot_three_panel_plot',
+        ['--country', country, '--filetype', '.png', '--outfilename', 'benchmark_three_panel',
+        '--weeks'] + plot_weeks, full = full, counts_full = counts_full)
+    record('render_risk', render, 'plot_risk_measure_individual',
+        ['--country', country, '--filetype', '.png', '--outfilename', 'benchmark_risk',
+        '--weeks'] + plot_weeks, df_params = params)
+    
+    return results
+
+
+def metadata():
+    """
+    Details of the platform and package versions of the benchmark.
+    """
+    import matplotlib
+    
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'matplotlib': matplotlib.__version__
+    }
+
+
+if __name__ == "__main__":
+    
+    # Process the input argument
+    parser = argparse.ArgumentParser()
+    
+    parser.add_argument("--scales", nargs = '+', type = float, default = [1, 10, 100],
+        help = "Multiples of the published number of repetitions")
+    
+    parser.add_argument("-c", "--countries", nargs = '+', type = str, default = ['uk'],
+        help = "Countries of interest ('uk' and/or 'japan')")
+    
+    parser.add_argument("--stages", nargs = '+', type = str, default = STAGES,
+        choices = STAGES, help = "Stages to benchmark")
+    
+    parser.add_argument("--nboot", type = int, default = 1000,
+        help = "Number of bootstrap samples")
+    
+    parser.add_argument("--workdir", type = str, default = None,
+        help = "Folder in which to generate data and figures (default is a temporary folder)")
+    
+    parser.add_argument("--output", type = str, default = "benchmark.json",
+        help = "Output JSON file")
+    
+    args = parser.parse_args()
+    
+    output = abspath(args.output)
+    cwd = os.getcwd()
+    
+    workdir = tempfile.mkdtemp() if args.workdir is None else args.workdir
+    for folder in ['data', 'graphics']:
+        if not os.path.exists(join(workdir, folder)):
+            os.makedirs(join(workdir, folder))
+    
+    tracemalloc.start()
+    
+    results = []
+    try:
+        os.chdir(workdir)
+        for scale in args.scales:
+            for country in args.countries:
+                run(scale, country, args.stages, args.nboot, results, output)
+    finally:
+        os.chdir(cwd)
+        tracemalloc.stop()
+        if args.workdir is None:
+            shutil.rmtree(workdir)
+    
+    write_results(output, results, args.nboot)
+    
+    sys.stdout.write("Results written to: " + output + "\n")
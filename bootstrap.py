@@ -1,15 +1,540 @@
 """
+Bootstrap the number of times each control intervention is optimal.  
 
+For each week and each parameter set ('final' or 'accrued'), one simulation is drawn at random 
+(with replacement) from each control intervention and the control with the fewest total culls 
+is recorded as optimal.  Ties are won by the first tied control in alphabetical order (see 
+simulation_tensor.tie_order; the simulations of each cell were sorted by control before taking 
+idxmin), so counts of each cell sum to the number of bootstrap samples.  Resampling is 
+performed in batches of (batchsize x number of controls) index matrices so that memory use stays 
+bounded for large numbers of bootstrap samples.  
+
+Each (parameter set, week) cell draws from its own random stream, spawned from the random seed 
+and keyed on the cell, so that output does not depend on the order in which cells are processed 
+or on the number of worker processes.  
+
+With --exact, no resampling is performed: the probability that each control is optimal when one 
+simulation is drawn from each control is calculated exactly from the empirical distributions of 
+total culls and --nboot times this probability is output as the counts.  Ties are won by the 
+first tied control as when resampling, so exact counts are the expected resampled counts and sum 
+to --nboot.  
+
+With --tolerance, resampling is sequential: each cell draws batches of --nboot bootstrap samples 
+until the Monte Carlo standard error of the proportion of samples in which each control is 
+optimal, sqrt(p(1 - p)/nboot), is below the tolerance for every control, or until --maxboot 
+samples have been drawn.  Cells with a clearly optimal control therefore stop early and cells 
+with close contests draw more samples.  The number of bootstrap samples drawn (nboot) and the 
+largest standard error across controls (se) of each cell are written to the output.  
+
+With --objectives, several objectives are evaluated from the same resampled index matrix, each 
+bootstrap sample drawing --ndraws simulations from each control: 'single' (the minimum of one 
+draw, as above), 'mean', 'median' and 'q95' of the draws of each control, and 'cvar' (the mean 
+of the largest 10% of the draws).  Each additional objective costs only its reduction of the 
+draws.  The first draw of each control comes from the random stream of the cell and the 
+other draws from a stream seeded from it, so 'single' counts do not depend on the other 
+objectives or on --ndraws.  Counts for all objectives are output in long format with an 
+`objective` column.  
+
+The bootstrap also records the full distribution of ranks of each control (rank 1 has the 
+fewest total culls, tied controls are ranked in alphabetical order, so the count of rank 1 is 
+the number of times the control is optimal).  Rank counts are saved as a (params_used x week x objective x 
+control x rank) array of small unsigned integers in `data/rank_counts_<country>.npz` (rank 
+counts are not calculated with --exact, in which case the file of any earlier run is removed).  
+
+Each cell is appended to the output as soon as it finishes and recorded in a checkpoint manifest 
+(`data/.cache/bootstrap_<country>/manifest.json`, with the random seed and the number of 
+bootstrap samples of the cell, and the rank counts of the cell alongside it).  With --resume, an 
+interrupted run continues from the cells recorded in the checkpoint (if the settings and the 
+simulation output are unchanged).  As each cell has its own random stream, the output of a 
+resumed run is identical to that of an uninterrupted run.  
+
+Usage:
+
+python bootstrap.py --country <country> [--randomseed <seed>] [--nboot <nboot>] [--batchsize <size>] [--workers <n>] [--exact] [--tolerance <tol>] [--maxboot <n>] [--objectives single mean ...] [--ndraws <k>] [--resume] [--profile [<trace file>]]
+
+
+Parameters
+----------
+--country : str ("japan" or "uk")
 
 --randomseed : int  (default 100)
     Random seed for the bootstrap test
 
+--nboot : int (default 1000)
+    Number of bootstrap samples per week and parameter set (per batch with --tolerance)
+
+--batchsize : int (default 10000)
+    Maximum number of bootstrap samples drawn at once
+
+--workers : int (default 1)
+    Number of worker processes over which to distribute the (parameter set, week) cells
+
+--exact : flag
+    Calculate the exact probability that each control is optimal instead of resampling
+
+--tolerance : float (default None)
+    Resample each cell until the standard error of every proportion is below this tolerance
+
+--maxboot : int (default 100000)
+    Maximum number of bootstrap samples per week and parameter set with --tolerance
+
+--objectives : list of str (default "single")
+    Objectives for choosing the optimal control in each bootstrap sample (see OBJECTIVES)
+
+--ndraws : int (default 20)
+    Number of simulations drawn from each control per bootstrap sample (for objectives other 
+    than 'single')
+
+--resume : flag
+    Resume an interrupted run from its checkpoint, skipping the cells that have finished
+
+--profile : str (optional)
+    Append timings of each stage to a JSON trace file (default profile.jsonl, see profiling.py)
+
 """
 
-import sys, argparse
-from os.path import join
+import os, sys, json, shutil, argparse
+from os.path import join, exists
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np, pandas as pd
 
+import profiling
+from data_cache import CACHE_FOLDER, fingerprint
+from simulation_tensor import SimulationTensor, CTRL_ORDER, tie_order
+from statistics_store import CVAR_ALPHA, tail_size
+
+# Simulation output shared with worker processes (set in each worker by _init_worker)
+_shared = {}
+
+# Columns of the output (counts_<country>.csv)
+COLUMNS = ['week', 'params_used', 'objective', 'control', 'counts', 'nboot', 'se']
+
+# Settings that must match for a run to be resumed from a checkpoint
+CHECKPOINT_SETTINGS = ['randomseed', 'nboot', 'batchsize', 'exact', 'tolerance', 'maxboot', 
+    'objectives', 'ndraws']
+
+
+def _cvar(draws, alpha = CVAR_ALPHA):
+    """
+    Mean of the largest (1 - alpha) fraction of draws (at least one) along the final axis
+    """
+    k = draws.shape[-1]
+    m = int(tail_size(alpha, k))
+    return np.partition(draws, k - m, axis = -1)[..., (k - m):].mean(axis = -1)
+
+
+# Objectives for choosing the optimal control from k draws of each control (along the final 
+# axis); the control with the smallest value is optimal
+OBJECTIVES = {
+    'single': lambda x: x[..., 0],
+    'mean': lambda x: x.mean(axis = -1),
+    'median': lambda x: np.median(x, axis = -1),
+    'q95': lambda x: np.percentile(x, 95, axis = -1),
+    'cvar': _cvar
+}
+
+
+def objective_counts(samples, nboot, objectives = ['single'], ndraws = 1, nreps = None, 
+        batchsize = 10000, rng = None, rank_counts = None, order = None):
+    """
+    Count the number of bootstrap samples in which each control is optimal under several 
+    objectives, all evaluated from the same resampled index matrix.  
+    
+    Each bootstrap sample draws `ndraws` simulations (with replacement) from each control.  Each 
+    objective reduces the draws of each control to one value (i.e. the mean of the draws) and 
+    the control with the smallest value is optimal (the first of any tied controls in `order`, 
+    so that exactly one control is optimal in each bootstrap sample).  The 'single' objective uses the 
+    first draw only (the minimum of one draw from each control).  
+    
+    The first draw of each control is taken from `rng` and the other draws from a generator 
+    seeded from `rng`, so that the 'single' counts are the same whichever other objectives are 
+    evaluated and whatever the number of draws.  
+    
+    Parameters
+    ----------
+    samples : 2D numpy array
+        Simulation output with one row per control (i.e. a cell of a SimulationTensor)
+    
+    nboot : int
+        Number of bootstrap samples
+    
+    objectives : list of str
+        Names of the objectives (in OBJECTIVES)
+    
+    ndraws : int
+        Number of simulations drawn from each control in each bootstrap sample
+    
+    nreps : 1D numpy array of ints
+        Number of simulations of each control, in the first columns of `samples` (default is 
+        all columns)
+    
+    batchsize : int
+        Maximum number of bootstrap samples drawn at once
+    
+    rng : numpy.random.Generator
+        Random number generator used for resampling (default is a freshly seeded generator)
+    
+    rank_counts : 3D numpy array of ints
+        If given, the number of bootstrap samples in which each control (second axis) has each 
+        rank (final axis; rank 1 is the smallest value, tied controls are ranked in `order`) 
+        under each objective (first axis) is added to this array
+    
+    order : 1D numpy array of ints
+        Position of each control in the order in which ties are won (i.e. from 
+        simulation_tensor.tie_order; default is the order of the rows of `samples`)
+    
+    Returns
+    -------
+    2D numpy array of ints
+        Number of bootstrap samples in which each control (column) was optimal under each 
+        objective (row); each row sums to `nboot`
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    
+    # Generator of the second and later draws (seeded whether or not they are needed)
+    draws_rng = np.random.default_rng(rng.integers(0, 2**63, size = 2))
+    
+    n_controls = samples.shape[0]
+    if nreps is None:
+        nreps = np.full(n_controls, samples.shape[1])
+    
+    if order is None:
+        order = np.arange(n_controls)
+    order = np.asarray(order)
+    
+    # Controls in the order in which ties are won, and which controls win ties with each other
+    winners = np.argsort(order)
+    earlier = (order[None, :] < order[:, None])
+    
+    controls = np.arange(n_controls)[:, None]
+    counts = np.zeros((len(objectives), n_controls), dtype = int)
+    
+    for start in range(0, nboot, batchsize):
+        size = min(batchsize, nboot - start)
+        
+        # Index matrix of (size x number of controls x ndraws) draws
+        rows = rng.integers(0, nreps, size = (size, n_controls))[:, :, None]
+        if ndraws > 1:
+            rows = np.concatenate([rows, draws_rng.integers(0, nreps[:, None], 
+                size = (size, n_controls, ndraws - 1))], axis = 2)
+        
+        draws = samples[controls, rows]
+        
+        for io, objective in enumerate(objectives):
+            value = OBJECTIVES[objective](draws)
+            
+            # There may be ties, in which case the first tied control (in `order`) is optimal
+            counts[io] += np.bincount(winners[value[:, winners].argmin(axis = 1)], 
+                minlength = n_controls)
+            
+            if rank_counts is not None:
+                # Rank of each control is one more than the number of smaller values and of 
+                # equal values of earlier controls
+                ranks = (value[:, None, :] < value[:, :, None]).sum(axis = 2) + \
+                    ((value[:, None, :] == value[:, :, None]) & earlier).sum(axis = 2)
+                rank_counts[io] += np.bincount((controls.T*n_controls + ranks).ravel(), 
+                    minlength = n_controls**2).reshape(n_controls, n_controls)
+    
+    return counts
+
+
+def optimal_counts(samples, nboot, nreps = None, batchsize = 10000, rng = None, order = None):
+    """
+    Count the number of bootstrap samples in which each control is optimal when one 
+    simulation is drawn from each control (see objective_counts).  
+    
+    Returns
+    -------
+    1D numpy array of ints
+        Number of bootstrap samples in which each control was optimal (the first of any tied 
+        controls)
+    """
+    return objective_counts(samples, nboot, nreps = nreps, batchsize = batchsize, rng = rng, 
+        order = order)[0]
+
+
+def standard_error(counts, nboot):
+    """
+    Monte Carlo standard error of the proportion of bootstrap samples in which each control is 
+    optimal.  
+    """
+    p = counts/float(nboot)
+    return np.sqrt(p*(1. - p)/nboot)
+
+
+def adaptive_optimal_counts(samples, tolerance, nboot = 1000, maxboot = 100000, 
+        objectives = ['single'], ndraws = 1, nreps = None, batchsize = 10000, rng = None, 
+        rank_counts = None, order = None):
+    """
+    Sequentially count the number of bootstrap samples in which each control is optimal.  
+    
+    Batches of `nboot` bootstrap samples are drawn until the standard error of the proportion 
+    of samples in which each control is optimal is below `tolerance` for every control and 
+    objective, or until `maxboot` samples have been drawn.  
+    
+    Parameters
+    ----------
+    samples, objectives, ndraws, nreps, batchsize, rng, rank_counts, order : 
+        As for objective_counts
+    
+    tolerance : float
+        Target standard error of the proportion of samples in which each control is optimal
+    
+    nboot : int
+        Number of bootstrap samples per batch
+    
+    maxboot : int
+        Maximum number of bootstrap samples
+    
+    Returns
+    -------
+    (2D numpy array of ints, int)
+        Number of bootstrap samples in which each control had the minimum value under each 
+        objective (see objective_counts) and the total number of bootstrap samples drawn
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    
+    counts = np.zeros((len(objectives), samples.shape[0]), dtype = int)
+    total = 0
+    
+    while total < maxboot:
+        size = min(nboot, maxboot - total)
+        counts += objective_counts(samples, size, objectives, ndraws, nreps, 
+            batchsize = batchsize, rng = rng, rank_counts = rank_counts, order = order)
+        total += size
+        
+        if np.all(standard_error(counts, total) < tolerance):
+            break
+    
+    return counts, total
+
+
+def exact_optimal_probabilities(samples, nreps = None, order = None):
+    """
+    Exact probability that each control is optimal when one value is drawn from each control.  
+    
+    For each distinct value v across all controls, the probability that control i draws v, all 
+    earlier controls (in `order`) draw more than v and all later controls draw at least v is 
+    accumulated (ties are won by the first tied control, as in objective_counts).  If control j draws more 
+    than v with probability g_j and at least v with probability g_j + p_j, then the probability 
+    at v is p_i prod_{j < i} g_j prod_{j > i} (g_j + p_j), calculated for all controls from 
+    prefix and suffix products.  Cost is dominated by sorting the values of each control.  
+    
+    Parameters
+    ----------
+    samples : 2D numpy array
+        Simulation output with one row per control (i.e. a cell of a SimulationTensor)
+    
+    nreps : 1D numpy array of ints
+        Number of simulations of each control, in the first columns of `samples` (default is 
+        all columns)
+    
+    order : 1D numpy array of ints
+        Position of each control in the order in which ties are won (default is the order of 
+        the rows of `samples`)
+    
+    Returns
+    -------
+    1D numpy array of floats
+        Probability that each control is optimal (sums to 1)
+    """
+    n_controls = samples.shape[0]
+    if nreps is None:
+        nreps = np.full(n_controls, samples.shape[1])
+    
+    # Controls in the order in which ties are won
+    winners = np.arange(n_controls) if order is None else np.argsort(order)
+    samples = [np.sort(samples[i][:nreps[i]]) for i in winners]
+    
+    support = np.unique(np.concatenate(samples))
+    
+    # Probability that each control is equal to (p) or greater than (g) each support value
+    p = np.empty((len(support), n_controls))
+    g = np.empty((len(support), n_controls))
+    for j, x in enumerate(samples):
+        left = np.searchsorted(x, support, side = 'left')
+        right = np.searchsorted(x, support, side = 'right')
+        p[:, j] = (right - left)/len(x)
+        g[:, j] = (len(x) - right)/len(x)
+    
+    # Products over the earlier controls (greater than v) and the later controls (at least v)
+    ones = np.ones((len(support), 1))
+    prefix = np.cumprod(np.concatenate([ones, g[:, :-1]], axis = 1), axis = 1)
+    suffix = np.cumprod(np.concatenate([ones, (g + p)[:, :0:-1]], axis = 1), axis = 1)[:, ::-1]
+    
+    probabilities = np.empty(n_controls)
+    probabilities[winners] = (p*prefix*suffix).sum(axis = 0)
+    return probabilities
+
+
+def rank_counts_filename(country, datadir = join('.', 'data')):
+    return join(datadir, 'rank_counts_' + country + '.npz')
+
+
+def save_rank_counts(filename, rank_counts, params_used, weeks, objectives, controls):
+    """
+    Save rank counts using the smallest unsigned integer type that holds them.  
+    """
+    dtype = np.uint16 if rank_counts.max(initial = 0) <= np.iinfo(np.uint16).max else np.uint32
+    
+    np.savez_compressed(filename, rank_counts = rank_counts.astype(dtype), 
+        params_used = np.array(params_used), weeks = np.array(weeks), 
+        objectives = np.array(objectives), controls = np.array(controls))
+
+
+def load_rank_counts(country, datadir = join('.', 'data')):
+    """
+    Load the bootstrap rank counts of a country.  
+    
+    Returns
+    -------
+    dict
+        `rank_counts` (params_used x week x objective x control x rank array) and the labels of 
+        its axes (`params_used`, `weeks`, `objectives`, `controls`)
+    """
+    with np.load(rank_counts_filename(country, datadir)) as data:
+        return dict((k, data[k]) for k in data.files)
+
+
+def rank_intervals(rank_counts, level = 0.95):
+    """
+    Equal-tailed interval of the bootstrap rank distribution of each control.  
+    
+    Parameters
+    ----------
+    rank_counts : numpy array of ints
+        Number of bootstrap samples with each rank (final axis)
+    
+    level : float
+        Coverage of the interval
+    
+    Returns
+    -------
+    (numpy array of ints, numpy array of ints)
+        Lower and upper ranks (rank 1 is the fewest total culls) with the shape of 
+        `rank_counts` excluding the final axis (0 where there are no bootstrap samples)
+    """
+    total = rank_counts.sum(axis = -1, keepdims = True)
+    cdf = np.cumsum(rank_counts, axis = -1)/np.maximum(total, 1)
+    
+    lower = (cdf < (1. - level)/2.).sum(axis = -1) + 1
+    upper = (cdf < 1. - (1. - level)/2.).sum(axis = -1) + 1
+    
+    empty = (total[..., 0] == 0)
+    return np.where(empty, 0, lower), np.where(empty, 0, upper)
+
+
+def cell_rng(randomseed, ip, week):
+    """
+    Random number generator for one (parameter set, week) cell of the bootstrap.  
+    
+    The stream is a child of `randomseed` keyed on the parameter set index and week, so it is 
+    the same whichever process runs the cell and whichever other cells are run.  
+    """
+    return np.random.default_rng(np.random.SeedSequence(randomseed, spawn_key = (ip, int(week))))
+
+
+def counts_filename(country, datadir = join('.', 'data')):
+    return join(datadir, 'counts_' + country + '.csv')
+
+
+def checkpoint_path(country, datadir = join('.', 'data')):
+    """
+    Folder of the checkpoint (manifest and rank counts of finished cells) of a bootstrap run.  
+    """
+    return join(datadir, CACHE_FOLDER, 'bootstrap_' + country)
+
+
+def read_checkpoint(path):
+    try:
+        with open(join(path, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_checkpoint(path, manifest):
+    """
+    Atomically write the manifest of a checkpoint.  
+    """
+    tmp = join(path, 'manifest.json.' + str(os.getpid()))
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent = 1)
+    os.replace(tmp, join(path, 'manifest.json'))
+
+
+def cell_ranks_filename(path, params_used, week):
+    return join(path, 'rank_counts_' + params_used + '_' + str(int(week)) + '.npy')
+
+
+def cell_counts(par, w, present, result, nboot, objectives, controls, exact = False):
+    """
+    Output rows (COLUMNS) of one (parameter set, week) cell from the counts of each objective.  
+    """
+    rows = []
+    for objective, res in zip(objectives, result):
+        
+        counts = np.zeros(len(controls), dtype = res.dtype)
+        counts[present] = res
+        
+        # Standard error of the proportions (zero if calculated exactly)
+        se = 0. if exact else standard_error(counts, nboot).max()
+        
+        rows.append(pd.DataFrame({
+            'control': controls, 
+            'counts': counts, 
+            'week': w, 
+            'objective': objective, 
+            'params_used': par, 
+            'nboot': nboot, 
+            'se': se}))
+    
+    return pd.concat(rows)[COLUMNS]
+
+
+def _init_worker(name, shape, dtype):
+    """
+    Attach a worker process to the shared-memory block holding the simulation tensor.  
+    """
+    from multiprocessing import shared_memory
+    
+    shm = shared_memory.SharedMemory(name = name)
+    _shared['shm'] = shm
+    _shared['values'] = np.ndarray(shape, dtype = dtype, buffer = shm.buf)
+
+
+def _bootstrap_cell(task):
+    """
+    Bootstrap one (parameter set, week) cell using the shared simulation tensor, returning the 
+    counts (objectives x controls), the number of bootstrap samples drawn and the rank counts 
+    (objectives x controls x ranks; None if calculated exactly).  
+    """
+    ip, iw, week, present, nreps, order, nboot, batchsize, randomseed, exact, tolerance, \
+        maxboot, objectives, ndraws = task
+    
+    samples = _shared['values'][ip, iw][present]
+    
+    if exact:
+        return nboot*exact_optimal_probabilities(samples, nreps, order)[None, :], nboot, None
+    
+    rng = cell_rng(randomseed, ip, week)
+    
+    n_controls = samples.shape[0]
+    rank_counts = np.zeros((len(objectives), n_controls, n_controls), dtype = int)
+    
+    if tolerance is not None:
+        counts, nboot = adaptive_optimal_counts(samples, tolerance, nboot, maxboot, objectives, 
+            ndraws, nreps, batchsize = batchsize, rng = rng, rank_counts = rank_counts, 
+            order = order)
+    else:
+        counts = objective_counts(samples, nboot, objectives, ndraws, nreps, 
+            batchsize = batchsize, rng = rng, rank_counts = rank_counts, order = order)
+    
+    return counts, nboot, rank_counts
+
+
 if __name__ == "__main__":
     
     
@@ -25,91 +550,201 @@ if __name__ == "__main__":
     parser.add_argument("--nboot", type = int, 
         help = "Number of bootstrap samples", default = 1000)
     
+    parser.add_argument("--batchsize", type = int, 
+        help = "Maximum number of bootstrap samples drawn at once", default = 10000)
+    
+    parser.add_argument("--workers", type = int, 
+        help = "Number of worker processes", default = 1)
+    
+    parser.add_argument("--exact", action = "store_true", 
+        help = "Calculate the exact probability that each control is optimal")
+    
+    parser.add_argument("--tolerance", type = float, 
+        help = "Target standard error of the proportion of times each control is optimal "
+        "(resampling in batches of --nboot)", default = None)
+    
+    parser.add_argument("--maxboot", type = int, 
+        help = "Maximum number of bootstrap samples with --tolerance", default = 100000)
+    
+    parser.add_argument("--objectives", nargs = '+', type = str, default = ['single'], 
+        choices = sorted(OBJECTIVES.keys()), 
+        help = "Objectives for choosing the optimal control in each bootstrap sample")
+    
+    parser.add_argument("--ndraws", type = int, 
+        help = "Number of simulations drawn from each control per bootstrap sample "
+        "(for objectives other than 'single')", default = 20)
+    
+    parser.add_argument("--resume", action = "store_true", 
+        help = "Resume an interrupted run, skipping the cells recorded in its checkpoint")
+    
+    profiling.add_profile_argument(parser)
+    
     args = parser.parse_args()
     
-    # Define the parameters for the bootstrapping
+    profiling.enable(args.profile)
+    
+    if args.exact and (args.objectives != ['single']):
+        parser.error("--exact is only available for the 'single' objective")
     
-    np.random.seed(args.randomseed)
+    # Only one draw per control is needed for the 'single' objective
+    ndraws = args.ndraws if any(o != 'single' for o in args.objectives) else 1
     
-    if args.country == "uk":
-        ctrl_order = ['ip', 'ipdc', 'ipdccp', 'rc3', 'rc10', 'v3', 'v10']
-    else: 
-        ctrl_order = ['ip', 'ipdc', 'rc3', 'rc10', 'v3', 'v10']
+    ctrl_order = CTRL_ORDER[args.country]
     
     # Calculate number of interventions
     n = len(ctrl_order)
     
-    # Import the dataset
-    full = pd.read_csv(join('.', 'data', 'simulation_output_' + args.country + '.csv'))
+    var = 'total_culls'
+    
+    # Import the dataset as a (params_used x week x control x rep) tensor
+    with profiling.stage('load'):
+        tensor = SimulationTensor.load(args.country, var = var)
+    
+    output_file = counts_filename(args.country)
+    path = checkpoint_path(args.country)
+    
+    settings = dict((k, getattr(args, k)) for k in CHECKPOINT_SETTINGS)
+    settings['ndraws'] = ndraws
+    sha1 = fingerprint(join('.', 'data', 'simulation_output_' + args.country + '.csv'))
     
-    for ip, par in enumerate(['final', 'accrued']):
-        sys.stdout.write("Generating boostrap samples from " + par + " parameters\n")
+    # Cells finished by a previous run with the same settings and simulation output
+    manifest = read_checkpoint(path) if args.resume else None
+    if args.resume and (manifest is None or not exists(output_file)):
+        sys.stdout.write("No checkpoint found, starting from the first cell\n")
+        manifest = None
+    
+    if manifest is not None:
+        if (manifest.get('settings') != settings) or (manifest.get('sha1') != sha1):
+            parser.error("settings or simulation output differ from those of the checkpoint "
+                "in " + path + " (run without --resume to start again)")
+        
+        sys.stdout.write("Resuming from " + str(len(manifest['cells'])) + " finished cells\n")
+        
+        # Discard any output of a cell that was not recorded as finished
+        with open(output_file, 'r+') as f:
+            f.truncate(manifest['size'])
+    else:
+        shutil.rmtree(path, ignore_errors = True)
+        os.makedirs(path)
         
-        # Subset the dataset to the parameter set and control 
-        full_all = full.loc[(full.params_used == par) & (full.control.isin(ctrl_order))]
+        with open(output_file, 'w') as f:
+            f.write(",".join(COLUMNS) + "\n")
         
-        for iv, var in enumerate(['total_culls']):
+        manifest = {'settings': settings, 'sha1': sha1, 'cells': [], 
+            'size': os.path.getsize(output_file)}
+        write_checkpoint(path, manifest)
+    
+    finished = set((c['params_used'], c['week']) for c in manifest['cells'])
+    
+    # Define the cells to be bootstrapped
+    cells = []; tasks = []
+    for ip, par in enumerate(tensor.params_used):
+        for iw, w in enumerate(tensor.weeks):
             
-            model_results = []
+            nreps = tensor.nreps[ip, iw]
+            present = (nreps > 0)
             
-            for w in full_all.week.unique():
-                optimal = []
-                sub = full_all.loc[full_all.week == w]
-                
-                n_controls = len(sub.control.unique())
-                if n_controls != n:
-                     sys.stdout.write("Not same number of controls in the data as expected\n")
-                
-                n_runs = sub.shape[0]/n_controls
+            if not present.any():
+                continue
+            
+            if present.sum() != n:
+                sys.stdout.write("Not same number of controls in the data as expected\n")
+            
+            if (par, int(w)) in finished:
+                continue
+            
+            cells.append((par, w, present))
+            tasks.append((ip, iw, w, present, nreps[present], 
+                tie_order(np.array(ctrl_order)[present]), args.nboot, args.batchsize, 
+                args.randomseed, args.exact, args.tolerance, args.maxboot, args.objectives, ndraws))
+    
+    values = np.ascontiguousarray(tensor.values)
+    
+    # Copy the simulation tensor into shared memory (read by the workers without pickling; 
+    # imported here as modules importing the functions of this script do not need it)
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(create = True, size = max(values.nbytes, 1))
+    shared_values = np.ndarray(values.shape, dtype = values.dtype, buffer = shm.buf)
+    shared_values[:] = values
+    
+    compute = profiling.stage('compute', unit = 'bootstrap samples').start()
+    total = 0; pool = None
+    try:
+        initargs = (shm.name, values.shape, values.dtype)
+        
+        # Results are returned in the order of the cells, as each cell finishes
+        if args.workers > 1:
+            sys.stdout.write("Calculating optimal controls using " + 
+                str(args.workers) + " workers\n")
+            
+            pool = ProcessPoolExecutor(max_workers = args.workers, 
+                initializer = _init_worker, initargs = initargs)
+            results = pool.map(_bootstrap_cell, tasks, 
+                chunksize = max(1, len(tasks) // (4*args.workers)))
+        else:
+            _init_worker(*initargs)
+            results = map(_bootstrap_cell, tasks)
+        
+        current = None
+        with open(output_file, 'a') as f:
+            for (par, w, present), (result, nboot, ranks) in zip(cells, results):
                 
-                shifts = (np.arange(n_controls)*n_runs).astype(int)
+                if (args.workers == 1) and (par != current):
+                    if args.exact:
+                        sys.stdout.write("Calculating exact probabilities from " + par + 
+                            " parameters\n")
+                    else:
+                        sys.stdout.write("Generating boostrap samples from " + par + 
+                            " parameters\n")
+                    current = par
                 
-                sub = sub.reset_index()
-                sub = sub.sort_values(by = 'control')
+                # Append the cell to the output, then record it as finished
+                cell_counts(par, w, present, result, nboot, args.objectives, ctrl_order, 
+                    args.exact).to_csv(f, header = False, index = False)
+                f.flush()
                 
-                for i in range(args.nboot):
-                    # Draw 5 random numbers (for each of the control actions)
-                    # between 0 and n_runs
-                    row = np.random.randint(n_runs, size = n_controls)
-                    
-                    # Add the starting row numbers.  
-                    comparison_df = sub.iloc[row + shifts]
-                    
-                    # Find the minimum
-                    imin = comparison_df[var].idxmin() # idxmin; argmin
-                    
-                    opt_df = comparison_df.loc[imin,:]
-                    
-                    if comparison_df.shape[0] != n:
-                        sys.stdout.write("Number of controls in the data not as expected")
-                    
-                    # there may be ties... so this may be a list
-                    if isinstance(opt_df.control, str):
-                        optimal.append(opt_df.control)
-                    else:
-                        optimal.extend(list(opt_df.control))
-                    
-                counts = pd.Categorical(optimal, categories = ctrl_order).value_counts()
+                if ranks is not None:
+                    np.save(cell_ranks_filename(path, par, w), ranks)
                 
-                model_results.append(optimal)
+                manifest['cells'].append({'params_used': par, 'week': int(w), 
+                    'randomseed': args.randomseed, 'nboot': int(nboot)})
+                manifest['size'] = f.tell()
+                write_checkpoint(path, manifest)
                 
-                if (w == 1) & (par == 'final'):
-                    counts_full = pd.DataFrame(counts)
-                    counts_full = counts_full.reset_index()
-                    counts_full.columns = ['control', 'counts']
-                    counts_full['week'] = w
-                    counts_full['objective'] = var
-                    counts_full['params_used'] = par
-                else:
-                    counts = pd.DataFrame(counts)
-                    counts = counts.reset_index()
-                    counts.columns = ['control', 'counts']
-                    counts['week'] = w
-                    counts['objective'] = var
-                    counts['params_used'] = par
-                    
-                    counts_full = pd.concat([counts_full, counts])
-    
-    cols2keep = ['week', 'params_used', 'control', 'counts']
-    counts_full[cols2keep].to_csv(join('.', 'data', 'counts_' + args.country + '.csv'), 
-        index = False)
+                total += nboot
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        _shared.clear()
+        del shared_values
+        shm.close()
+        shm.unlink()
+    
+    compute.stop(items = total)
+    
+    counts_full = pd.read_csv(output_file)
+    
+    if args.tolerance is not None:
+        sys.stdout.write("Bootstrap samples per cell: " + 
+            str(counts_full.nboot.min()) + " to " + str(counts_full.nboot.max()) + 
+            " (" + str(counts_full.drop_duplicates(['params_used', 'week']).nboot.sum()) + 
+            " in total)\n")
+    
+    with profiling.stage('save'):
+        if not args.exact:
+            rank_counts = np.zeros((len(tensor.params_used), len(tensor.weeks), 
+                len(args.objectives), n, n), dtype = int)
+            
+            for c in manifest['cells']:
+                ip = tensor.params_index(c['params_used']); iw = tensor.week_index(c['week'])
+                present = (tensor.nreps[ip, iw] > 0)
+                rank_counts[ip, iw][:, present, :present.sum()] = \
+                    np.load(cell_ranks_filename(path, c['params_used'], c['week']))
+            
+            save_rank_counts(rank_counts_filename(args.country), rank_counts, 
+                tensor.params_used, tensor.weeks, args.objectives, ctrl_order)
+        
+        # Rank counts are not calculated exactly, so remove those of an earlier run (which would 
+        # not match the counts)
+        elif exists(rank_counts_filename(args.country)):
+            os.remove(rank_counts_filename(args.country))
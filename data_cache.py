@@ -0,0 +1,236 @@
+"""
+Typed, columnar binary cache of the CSV files in the `data` folder.
+
+The first time a CSV file is read it is parsed with pandas and each column is saved as a numpy
+`.npy` file within a `.cache` folder next to the CSV file, along with a JSON manifest.  String
+columns (i.e. `control`, `params_used`) are stored as categoricals, `week` as a small integer,
+and other numeric columns as int32/float32.  Later reads memory-map the `.npy` files rather than
+parsing the text file.
+
+The cache is invalidated when the size or modification time of the CSV file changes and the
+SHA-1 hash of its contents no longer matches the hash recorded in the manifest.
+
+Usage:
+
+from data_cache import read_csv
+full = read_csv(join('.', 'data', 'simulation_output_uk.csv'))
+"""
+
+import os, json, hashlib, shutil
+from os.path import join, basename, dirname, exists
+import numpy as np, pandas as pd
+
+# Version of the cache layout (bump to invalidate all existing caches)
+CACHE_VERSION = 1
+
+# Name of the folder (within the folder of each CSV file) in which caches are stored
+CACHE_FOLDER = '.cache'
+
+# Columns stored as small integers
+SMALL_INT_COLUMNS = ['week']
+
+
+def file_stamp(filename):
+    """
+    Size and modification time (ns) of a file, used as a cheap check for changes to the file.
+    """
+    st = os.stat(filename)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def file_hash(filename, blocksize = 2**20):
+    """
+    SHA-1 hash of the contents of a file.
+    """
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_path(filename):
+    """
+    Folder in which the cache of a CSV file is stored.
+    """
+    return join(dirname(filename) or '.', CACHE_FOLDER, basename(filename))
+
+
+def _downcast(series, name):
+    """
+    Convert a column to the compact dtype used in the cache.
+    
+    Returns
+    -------
+    (numpy array, dict)
+        Array to store and the manifest entry describing the column
+    """
+    if not (pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series)):
+        cat = pd.Categorical(series)
+        codes = cat.codes.astype(np.int8 if len(cat.categories) < 2**7 else np.int32)
+        return codes, {'kind': 'category', 'categories': [str(c) for c in cat.categories]}
+    
+    values = series.values
+    
+    # Floats that are all whole numbers (e.g. counts written as floats) are stored as integers
+    if values.dtype.kind == 'f' and np.all(np.isfinite(values)) and \
+            np.array_equal(values, np.round(values)):
+        values = values.astype(np.int64)
+    
+    if values.dtype.kind in 'iu':
+        info = np.iinfo(np.int16 if name in SMALL_INT_COLUMNS else np.int32)
+        if (values.size == 0) or ((values.min() >= info.min) and (values.max() <= info.max)):
+            values = values.astype(info.dtype)
+    elif values.dtype.kind == 'f':
+        values = values.astype(np.float32)
+    
+    return values, {'kind': 'array'}
+
+
+def build_cache(filename):
+    """
+    Parse a CSV file and write its columnar cache.
+    
+    Returns
+    -------
+    dict
+        Manifest of the cache
+    """
+    stamp = file_stamp(filename)
+    digest = file_hash(filename)
+    
+    df = pd.read_csv(filename)
+    
+    path = cache_path(filename)
+    if not exists(path):
+        os.makedirs(path, exist_ok = True)
+    
+    columns = []
+    for i, name in enumerate(df.columns):
+        values, entry = _downcast(df[name], name)
+        
+        # File names include the hash so that an old cache is never partially overwritten, and 
+        # each file is written to a temporary name first so that other processes building the 
+        # same cache never read a partially written file
+        entry['name'] = str(name)
+        entry['file'] = digest[:12] + '_' + str(i) + '.npy'
+        tmp = join(path, entry['file'] + '.' + str(os.getpid()))
+        with open(tmp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(values))
+        os.replace(tmp, join(path, entry['file']))
+        columns.append(entry)
+    
+    manifest = {'version': CACHE_VERSION, 'source': basename(filename), 'sha1': digest,
+        'nrows': len(df), 'columns': columns}
+    manifest.update(stamp)
+    
+    _write_manifest(path, manifest)
+    _remove_stale_files(path, manifest)
+    
+    return manifest
+
+
+def _write_manifest(path, manifest):
+    """
+    Atomically write the manifest of a cache.
+    """
+    tmp = join(path, 'manifest.json.' + str(os.getpid()))
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent = 1)
+    os.replace(tmp, join(path, 'manifest.json'))
+
+
+def _remove_stale_files(path, manifest):
+    """
+    Remove column files in a cache that are not referenced by its manifest.
+    """
+    keep = set(c['file'] for c in manifest['columns'])
+    for f in os.listdir(path):
+        if f.endswith('.npy') and (f not in keep):
+            try:
+                os.remove(join(path, f))
+            except OSError:
+                pass
+
+
+def _read_manifest(path):
+    try:
+        with open(join(path, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def cached_manifest(filename):
+    """
+    Manifest of the up-to-date cache of a CSV file, building or refreshing the cache if needed.
+    """
+    path = cache_path(filename)
+    manifest = _read_manifest(path)
+    
+    if (manifest is None) or (manifest.get('version') != CACHE_VERSION):
+        return build_cache(filename)
+    
+    stamp = file_stamp(filename)
+    if all(manifest.get(k) == v for k, v in stamp.items()):
+        return manifest
+    
+    # File has been touched; only rebuild if the contents have changed
+    if file_hash(filename) != manifest['sha1']:
+        return build_cache(filename)
+    
+    manifest.update(stamp)
+    _write_manifest(path, manifest)
+    
+    return manifest
+
+
+def fingerprint(filename):
+    """
+    Fingerprint of the contents of a CSV file (SHA-1 hash as recorded in its cache).
+    """
+    return cached_manifest(filename)['sha1']
+
+
+def read_csv(filename, cache = True):
+    """
+    Read a CSV file from the data folder, using (and creating if needed) its columnar cache.
+    
+    Parameters
+    ----------
+    filename : str
+        Path to the CSV file
+    
+    cache : boolean
+        Should the cache be used?  If False the CSV file is parsed directly with pandas.
+    
+    Returns
+    -------
+    pandas.DataFrame
+        Data with categorical string columns and compact numeric columns
+    """
+    if not cache:
+        return pd.read_csv(filename)
+    
+    manifest = cached_manifest(filename)
+    path = cache_path(filename)
+    
+    data = {}
+    for entry in manifest['columns']:
+        values = np.load(join(path, entry['file']), mmap_mode = 'r')
+        
+        if entry['kind'] == 'category':
+            values = pd.Categorical.from_codes(np.asarray(values), entry['categories'])
+        
+        data[entry['name']] = values
+    
+    return pd.DataFrame(data, columns = [c['name'] for c in manifest['columns']], copy = False)
+
+
+def clear_cache(filename):
+    """
+    Remove the cache of a CSV file.
+    """
+    path = cache_path(filename)
+    if exists(path):
+        shutil.rmtree(path)
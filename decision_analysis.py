@@ -0,0 +1,259 @@
+"""
+Importable, memoized decision analysis (rankings, optimal controls, risk and value of information).
+
+Functions here wrap the calculations of ranking.py, bootstrap.py, risk_engine.py and
+value_of_information.py for use from notebooks and services.  Nothing on this path imports
+matplotlib.  Results are memoized in bounded least-recently-used caches keyed on the fingerprint
+of the input data file (the SHA-1 hash recorded by data_cache.py, which is only recalculated when
+the size or modification time of the file changes) and the arguments, so that repeated queries
+are answered without recalculation and results are recalculated when the data change.  Simulation output and parameters are also
+held in memory between calls (see TENSOR_CACHE_SIZE).
+
+Returned tables are copies, so callers may modify them without affecting the caches.
+
+Usage:
+
+import decision_analysis as da
+da.rank_controls('uk', 5, 'accrued', 'mean')           # control, value, ranking
+da.optimal_proportions('uk', 5, 'accrued')             # proportion optimal by control
+da.onward_risk('uk', weeks = [1, 2, 3])                 # week, rep, risk
+da.value_of_information('uk')                           # voi, evpi, regret by week
+da.cache_info()
+"""
+
+from os.path import join
+from functools import lru_cache
+import numpy as np, pandas as pd
+
+from data_cache import read_csv, fingerprint
+from simulation_tensor import SimulationTensor, CTRL_ORDER, tie_order
+from ranking import rank_descending
+from statistics_store import StatisticsStore, is_statistic
+from bootstrap import objective_counts, exact_optimal_probabilities, cell_rng
+from risk_engine import risk_by_week
+from value_of_information import value_of_information as _voi
+
+# Default folder of the datasets
+DATADIR = join('.', 'data')
+
+# Number of results held in each cache
+CACHE_SIZE = 256
+
+# Number of datasets (simulation tensors, parameter files) held in memory
+TENSOR_CACHE_SIZE = 4
+
+
+def data_file(name, country, datadir = DATADIR):
+    """
+    File name of a dataset of a country (i.e. data_file('simulation_output', 'uk'))
+    """
+    return join(datadir, name + '_' + country + '.csv')
+
+
+@lru_cache(maxsize = TENSOR_CACHE_SIZE)
+def _tensor(filename, key, controls):
+    return SimulationTensor.from_frame(read_csv(filename), list(controls))
+
+
+@lru_cache(maxsize = TENSOR_CACHE_SIZE)
+def _params(filename, key):
+    return read_csv(filename)
+
+
+def load_tensor(country, datadir = DATADIR):
+    """
+    Simulation tensor of a country (held in memory until the simulation output changes).
+    """
+    filename = data_file('simulation_output', country, datadir)
+    return _tensor(filename, fingerprint(filename), tuple(CTRL_ORDER[country]))
+
+
+def load_params(country, datadir = DATADIR):
+    """
+    Posterior parameter draws of a country (held in memory until the parameters file changes).
+    """
+    filename = data_file('parameters', country, datadir)
+    return _params(filename, fingerprint(filename))
+
+
+@lru_cache(maxsize = TENSOR_CACHE_SIZE)
+def _store(filename, key, controls):
+    return StatisticsStore.from_tensor(_tensor(filename, key, controls))
+
+
+@lru_cache(maxsize = CACHE_SIZE)
+def _rank_controls(filename, key, controls, week, params_used, statistic):
+    tensor = _tensor(filename, key, controls)
+    
+    value = _store(filename, key, controls).statistic(statistic)[
+        tensor.params_index(params_used), tensor.week_index(week)]
+    
+    return pd.DataFrame({'control': tensor.controls, 'value': value,
+        'ranking': rank_descending(value)})
+
+
+def rank_controls(country, week, params_used = 'accrued', statistic = 'mean',
+        datadir = DATADIR):
+    """
+    Statistic and ranking of each control for one parameter set and week.
+    
+    Parameters
+    ----------
+    country : str ('uk' or 'japan')
+    
+    week : int
+    
+    params_used : str ('final' or 'accrued')
+    
+    statistic : str
+        Statistic of total culls by which controls are ranked ('mean', 'median', 'var',
+        'q<percentile>' or 'cvar<percentile>', see statistics_store.py)
+    
+    Returns
+    -------
+    pandas.DataFrame
+        Columns `control`, `value` and `ranking` (rank 1 is the largest value, as in panel B of
+        the three-panel plots, ties are given the minimum rank)
+    """
+    if not is_statistic(statistic):
+        raise ValueError("Unknown statistic: " + str(statistic))
+    
+    filename = data_file('simulation_output', country, datadir)
+    
+    return _rank_controls(filename, fingerprint(filename), tuple(CTRL_ORDER[country]),
+        int(week), params_used, statistic).copy()
+
+
+@lru_cache(maxsize = CACHE_SIZE)
+def _optimal_proportions(filename, key, controls, week, params_used, nboot, objective, ndraws,
+        randomseed):
+    tensor = _tensor(filename, key, controls)
+    
+    nreps = tensor.cell_nreps(params_used, week)
+    present = (nreps > 0)
+    samples = tensor.cell(params_used, week)[present]
+    order = tie_order(np.array(tensor.controls)[present])
+    
+    proportions = np.zeros(len(controls))
+    if nboot is None:
+        proportions[present] = exact_optimal_probabilities(samples, nreps[present], order)
+    else:
+        rng = cell_rng(randomseed, tensor.params_index(params_used), week)
+        counts = objective_counts(samples, nboot, [objective], ndraws, nreps[present],
+            rng = rng, order = order)[0]
+        proportions[present] = counts/float(nboot)
+    
+    return pd.Series(proportions, index = pd.Index(tensor.controls, name = 'control'),
+        name = 'proportion')
+
+
+def optimal_proportions(country, week, params_used = 'accrued', nboot = None,
+        objective = 'single', ndraws = 1, randomseed = 100, datadir = DATADIR):
+    """
+    Proportion of times each control is optimal (has the fewest total culls) for one parameter
+    set and week.
+    
+    Parameters
+    ----------
+    nboot : int
+        Number of bootstrap samples (default is the exact probability, see
+        bootstrap.exact_optimal_probabilities, which is only available for the 'single'
+        objective)
+    
+    objective, ndraws : str, int
+        Objective of each bootstrap sample and number of simulations drawn from each control
+        (see bootstrap.objective_counts)
+    
+    randomseed : int
+        Random seed (resampling uses the stream of the cell, as in bootstrap.py, so proportions
+        match the counts of bootstrap.py for the same seed, nboot and ndraws)
+    
+    Returns
+    -------
+    pandas.Series
+        Proportion of bootstrap samples (or probability) in which each control is optimal
+    """
+    if (nboot is None) and (objective != 'single'):
+        raise ValueError("Exact proportions are only available for the 'single' objective")
+    
+    filename = data_file('simulation_output', country, datadir)
+    
+    return _optimal_proportions(filename, fingerprint(filename), tuple(CTRL_ORDER[country]),
+        int(week), params_used, nboot, objective, ndraws, randomseed).copy()
+
+
+@lru_cache(maxsize = CACHE_SIZE)
+def _onward_risk(filename, key, japan, weeks, integration):
+    return risk_by_week(_params(filename, key), japan,
+        weeks = (None if weeks is None else list(weeks)), integration = integration)
+
+
+def onward_risk(country, weeks = None, integration = 'grid', datadir = DATADIR):
+    """
+    Risk of onward transmission for each posterior draw (see risk_engine.py).
+    
+    Parameters
+    ----------
+    weeks : list of ints
+        Weeks for which to calculate the risk (default is all weeks)
+    
+    integration : str ("grid", "exact" or "adaptive")
+        Method used to integrate the kernel across distances
+    
+    Returns
+    -------
+    pandas.DataFrame
+        Columns `week`, `rep` and `risk`
+    """
+    filename = data_file('parameters', country, datadir)
+    
+    if weeks is not None:
+        weeks = tuple(sorted(int(w) for w in weeks))
+    
+    return _onward_risk(filename, fingerprint(filename), (country == 'japan'), weeks,
+        integration).copy()
+
+
+@lru_cache(maxsize = CACHE_SIZE)
+def _value_of_information(filename, key, controls, nboot, level, randomseed):
+    return _voi(_tensor(filename, key, controls), nboot, level,
+        rng = np.random.default_rng(randomseed))
+
+
+def value_of_information(country, nboot = 1000, level = 0.95, randomseed = 100,
+        datadir = DATADIR):
+    """
+    Value of complete information, expected value of perfect information and expected regret
+    of the accrued-optimal control for every week (see value_of_information.py).
+    
+    Returns
+    -------
+    pandas.DataFrame
+        One row per week (columns as in `value_of_information_<country>.csv`)
+    """
+    filename = data_file('simulation_output', country, datadir)
+    
+    return _value_of_information(filename, fingerprint(filename), tuple(CTRL_ORDER[country]),
+        nboot, level, randomseed).copy()
+
+
+def cache_info():
+    """
+    Hits, misses and sizes of the caches of each function
+    """
+    return {'rank_controls': _rank_controls.cache_info(),
+        'optimal_proportions': _optimal_proportions.cache_info(),
+        'onward_risk': _onward_risk.cache_info(),
+        'value_of_information': _value_of_information.cache_info(),
+        'tensor': _tensor.cache_info(),
+        'store': _store.cache_info(),
+        'params': _params.cache_info()}
+
+
+def clear_cache():
+    """
+    Empty all caches (i.e. to release memory)
+    """
+    for f in [_rank_controls, _optimal_proportions, _onward_risk, _value_of_information,
+            _tensor, _store, _params]:
+        f.cache_clear()
@@ -0,0 +1,560 @@
+"""
+Local HTTP service for real-time decisions as new weekly simulation batches arrive.
+
+The service holds the simulation output of one country in memory, one (controls x reps) array per
+(params_used, week) cell, along with the summary statistics and rankings of the controls (see
+ranking.py) and the proportion of times each control is optimal (see bootstrap.py) of every
+cell.  When a batch of new simulations is posted, only the cells of the weeks in the batch are
+updated, so that queries for the current ranking or optimal control of a week are answered from
+memory.  By default proportions are the exact probabilities that each control is optimal (as
+with `bootstrap.py --exact`); with --nboot they are bootstrapped from a random stream keyed on
+the cell (as in bootstrap.py, so they match the counts of `counts_<country>.csv` generated without
+--exact).  In both cases ties are won by the first tied control in alphabetical order (see
+simulation_tensor.tie_order), so proportions sum to 1.
+
+The service listens on localhost and has the following endpoints (all responses are JSON):
+
+* GET /health : status, country, controls and the weeks held in memory
+* POST /batch : add simulations (body {"rows": {"week": [...], "params_used": [...], "control":
+  [...], "total_culls": [...]}, "replace": false}, where rows may also be a list of records);
+  with "replace", the simulations of the cells in the batch replace those held in memory
+* GET /ranking?week=<w>&params_used=<p>&statistic=<s> : statistic and ranking of each control
+  (rank 1 is the largest statistic, as in panel B of the three-panel plots)
+* GET /optimal?week=<w>&params_used=<p> : proportion of times each control is optimal
+
+Usage:
+
+python decision_service.py --country <country> [--host <host>] [--port <port>] [--empty] [--statistics mean median ...] [--nboot <n>] [--randomseed <seed>] [--demo] [--profile [<trace file>]]
+
+curl "http://127.0.0.1:8765/ranking?week=5&params_used=accrued&statistic=mean"
+
+from decision_service import post_batch, query
+post_batch("http://127.0.0.1:8765", batch)     # batch is a pandas.DataFrame
+query("http://127.0.0.1:8765", "optimal", week = 5, params_used = "accrued")
+
+
+Parameters
+----------
+--country : str ("japan" or "uk")
+
+--host : str (default "127.0.0.1")
+    Address on which to listen
+
+--port : int (default 8765)
+    Port on which to listen
+
+--empty : flag
+    Start with no simulations (rather than the simulation output in the data folder)
+
+--statistics : list of str (default "mean median")
+    Statistics by which controls are ranked ('mean', 'median', 'var', 'q<percentile>' or 
+    'cvar<percentile>', see statistics_store.py)
+
+--nboot : int (default None)
+    Bootstrap the proportions with this many samples per cell (default is exact proportions)
+
+--randomseed : int (default 100)
+    Random seed for the bootstrap
+
+--demo : flag
+    Start the service with no simulations, post synthetic batches for each week, query the
+    ranking and optimal control of each week, report response times, and stop
+
+--profile : str (optional)
+    Append timings of each stage (loading, adding each batch and answering each query) to a JSON
+    trace file (default profile.jsonl, see profiling.py)
+"""
+
+import sys, json, time, asyncio, argparse
+from os.path import join, exists
+from urllib.parse import urlsplit, parse_qs, urlencode
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+import numpy as np, pandas as pd
+
+import profiling
+from simulation_tensor import SimulationTensor, CTRL_ORDER, PARAMS_USED, tie_order
+from ranking import rank_descending
+from statistics_store import StatisticsStore, parse_statistic, is_statistic
+from bootstrap import objective_counts, exact_optimal_probabilities, standard_error, cell_rng
+
+# Default address of the service
+HOST = '127.0.0.1'
+PORT = 8765
+
+# Columns of a batch of simulations
+BATCH_COLUMNS = ['week', 'params_used', 'control', 'total_culls']
+
+# Reasons of the HTTP status codes used by the service
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+    500: 'Internal Server Error'}
+
+
+class DecisionState(object):
+    """
+    Simulation output of one country with the rankings and optimal-control proportions of every
+    (params_used, week) cell, updated one batch at a time.
+    
+    The simulations, rankings and proportions of a cell are calculated before the cell is
+    published (replacing the entry of the cell in `cells` in one assignment), so that a cell read
+    while a batch is being added (i.e. from another thread) is either wholly old or wholly new.
+    
+    Attributes
+    ----------
+    controls : list of str
+        Controls, in the order of the rows of each cell
+    
+    cells : dict
+        (params_used, week): dict of the cell with keys `simulations` (list of 1D numpy arrays of
+        total culls, one per control), `nreps` (number of simulations of each control),
+        `rankings` (statistic: (statistic of each control, ranking of each control)) and
+        `optimal` ((proportion of times each control is optimal, number of bootstrap samples
+        (None if exact), largest standard error across controls))
+    """
+    def __init__(self, controls, statistics = ['mean', 'median'], nboot = None,
+            randomseed = 100):
+        self.controls = list(controls)
+        self.statistics = list(statistics)
+        for name in self.statistics:
+            parse_statistic(name)
+        self.nboot = nboot
+        self.randomseed = randomseed
+        
+        self.cells = {}
+    
+    @property
+    def weeks(self):
+        # Copy the keys first, as batches may be added from another thread
+        return sorted(set(w for p, w in list(self.cells)))
+    
+    @classmethod
+    def from_tensor(cls, tensor, **kwargs):
+        """
+        State holding the simulation output of a SimulationTensor.
+        """
+        state = cls(tensor.controls, **kwargs)
+        
+        for p in tensor.params_used:
+            for w in tensor.weeks:
+                nreps = tensor.cell_nreps(p, w)
+                if (nreps > 0).any():
+                    state.cells[(p, w)] = state.summarise_cell(p, w,
+                        [x[:r].copy() for x, r in zip(tensor.cell(p, w), nreps)])
+        
+        return state
+    
+    def add_batch(self, batch, replace = False):
+        """
+        Add a batch of simulations and update the cells of the batch.
+        
+        Batches must be added one at a time (i.e. DecisionService holds a lock while adding a
+        batch); cells may be queried while a batch is added.
+        
+        Parameters
+        ----------
+        batch : pandas.DataFrame
+            Simulations (columns `week`, `params_used`, `control` and `total_culls`)
+        
+        replace : boolean
+            Should the simulations of each cell in the batch replace those already held?
+        
+        Returns
+        -------
+        list of tuples
+            (params_used, week) cells that were updated
+        """
+        missing = [c for c in BATCH_COLUMNS if c not in batch.columns]
+        if missing:
+            raise ValueError("Batch is missing columns: " + ", ".join(missing))
+        
+        unknown = set(batch.control.astype(str)) - set(self.controls)
+        if unknown:
+            raise ValueError("Unknown controls: " + ", ".join(sorted(unknown)))
+        
+        unknown = set(batch.params_used.astype(str)) - set(PARAMS_USED)
+        if unknown:
+            raise ValueError("Unknown parameter sets: " + ", ".join(sorted(unknown)))
+        
+        batch = batch.assign(week = batch.week.astype(int),
+            total_culls = batch.total_culls.astype(float))
+        
+        updated = []
+        for (p, w), cell in batch.groupby(['params_used', 'week'], sort = True):
+            p = str(p); w = int(w)
+            
+            new = [cell.total_culls.values[(cell.control == c).values] for c in self.controls]
+            
+            old = self.cells.get((p, w))
+            if (not replace) and (old is not None):
+                new = [np.concatenate([x, y]) for x, y in zip(old['simulations'], new)]
+            
+            # Publish the cell once it has been summarised
+            self.cells[(p, w)] = self.summarise_cell(p, w, new)
+            updated.append((p, w))
+        
+        return updated
+    
+    def summarise_cell(self, params_used, week, simulations):
+        """
+        Rankings and optimal-control proportions of the simulations of one cell.
+        
+        Returns
+        -------
+        dict
+            Entry of the cell in `cells`
+        """
+        nreps = np.array([len(x) for x in simulations])
+        
+        # (controls x reps) array padded with NaN
+        values = np.full((len(simulations), max(nreps.max(), 1)), np.nan)
+        for i, x in enumerate(simulations):
+            values[i, :len(x)] = x
+        
+        # Simulations of each control sorted once for all statistics (controls without 
+        # simulations are NaN and are not ranked)
+        store = StatisticsStore(values, nreps)
+        rankings = {}
+        for name in self.statistics:
+            value = store.statistic(name)
+            rankings[name] = (value, rank_descending(value))
+        
+        # Optimal controls are chosen among controls with simulations
+        present = (nreps > 0)
+        order = tie_order(np.array(self.controls)[present])
+        proportions = np.zeros(len(simulations))
+        
+        if self.nboot is None:
+            proportions[present] = exact_optimal_probabilities(values[present], nreps[present],
+                order)
+            optimal = (proportions, None, 0.)
+        else:
+            counts = objective_counts(values[present], self.nboot, nreps = nreps[present],
+                rng = cell_rng(self.randomseed, PARAMS_USED.index(params_used), week),
+                order = order)[0]
+            proportions[present] = counts/float(self.nboot)
+            optimal = (proportions, self.nboot, standard_error(counts, self.nboot).max())
+        
+        return {'simulations': simulations, 'nreps': nreps, 'rankings': rankings,
+            'optimal': optimal}
+    
+    def ranking(self, week, params_used, statistic):
+        """
+        Statistic and ranking of each control in one cell.
+        """
+        cell = self.cells[(params_used, int(week))]
+        value, ranks = cell['rankings'][statistic]
+        
+        return {'week': int(week), 'params_used': params_used, 'statistic': statistic,
+            'controls': [{'control': c, 'value': _number(v), 'ranking': _number(r),
+                'nreps': int(n)} for c, v, r, n in zip(self.controls, value, ranks, cell['nreps'])]}
+    
+    def optimal_control(self, week, params_used):
+        """
+        Proportion of times each control is optimal in one cell.
+        """
+        proportions, nboot, se = self.cells[(params_used, int(week))]['optimal']
+        
+        return {'week': int(week), 'params_used': params_used, 'nboot': nboot,
+            'se': _number(se), 'optimal': self.controls[int(np.argmax(proportions))],
+            'proportions': dict((c, _number(x)) for c, x in zip(self.controls, proportions))}
+
+
+def _number(x):
+    """
+    Convert a numpy number to a JSON number (NaN as null)
+    """
+    x = float(x)
+    return None if np.isnan(x) else x
+
+
+class DecisionService(object):
+    """
+    HTTP/1.1 server (using asyncio streams) answering queries of a DecisionState.
+    
+    Batches are added in a worker thread, one at a time, so that queries are answered from the
+    cells held in memory while a batch is being added.
+    """
+    def __init__(self, state, country = None):
+        self.state = state
+        self.country = country
+        self._lock = None
+    
+    @property
+    def lock(self):
+        # Created in the running event loop (asyncio locks are bound to a loop in Python < 3.10)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+    
+    def add_batch(self, payload):
+        """
+        Add the batch of a POST /batch request (run in a worker thread).
+        
+        Returns
+        -------
+        (list of tuples, int)
+            (params_used, week) cells that were updated and the number of simulations added
+        """
+        batch = pd.DataFrame(payload['rows'])
+        return self.state.add_batch(batch, replace = payload.get('replace', False)), len(batch)
+    
+    async def route(self, method, target, body):
+        """
+        Respond to one request.
+        
+        Returns
+        -------
+        (int, dict)
+            HTTP status code and JSON response
+        """
+        url = urlsplit(target)
+        params = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+        path = url.path.rstrip('/')
+        
+        if path == '/health':
+            return 200, {'status': 'ok', 'country': self.country,
+                'controls': self.state.controls, 'weeks': self.state.weeks}
+        
+        if path == '/batch':
+            if method != 'POST':
+                return 405, {'error': "Use POST to add a batch"}
+            
+            payload = json.loads(body.decode('utf-8'))
+            start = time.perf_counter()
+            async with self.lock:
+                # Profiled in the event loop, as stages are not thread-safe (queries answered
+                # while the batch is added are recorded as nested stages)
+                with profiling.stage('add_batch', unit = 'simulations') as s:
+                    updated, s.items = await asyncio.get_running_loop().run_in_executor(None,
+                        self.add_batch, payload)
+            
+            return 200, {'updated': [{'params_used': p, 'week': w} for p, w in updated],
+                'elapsed_ms': 1000.*(time.perf_counter() - start)}
+        
+        if path in ['/ranking', '/optimal']:
+            if method != 'GET':
+                return 405, {'error': "Use GET to query " + path}
+            
+            week = int(params['week'])
+            params_used = params.get('params_used', 'accrued')
+            
+            if (params_used, week) not in self.state.cells:
+                return 404, {'error': "No simulations for week " + str(week) +
+                    " (" + params_used + ")"}
+            
+            with profiling.stage('query'):
+                if path == '/ranking':
+                    statistic = params.get('statistic', self.state.statistics[0])
+                    if statistic not in self.state.statistics:
+                        return 400, {'error': "Statistic not ranked: " + statistic}
+                    return 200, self.state.ranking(week, params_used, statistic)
+                
+                return 200, self.state.optimal_control(week, params_used)
+        
+        return 404, {'error': "Unknown path: " + url.path}
+    
+    async def handle(self, reader, writer):
+        """
+        Serve the requests of one connection (kept alive unless the client closes it).
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                
+                # A malformed request is answered with 400 and the connection is closed
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                    
+                    headers = {}
+                    while True:
+                        line = await reader.readline()
+                        if line in (b'\r\n', b'\n', b''):
+                            break
+                        name, value = line.decode('latin-1').split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                    
+                    length = int(headers.get('content-length', 0))
+                    if length < 0:
+                        raise ValueError("negative Content-Length")
+                except ValueError as e:
+                    await self.respond(writer, 'HTTP/1.1', 400,
+                        {'error': "Malformed request: " + str(e)}, close = True)
+                    break
+                
+                body = await reader.readexactly(length)
+                
+                try:
+                    status, response = await self.route(method, target, body)
+                except (KeyError, ValueError) as e:
+                    status, response = 400, {'error': str(e)}
+                except Exception as e:
+                    status, response = 500, {'error': repr(e)}
+                
+                close = (headers.get('connection', '').lower() == 'close') or \
+                    (version == 'HTTP/1.0')
+                
+                await self.respond(writer, version, status, response, close)
+                
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    
+    async def respond(self, writer, version, status, response, close = False):
+        """
+        Write one JSON response.
+        """
+        content = json.dumps(response).encode('utf-8')
+        writer.write((version + ' ' + str(status) + ' ' + REASONS[status] + '\r\n' +
+            'Content-Type: application/json\r\n' +
+            'Content-Length: ' + str(len(content)) + '\r\n' +
+            'Connection: ' + ('close' if close else 'keep-alive') + '\r\n\r\n').\
+            encode('latin-1') + content)
+        await writer.drain()
+    
+    async def start(self, host = HOST, port = PORT):
+        return await asyncio.start_server(self.handle, host, port)
+
+
+def request(url, path, payload = None, **params):
+    """
+    Send a request to the service (POST if there is a payload) and return the JSON response.
+    """
+    target = url.rstrip('/') + '/' + path.lstrip('/')
+    if params:
+        target += '?' + urlencode(params)
+    
+    data = None if payload is None else json.dumps(payload).encode('utf-8')
+    req = Request(target, data = data, headers = {'Content-Type': 'application/json'})
+    
+    try:
+        with urlopen(req) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except HTTPError as e:
+        raise ValueError(json.loads(e.read().decode('utf-8'))['error'])
+
+
+def post_batch(url, batch, replace = False):
+    """
+    Post a batch of simulations (pandas.DataFrame with columns BATCH_COLUMNS) to the service.
+    """
+    rows = dict((c, batch[c].tolist()) for c in BATCH_COLUMNS)
+    return request(url, 'batch', {'rows': rows, 'replace': replace})
+
+
+def query(url, path, **params):
+    """
+    Query the service (i.e. query(url, 'ranking', week = 5, params_used = 'accrued')).
+    """
+    return request(url, path, **params)
+
+
+async def demo(service, country, host = HOST, port = PORT, reps = 500, randomseed = 100):
+    """
+    Post synthetic batches for each week to a service and time queries of each week.
+    """
+    import synthetic_data
+    
+    server = await service.start(host, port)
+    url = 'http://' + host + ':' + str(port)
+    loop = asyncio.get_running_loop()
+    rng = np.random.default_rng(randomseed)
+    
+    async def timed(func, *args, **kwargs):
+        start = time.perf_counter()
+        value = await loop.run_in_executor(None, lambda: func(*args, **kwargs))
+        return value, 1000.*(time.perf_counter() - start)
+    
+    try:
+        for w in synthetic_data.WEEKS[country]:
+            batch = synthetic_data.simulation_batch(w, reps, CTRL_ORDER[country], rng)
+            
+            posted, t_batch = await timed(post_batch, url, batch)
+            ranking, t_ranking = await timed(query, url, 'ranking', week = w,
+                params_used = 'accrued')
+            optimal, t_optimal = await timed(query, url, 'optimal', week = w,
+                params_used = 'accrued')
+            
+            top = [c['control'] for c in ranking['controls'] if c['ranking'] == 1]
+            sys.stdout.write("Week " + str(w) + ": batch of " + str(len(batch)) +
+                " simulations (%.1f ms), ranking (%.1f ms), optimal (%.1f ms): " %
+                (t_batch, t_ranking, t_optimal) + "optimal " + optimal['optimal'] +
+                ", largest " + ranking['statistic'] + " " + ", ".join(top) + "\n")
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+async def serve(service, host = HOST, port = PORT):
+    server = await service.start(host, port)
+    sys.stdout.write("Serving " + str(service.country) + " on http://" + host + ":" +
+        str(port) + "\n")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    
+    # Process the input argument
+    parser = argparse.ArgumentParser()
+    
+    parser.add_argument("-c", "--country", type = str, required = True,
+        help = "Country of interest ('uk' or 'japan')")
+    
+    parser.add_argument("--host", type = str, default = HOST,
+        help = "Address on which to listen")
+    
+    parser.add_argument("--port", type = int, default = PORT,
+        help = "Port on which to listen")
+    
+    parser.add_argument("--empty", action = 'store_true',
+        help = "Start with no simulations")
+    
+    parser.add_argument("--statistics", nargs = '+', type = str, default = ['mean', 'median'],
+        help = "Statistics by which to rank the controls (i.e. mean median q95 cvar90)")
+    
+    parser.add_argument("--nboot", type = int, default = None,
+        help = "Number of bootstrap samples (default is exact proportions)")
+    
+    parser.add_argument("--randomseed", type = int, default = 100,
+        help = "Random seed for the bootstrap")
+    
+    parser.add_argument("--demo", action = 'store_true',
+        help = "Post synthetic batches to the service, report response times and stop")
+    
+    profiling.add_profile_argument(parser)
+    
+    args = parser.parse_args()
+    
+    profiling.enable(args.profile)
+    
+    for name in args.statistics:
+        if not is_statistic(name):
+            parser.error("unknown statistic: " + name)
+    
+    settings = {'statistics': args.statistics, 'nboot': args.nboot,
+        'randomseed': args.randomseed}
+    
+    simfile = join('.', 'data', 'simulation_output_' + args.country + '.csv')
+    
+    if args.empty or args.demo or not exists(simfile):
+        state = DecisionState(CTRL_ORDER[args.country], **settings)
+    else:
+        sys.stdout.write("Loading simulation output: " + simfile + "\n")
+        with profiling.stage('load'):
+            state = DecisionState.from_tensor(SimulationTensor.load(args.country), **settings)
+    
+    service = DecisionService(state, args.country)
+    
+    try:
+        if args.demo:
+            asyncio.run(demo(service, args.country, args.host, args.port,
+                randomseed = args.randomseed))
+        else:
+            asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,184 @@
+"""
+Fast kernel density estimates for violin plots.
+
+Violin plots in matplotlib evaluate an exact Gaussian kernel density estimate (KDE) over all
+samples for every violin.  Here, KDE curves for a batch of groups (i.e. every week x params_used
+x control of a figure) are calculated at once using a binned KDE: the samples of each group are
+linearly binned onto a regular grid, convolved with a Gaussian kernel using the FFT, and
+interpolated at the points at which matplotlib would evaluate the KDE (`points` evenly spaced
+values between the minimum and maximum of each group).  The bandwidth follows matplotlib's
+default (Scott's rule).  Cost grows linearly with the number of samples.
+
+Curves are cached on disk (in `data/.cache/density`) keyed by a hash of the input data and
+settings, and are returned in the format of `matplotlib.cbook.violin_stats` so that violins can
+be drawn from precomputed curves using `Axes.violin`.
+
+Usage:
+
+from density import violin_stats
+vpstats = violin_stats([x1, x2, x3], points = 50)
+ax.violin(vpstats, positions = [1, 2, 3], widths = 0.7)
+"""
+
+import os, hashlib
+from os.path import join, exists
+import numpy as np
+
+from data_cache import CACHE_FOLDER
+
+# Folder in which density curves are cached
+DENSITY_CACHE = join('.', 'data', CACHE_FOLDER, 'density')
+
+# Number of bins of the grid onto which samples are binned
+GRIDSIZE = 512
+
+# Version of the density calculation (bump to invalidate cached curves)
+DENSITY_VERSION = 1
+
+
+def kde_curves(groups, points = 50, gridsize = GRIDSIZE):
+    """
+    Binned Gaussian KDE (Scott's rule bandwidth) of several groups of samples at once.
+    
+    Parameters
+    ----------
+    groups : list of 1D numpy arrays
+        Samples of each group (each with at least one sample)
+    
+    points : int
+        Number of evenly spaced points, between the minimum and maximum of each group, at which
+        the density is evaluated
+    
+    gridsize : int
+        Number of bins of the grid onto which samples are binned
+    
+    Returns
+    -------
+    (2D numpy array, 2D numpy array)
+        Coordinates and density of each group (groups x points)
+    """
+    G = len(groups)
+    groups = [np.asarray(x, dtype = np.float64) for x in groups]
+    
+    n = np.array([len(x) for x in groups])
+    lo = np.array([x.min() for x in groups])
+    hi = np.array([x.max() for x in groups])
+    std = np.array([x.std(ddof = 1) if len(x) > 1 else 0. for x in groups])
+    
+    # Scott's rule (as used by matplotlib), with a fallback for groups with no spread
+    bw = std*n**(-1./5)
+    span = hi - lo
+    degenerate = (bw <= 0) | (span <= 0)
+    span = np.where(span > 0, span, 1.)
+    bw = np.where(bw > 0, bw, span)
+    
+    dx = span/(gridsize - 1.)
+    
+    # Linear binning of all groups onto a (groups x gridsize) grid
+    values = np.concatenate(groups)
+    group = np.repeat(np.arange(G), n)
+    pos = (values - lo[group])/dx[group]
+    left = np.clip(np.floor(pos).astype(int), 0, gridsize - 2)
+    frac = pos - left
+    
+    flat = group*gridsize + left
+    grid = np.bincount(flat, weights = 1. - frac, minlength = G*gridsize) + \
+        np.bincount(flat + 1, weights = frac, minlength = G*gridsize)
+    grid = grid.reshape(G, gridsize)
+    
+    # Zero-pad so the kernel does not wrap around, then convolve with the Gaussian kernel
+    tail = int(np.ceil(np.max(5*bw/dx)))
+    L = int(2**np.ceil(np.log2(gridsize + min(tail, 4*gridsize))))
+    
+    f = np.fft.rfftfreq(L)
+    kernel_ft = np.exp(-0.5*(2*np.pi*f[None, :]*(bw/dx)[:, None])**2)
+    density = np.fft.irfft(np.fft.rfft(grid, n = L, axis = 1)*kernel_ft, n = L, axis = 1)
+    density = np.maximum(density[:, :gridsize], 0.)/(n*dx)[:, None]
+    
+    # Interpolate at the evaluation points
+    t = np.linspace(0, 1, points)
+    coords = lo[:, None] + (hi - lo)[:, None]*t
+    pos = t*(gridsize - 1)
+    left = np.clip(np.floor(pos).astype(int), 0, gridsize - 2)
+    frac = pos - left
+    vals = density[:, left]*(1. - frac) + density[:, left + 1]*frac
+    
+    vals[degenerate] = 1.
+    
+    return coords, vals
+
+
+def data_key(groups, **settings):
+    """
+    Hash of a batch of groups of samples and the settings used to calculate their densities.
+    """
+    h = hashlib.sha1(str(DENSITY_VERSION).encode())
+    for k in sorted(settings):
+        h.update((k + '=' + str(settings[k]) + ';').encode())
+    for x in groups:
+        x = np.ascontiguousarray(x, dtype = np.float64)
+        h.update(str(len(x)).encode())
+        h.update(x.tobytes())
+    return h.hexdigest()
+
+
+def violin_stats(groups, points = 50, gridsize = GRIDSIZE, cache = True,
+        cachedir = DENSITY_CACHE):
+    """
+    Violin statistics (as from matplotlib.cbook.violin_stats) of several groups of samples.
+    
+    Parameters
+    ----------
+    groups : list of 1D numpy arrays
+        Samples of each group
+    
+    points : int
+        Number of points at which each density is evaluated
+    
+    gridsize : int
+        Number of bins of the grid onto which samples are binned
+    
+    cache : boolean
+        Should curves be read from (and written to) the on-disk cache?
+    
+    cachedir : str
+        Folder in which curves are cached
+    
+    Returns
+    -------
+    list of dicts
+        Keys `coords`, `vals`, `mean`, `median`, `min`, `max` and `quantiles` for each group,
+        to be passed to `Axes.violin`
+    """
+    groups = [np.asarray(x, dtype = np.float64) for x in groups]
+    groups = [x[~np.isnan(x)] for x in groups]
+    nonempty = [i for i, x in enumerate(groups) if len(x) > 0]
+    
+    filename = None
+    if cache:
+        filename = join(cachedir, data_key(groups, points = points, gridsize = gridsize) + '.npz')
+    
+    if (filename is not None) and exists(filename):
+        cached = np.load(filename)
+        coords, vals = cached['coords'], cached['vals']
+    else:
+        coords, vals = kde_curves([groups[i] for i in nonempty], points, gridsize)
+        
+        if filename is not None:
+            if not exists(cachedir):
+                os.makedirs(cachedir, exist_ok = True)
+            tmp = filename + '.' + str(os.getpid()) + '.npz'
+            np.savez(tmp, coords = coords, vals = vals)
+            os.replace(tmp, filename)
+    
+    vpstats = []
+    for x in groups:
+        vpstats.append({'vals': np.array([]), 'coords': np.array([]), 'mean': np.nan,
+            'median': np.nan, 'min': np.nan, 'max': np.nan, 'quantiles': np.array([])})
+    
+    for j, i in enumerate(nonempty):
+        x = groups[i]
+        vpstats[i].update({'vals': vals[j], 'coords': coords[j], 'mean': np.mean(x),
+            'median': np.median(x), 'min': np.min(x), 'max': np.max(x)})
+    
+    return vpstats
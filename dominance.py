@@ -0,0 +1,252 @@
+"""
+Pairwise dominance of control interventions.
+
+For every parameter set ('final' or 'accrued'), week and pair of controls (i, j), the probability
+that a simulation of control i has fewer total culls than a simulation of control j, with ties
+counted as one half:
+
+    P(X_i < X_j) + P(X_i = X_j)/2
+
+This is the Mann-Whitney U statistic of the pair divided by the number of pairs of simulations,
+so that it is calculated exactly from ranks rather than from all n_i x n_j comparisons.  The
+simulations of all controls of a (params_used, week) cell are sorted once (for all cells at
+once) and, for each control j, the number of simulations of j below (and tied with) every
+simulation is found from a cumulative count along the sorted values.  The cost is one
+O(n log n) sort per cell plus O(n) per control.
+
+Output is saved as `data/dominance_<country>.csv` (see data/README.md).  With --heatmap, the
+dominance matrices of the parameter set --params_used are also plotted for --weeks (one panel
+per week, a row per control i and a column per control j).
+
+Usage:
+
+python dominance.py --country <country> [--heatmap] [--weeks 1 2 3 ...] [--params_used <params>] [--filetype <.png>] [--outfilename <name>] [--profile [<trace file>]]
+
+
+Parameters
+----------
+--country : str ("japan" or "uk")
+
+--heatmap : flag
+    Plot the dominance matrices as heatmaps (saved in the graphics folder)
+
+--weeks : list of int (default all weeks)
+    Weeks to plot with --heatmap
+
+--params_used : str ("final" or "accrued", default "accrued")
+    Parameter set to plot with --heatmap
+
+--filetype : str (default ".png")
+    Filetype of the heatmap
+
+--outfilename : str (default "dominance_<country>")
+    File name of the heatmap (excluding the filetype suffix)
+
+--profile : str (optional)
+    Append timings of each stage to a JSON trace file (default profile.jsonl, see profiling.py)
+"""
+
+import sys, argparse
+from os.path import join
+import numpy as np, pandas as pd
+
+import profiling
+from simulation_tensor import SimulationTensor
+
+
+def dominance_matrix(values, nreps = None):
+    """
+    Probability that a draw from each control has fewer total culls than a draw from each other
+    control (ties counted as one half).
+    
+    Parameters
+    ----------
+    values : numpy array
+        Simulation output (... x controls x reps), i.e. the values of a SimulationTensor, with
+        the simulations of each control in the first `nreps` columns
+    
+    nreps : numpy array of ints
+        Number of simulations of each control (... x controls, default is all columns)
+    
+    Returns
+    -------
+    numpy array of floats
+        Dominance matrices (... x controls x controls), where entry (i, j) is
+        P(X_i < X_j) + P(X_i = X_j)/2 (0.5 on the diagonal, NaN where a control has no
+        simulations)
+    """
+    C, R = values.shape[-2:]
+    if nreps is None:
+        nreps = np.full(values.shape[:-1], R)
+    
+    x = values.reshape(-1, C*R)
+    N = len(x)
+    
+    # Sort the simulations of all controls of each cell together (padding is moved to the end)
+    label = np.repeat(np.arange(C), R)
+    valid = (np.arange(R) < nreps[..., None]).reshape(N, C*R)
+    x = np.where(valid, x, np.inf)
+    
+    order = np.argsort(x, axis = 1, kind = 'stable')
+    xs = np.take_along_axis(x, order, axis = 1)
+    ls = label[order]
+    vs = np.take_along_axis(valid, order, axis = 1)
+    
+    # First and last positions of the run of equal values that each position belongs to
+    position = np.arange(C*R)
+    first_of_run = np.ones(xs.shape, dtype = bool)
+    first_of_run[:, 1:] = (xs[:, 1:] != xs[:, :-1])
+    last_of_run = np.ones(xs.shape, dtype = bool)
+    last_of_run[:, :-1] = first_of_run[:, 1:]
+    
+    first = np.maximum.accumulate(np.where(first_of_run, position, 0), axis = 1)
+    last = np.minimum.accumulate(np.where(last_of_run, position, C*R)[:, ::-1], axis = 1)[:, ::-1]
+    
+    # Index of the (cell, control) of each sorted value, for summing over the values of a control
+    group = (np.arange(N)[:, None]*C + ls)[vs]
+    
+    # below[n, i, j]: number of pairs in which the draw from j is below the draw from i (ties 1/2)
+    below = np.empty((N, C, C))
+    for j in range(C):
+        # Number of simulations of control j up to (and excluding) each position
+        cumulative = np.zeros((N, C*R + 1))
+        cumulative[:, 1:] = np.cumsum((ls == j) & vs, axis = 1)
+        
+        less = np.take_along_axis(cumulative, first, axis = 1)
+        tied = np.take_along_axis(cumulative, last + 1, axis = 1) - less
+        
+        below[:, :, j] = np.bincount(group, weights = (less + 0.5*tied)[vs],
+            minlength = N*C).reshape(N, C)
+    
+    npairs = nreps.reshape(N, C, 1)*nreps.reshape(N, 1, C)
+    
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        D = np.swapaxes(below, 1, 2)/npairs
+    
+    return D.reshape(values.shape[:-2] + (C, C))
+
+
+def dominance_table(tensor):
+    """
+    Dominance of every pair of controls for every parameter set and week.
+    
+    Parameters
+    ----------
+    tensor : SimulationTensor
+        Simulation output
+    
+    Returns
+    -------
+    pandas.DataFrame
+        Columns `params_used`, `week`, `control`, `other` and `dominance` (probability that
+        `control` has fewer total culls than `other`, ties counted as one half), sorted by
+        parameter set, week, control and other control (in the order of the controls in
+        `tensor`); weeks and controls without simulations are omitted
+    """
+    P, W, C, R = tensor.shape
+    
+    D = dominance_matrix(tensor.values, tensor.nreps)
+    
+    table = pd.DataFrame({
+        'params_used': np.repeat(tensor.params_used, W*C*C),
+        'week': np.tile(np.repeat(tensor.weeks, C*C), P),
+        'control': np.tile(np.repeat(tensor.controls, C), P*W),
+        'other': np.tile(tensor.controls, P*W*C),
+        'dominance': D.ravel()})
+    
+    return table.loc[table.dominance.notnull()].reset_index(drop = True)
+
+
+def dominance_filename(country, datadir = join('.', 'data')):
+    return join(datadir, 'dominance_' + country + '.csv')
+
+
+def plot_heatmap(table, params_used, weeks, controls, filename):
+    """
+    Plot the dominance matrices of one parameter set for several weeks (one panel per week).
+    """
+    import matplotlib.pyplot as plt
+    from colours import text_props
+    
+    table = table.loc[(table.params_used == params_used) & table.week.isin(weeks)]
+    
+    fig, ax = plt.subplots(ncols = len(weeks), nrows = 1, squeeze = False)
+    ax = ax[0]
+    
+    for axi, t in enumerate(weeks):
+        matrix = table.loc[table.week == t].pivot(index = 'control', columns = 'other',
+            values = 'dominance').reindex(index = controls, columns = controls)
+        
+        im = ax[axi].imshow(matrix.values, cmap = 'RdBu', vmin = 0, vmax = 1,
+            interpolation = 'none')
+        
+        ax[axi].set_xticks(range(len(controls)))
+        ax[axi].set_xticklabels(controls, rotation = 90)
+        ax[axi].set_yticks(range(len(controls)))
+        ax[axi].set_yticklabels(controls if axi == 0 else [])
+        ax[axi].tick_params(labelsize = 8, length = 0.0)
+        
+        ax[axi].text(0.5, -0.45, str(t), size = 12, ha = "center", transform = ax[axi].transAxes)
+    
+    plt.figtext(0.47, 0.04, 'Week since first confirmed case', va = 'center', ha = 'center',
+        **text_props)
+    
+    fig.set_size_inches((1.5*len(weeks) + 1.5, 2.8))
+    
+    fig.subplots_adjust(left = 0.08, bottom = 0.3, right = 0.86, top = 0.97, wspace = 0.08)
+    
+    cbar = fig.colorbar(im, cax = fig.add_axes([0.88, 0.3, 0.015, 0.67]))
+    cbar.set_label('P(row has fewer culls than column)', fontsize = 8)
+    cbar.ax.tick_params(labelsize = 8)
+    
+    plt.savefig(filename)
+    plt.close()
+
+
+if __name__ == "__main__":
+    
+    # Process the input argument
+    parser = argparse.ArgumentParser()
+    
+    parser.add_argument("-c", "--country", type = str, required = True,
+        help = "Country of interest ('uk' or 'japan')")
+    
+    parser.add_argument("--heatmap", action = "store_true",
+        help = "Plot the dominance matrices as heatmaps")
+    
+    parser.add_argument("-w", "--weeks", nargs = '+', type = int, default = None,
+        help = "Weeks to plot with --heatmap (default all weeks)")
+    
+    parser.add_argument("--params_used", type = str, default = 'accrued',
+        choices = ['final', 'accrued'], help = "Parameter set to plot with --heatmap")
+    
+    parser.add_argument("-f", "--filetype", type = str, default = ".png",
+        help = "Filetype of the heatmap")
+    
+    parser.add_argument("-o", "--outfilename", type = str, default = None,
+        help = "Output filename of the heatmap (excluding the filetype suffix)")
+    
+    profiling.add_profile_argument(parser)
+    
+    args = parser.parse_args()
+    
+    profiling.enable(args.profile)
+    
+    sys.stdout.write("Calculating pairwise dominance of controls for: " + args.country + "\n")
+    
+    with profiling.stage('load'):
+        tensor = SimulationTensor.load(args.country)
+    
+    with profiling.stage('compute', items = int(tensor.nreps.sum()), unit = 'simulations'):
+        table = dominance_table(tensor)
+    
+    with profiling.stage('save'):
+        table.to_csv(dominance_filename(args.country), index = False)
+    
+    if args.heatmap:
+        weeks = tensor.weeks if args.weeks is None else args.weeks
+        outfilename = args.outfilename or ('dominance_' + args.country)
+        
+        with profiling.stage('render'):
+            plot_heatmap(table, args.params_used, weeks, tensor.controls,
+                join('.', 'graphics', outfilename + args.filetype))
@@ -0,0 +1,123 @@
+"""
+Pre-partitioned group index for slicing datasets by (params_used, week, control).
+
+A `GroupIndex` sorts a dataset once by its key columns and stores the sorted key of each group
+along with offsets of each group into the sorted value columns (in the manner of a compressed
+sparse row matrix).  Any group, or any set of groups that share a prefix of the keys (i.e. all
+controls for one parameter set and week), is then a contiguous, zero-copy view of the sorted
+columns rather than the result of a boolean mask across the full dataset.
+
+Usage:
+
+from group_index import GroupIndex
+index = GroupIndex(full, ['params_used', 'week', 'control'], ['total_culls'])
+index.get('total_culls', 'accrued', 5, 'rc3')     # total culls for one group
+index.get('total_culls', 'accrued')               # total culls for all weeks and controls
+"""
+
+import numpy as np, pandas as pd
+
+
+def _label(value):
+    """
+    Convert a key to a plain Python value (so that i.e. numpy and Python integers match)
+    """
+    if isinstance(value, (np.integer, int)):
+        return int(value)
+    if isinstance(value, (np.floating, float)):
+        return float(value)
+    return str(value)
+
+
+class GroupIndex(object):
+    """
+    Index of the groups of a dataset defined by one or more key columns.
+    
+    Attributes
+    ----------
+    keys : list of str
+        Key columns, in order of priority
+    
+    group_keys : list of tuples
+        Key of each group, in sorted order
+    
+    offsets : 1D numpy array of ints
+        Start of each group within the sorted columns, with the number of rows appended
+    
+    columns : dict
+        Value columns (numpy arrays) sorted by group
+    """
+    def __init__(self, df, keys, columns = None):
+        self.keys = list(keys)
+        
+        if columns is None:
+            columns = [c for c in df.columns if c not in self.keys]
+        
+        codes = []; uniques = []
+        for k in self.keys:
+            c, u = pd.factorize(np.asarray(df[k]), sort = True)
+            codes.append(c); uniques.append(u)
+        
+        # Sort by the keys (np.lexsort uses the final key as the primary key)
+        order = np.lexsort(codes[::-1])
+        sorted_codes = np.stack([c[order] for c in codes], axis = 1)
+        
+        change = np.any(sorted_codes[1:] != sorted_codes[:-1], axis = 1)
+        starts = np.concatenate(([0], np.nonzero(change)[0] + 1)) if len(order) else \
+            np.array([], dtype = int)
+        
+        self.offsets = np.append(starts, len(order))
+        self.group_keys = [tuple(_label(uniques[j][code]) for j, code in enumerate(row))
+            for row in sorted_codes[starts]]
+        
+        self.columns = dict((c, np.ascontiguousarray(np.asarray(df[c])[order]))
+            for c in columns)
+        
+        # Range of groups (first, last + 1) for every prefix of the keys
+        self._ranges = {}
+        for g, key in enumerate(self.group_keys):
+            for level in range(1, len(self.keys) + 1):
+                prefix = key[:level]
+                if prefix in self._ranges:
+                    self._ranges[prefix][1] = g + 1
+                else:
+                    self._ranges[prefix] = [g, g + 1]
+    
+    def __len__(self):
+        return len(self.group_keys)
+    
+    def __contains__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        return tuple(_label(k) for k in key) in self._ranges
+    
+    def rows(self, *key):
+        """
+        Slice of the sorted columns for a group, or for all groups with a prefix of the keys
+        
+        An empty slice is returned if there are no such groups.
+        """
+        key = tuple(_label(k) for k in key)
+        
+        if len(key) == 0:
+            return slice(0, self.offsets[-1])
+        
+        if key not in self._ranges:
+            return slice(0, 0)
+        
+        first, last = self._ranges[key]
+        return slice(self.offsets[first], self.offsets[last])
+    
+    def get(self, column, *key):
+        """
+        Zero-copy view of a value column for a group (or prefix of the keys)
+        """
+        return self.columns[column][self.rows(*key)]
+    
+    def frame(self, *key):
+        """
+        DataFrame of all value columns for a group (or prefix of the keys)
+        """
+        rows = self.rows(*key)
+        return pd.DataFrame(dict((c, v[rows]) for c, v in self.columns.items()),
+            columns = list(self.columns.keys()))
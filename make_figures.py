@@ -0,0 +1,202 @@
+"""
+Generate all figures from a single Python process.
+
+The figures generated by `run.sh` are declared in `FIGURES` below.  Each dataset in the `data`
+folder is loaded once and shared by all figures that use it (i.e. the UK simulation output is
+loaded once for figures 2, S9 and S10), as are the objects that plotting modules derive from the
+datasets (declared in the `DERIVED` dictionary of a plotting module, i.e. the index and the
+ranking table of the simulation output, built once for figures 2, S9 and S10).  Figures may optionally be rendered across a pool of
+worker processes, in which case each worker loads the datasets it needs once.  Plotting modules
+(and matplotlib) are only imported when a figure is rendered.
+
+Usage:
+
+python make_figures.py [--figures fig_1 fig_2 ...] [--filetype <filetype>] [--workers <n>] [--profile [<trace file>]]
+
+
+Parameters
+----------
+--figures : list of str
+    Names of the figures to generate (default is all figures in FIGURES)
+
+--filetype : str
+    Graphics filetype for all output figures (overriding the filetype of each figure)
+
+--workers : int (default 1)
+    Number of worker processes over which to render figures
+
+--list : flag
+    List the available figures and exit
+
+--profile : str (optional)
+    Append timings of each stage of each figure to a JSON trace file (default profile.jsonl, 
+    see profiling.py); records are labelled by figure name
+"""
+
+import sys, time, argparse, importlib
+from os.path import join
+from concurrent.futures import ProcessPoolExecutor
+
+import profiling
+from data_cache import read_csv
+
+# Figures generated by run.sh: (name, plotting module, command-line arguments)
+FIGURES = [
+    ('fig_1', 'plot_risk_measure_individual',
+        '--filetype=.png --country=uk --outfilename=fig_1 --weeks 1 2 3 4 5 28'),
+    ('fig_2', 'plot_three_panel_plot',
+        '--filetype=.png --country=uk --outfilename=fig_2 --weeks 1 2 3 4 5 28'),
+    ('fig_3', 'plot_three_panel_plot',
+        '--filetype=.png --country=japan --outfilename=fig_3 --weeks 1 2 3 4 5 11'),
+    ('fig_s3', 'plot_params_mean_95CI',
+        '-f=.png -w 1 2 3 4 5 6 7 8 9 10 11 --figw=9.5 --figh=7 --outputfilename=fig_s3 '
+        '--ncols=4 --nrows=4'),
+    ('fig_s4', 'plot_risk_measure_individual',
+        '--filetype=.png --country=japan --outfilename=fig_s4 --weeks 1 2 3 4 5 11'),
+    ('fig_s5', 'plot_scatterplot_params',
+        '-p1=psi_1 -p2=gamma_1 -w 1 2 3 4 5 6 -c=uk -f=.png --outfilename=fig_s5'),
+    ('fig_s6', 'plot_scatterplot_params',
+        '-p1=phi_2 -p2=zeta_2 -w 1 2 3 4 5 6 -c=japan -f=.png --outfilename=fig_s6'),
+    ('fig_s9', 'plot_three_panel_plot',
+        '--filetype=.png --country=uk --outfilename=fig_s9 --figw=14 --figh=7 --sim_legend=True '
+        '--legend_size=8 --accrued_xtext=Ac --complete_xtext=Co '
+        '--weeks 1 2 3 4 5 6 7 8 9 10 11 12'),
+    ('fig_s10', 'plot_three_panel_plot',
+        '--filetype=.png --country=uk --outfilename=fig_s10 --figw=14 --figh=7 --sim_legend=True '
+        '--legend_size=8 --accrued_xtext=Ac --complete_xtext=Co '
+        '--weeks 13 14 15 16 17 18 19 20 21 22 23 24 25 26 27 28'),
+    ('fig_s11', 'plot_three_panel_plot',
+        '--filetype=.png --country=japan --outfilename=fig_s11 --figw=14 --figh=7 '
+        '--sim_legend=True --legend_size=8 --accrued_xtext=Ac --complete_xtext=Co '
+        '--weeks 1 2 3 4 5 6 7 8 9 10 11')
+]
+
+# Datasets loaded in this process (file name: pandas.DataFrame)
+_datasets = {}
+
+# Objects derived from the datasets in this process ((module, keyword, arguments): object)
+_derived = {}
+
+
+def load_dataset(filename, datadir = join('.', 'data')):
+    """
+    Load a dataset from the data folder, reusing it if it has already been loaded.
+    """
+    if filename not in _datasets:
+        _datasets[filename] = read_csv(join(datadir, filename))
+    return _datasets[filename]
+
+
+def load_derived(module, args, data):
+    """
+    Objects derived from the datasets of a figure (see `DERIVED` in the plotting modules), reusing
+    those already derived for another figure with the same datasets and arguments.
+    """
+    derived = {}
+    for k, (func, depends) in getattr(module, 'DERIVED', {}).items():
+        key = (module.__name__, k) + tuple(getattr(args, d) for d in depends)
+        if key not in _derived:
+            _derived[key] = func(args, **data)
+        derived[k] = _derived[key]
+    return derived
+
+
+def _init_worker():
+    """
+    Use a non-interactive matplotlib backend (matplotlib is imported lazily).
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def render(figure, filetype = None, profile = None):
+    """
+    Render one figure in FIGURES.
+    
+    Parameters
+    ----------
+    figure : tuple
+        (name, plotting module, command-line arguments) of the figure
+    
+    filetype : str
+        Graphics filetype overriding that in the command-line arguments of the figure
+    
+    profile : str
+        Trace file to which timings of each stage are appended (no profiling if None)
+    
+    Returns
+    -------
+    (str, float)
+        Name of the figure and time taken (s) to render it
+    """
+    name, module_name, argv = figure
+    start = time.time()
+    
+    _init_worker()
+    profiling.enable(profile, script = name)
+    
+    module = importlib.import_module(module_name)
+    
+    args = module.make_parser().parse_args(argv.split())
+    if filetype is not None:
+        args.filetype = filetype
+    
+    # Datasets shared between figures (only the first figure to use a dataset loads it)
+    with profiling.stage('load_shared'):
+        data = dict((k, load_dataset(v.format(country = getattr(args, 'country', None))))
+            for k, v in module.DATA_FILES.items())
+    
+    with profiling.stage('derive_shared'):
+        data.update(load_derived(module, args, data))
+    
+    with profiling.stage('figure'):
+        module.plot(args, **data)
+    
+    return name, time.time() - start
+
+
+if __name__ == "__main__":
+    
+    # Process the input argument
+    parser = argparse.ArgumentParser()
+    
+    parser.add_argument("--figures", nargs = '+', type = str, default = None,
+        help = "Names of the figures to generate (default all)")
+    
+    parser.add_argument("--filetype", type = str, default = None,
+        help = "Filetype to be used for all output figures")
+    
+    parser.add_argument("--workers", type = int, default = 1,
+        help = "Number of worker processes")
+    
+    parser.add_argument("--list", action = "store_true",
+        help = "List the available figures and exit")
+    
+    profiling.add_profile_argument(parser)
+    
+    args = parser.parse_args()
+    
+    if args.list:
+        for name, module_name, argv in FIGURES:
+            sys.stdout.write(name + ": python " + module_name + ".py " + argv + "\n")
+        sys.exit(0)
+    
+    names = [f[0] for f in FIGURES]
+    if args.figures is None:
+        figures = FIGURES
+    else:
+        unknown = [f for f in args.figures if f not in names]
+        if unknown:
+            parser.error("Unknown figures: " + ", ".join(unknown))
+        figures = [f for f in FIGURES if f[0] in args.figures]
+    
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers = args.workers, initializer = _init_worker) as pool:
+            results = pool.map(render, figures, [args.filetype]*len(figures), 
+                [args.profile]*len(figures))
+            for name, elapsed in results:
+                sys.stdout.write("Generated " + name + " (" + "%.1f" % elapsed + "s)\n")
+    else:
+        for figure in figures:
+            name, elapsed = render(figure, args.filetype, args.profile)
+            sys.stdout.write("Generated " + name + " (" + "%.1f" % elapsed + "s)\n")
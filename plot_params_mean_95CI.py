@@ -6,14 +6,31 @@ case) for both UK and Miyazaki outbreaks.  For each week the mean parameter valu
 and 97.5 percent quantiles are plotted for both countries.  Japan is plotted in red and UK is 
 plotted in blue.  
 
+Means and quantiles are looked up in the summary table of each country (see posterior_summary.py),
+which is calculated in one pass over each parameters file and cached.  With --streaming, parameter
+files are instead read in chunks and summarised using running means and mergeable quantile
+sketches for each (country, week, parameter) (see quantile_sketch.py), so that posteriors with
+millions of draws per week can be plotted with bounded memory.  Quantiles are then accurate to
+within a relative error of 0.05%, so quantiles of parameters plotted on the log scale are accurate
+to within an absolute error of about 0.0005 (log(1.0005)).
+
 Usage: 
-plot_params_mean_95CI.py --filetype=<filetype> --weeks <weeks>
+plot_params_mean_95CI.py --filetype=<filetype> --weeks <weeks> [--streaming] [--chunksize <rows>]
 
 filetype : str
     File type for output figure, as passed to plt.savefig.  
 
 weeks : list of int
     Weeks of data to plot
+
+streaming : flag
+    Summarise parameter files in chunks rather than loading them into memory
+
+chunksize : int (default 100000)
+    Number of rows read at once when streaming
+
+profile : str (optional)
+    Append timings of each stage to a JSON trace file (default profile.jsonl, see profiling.py)
 """
 
 # Set latex-related parameters for rending the axes titles (ignored if generating a png file)
@@ -28,16 +45,9 @@ from matplotlib import pyplot as plt
 import matplotlib.patches as mpatches
 
 from colours import *
-
-# Functions to use for plotting
-def quant025(x):
-    return(x.quantile(0.025))
-
-def quant975(x):
-    return(x.quantile(0.975))
-
-functions = [np.mean, quant025, quant975]
-function_names = ['avg', 'L95', 'U95']
+import profiling
+from posterior_summary import load_summary, sketch_table, ALL_WEEKS
+from quantile_sketch import summarise, CHUNKSIZE
 
 # Parameters to plot on the log scale
 as_logged = ['gamma_1', 'epsilon_1', 'epsilon_2']
@@ -45,8 +55,14 @@ as_logged = ['gamma_1', 'epsilon_1', 'epsilon_2']
 # Parameters to plot with 0 - 1 limits
 as_zero_to_one = ['phi_1', 'phi_2', 'psi_1', 'psi_2']
 
+# Datasets used by plot() (keyword argument: file within the data folder)
+DATA_FILES = {'fulluk': 'parameters_uk.csv', 'fullj': 'parameters_japan.csv'}
 
-if __name__ == "__main__":
+
+def make_parser():
+    """
+    Parser of the command-line arguments of this script
+    """
     
     # Process the input argument
     parser = argparse.ArgumentParser()
@@ -65,22 +81,54 @@ if __name__ == "__main__":
     parser.add_argument('--nrows', type = int, default = 4)
     parser.add_argument('--ncols', type = int, default = 4)
     
-    args = parser.parse_args()
+    parser.add_argument('--streaming', action = 'store_true',
+        help = "Summarise parameter files in chunks (with bounded memory)")
+    
+    parser.add_argument('--chunksize', type = int, default = CHUNKSIZE,
+        help = "Number of rows read at once when streaming")
     
-    fulluk = pd.read_csv(join('.', 'data', 'parameters_uk.csv'))
-    fullj = pd.read_csv(join('.', 'data', 'parameters_japan.csv'))
+    profiling.add_profile_argument(parser)
+    
+    return parser
+
+
+def plot(args, fulluk = None, fullj = None):
+    """
+    Plot the mean and 95% intervals of the posterior of each parameter for both countries.  
+    
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Arguments as returned by make_parser().parse_args()
+    
+    fulluk, fullj : pandas.DataFrame
+        Posterior parameter draws for UK and Miyazaki (read from the data folder if not given)
+    """
+    
+    # Summary tables of the posterior of each country (see posterior_summary.py)
+    with profiling.stage('load'):
+        summaries = []
+        for df, country in [(fulluk, 'uk'), (fullj, 'japan')]:
+            if args.streaming:
+                # Parameter files are summarised a chunk at a time
+                if df is None:
+                    df = join('.', 'data', 'parameters_' + country + '.csv')
+                summaries.append(sketch_table(summarise(df, args.chunksize)))
+            else:
+                summaries.append(load_summary(country, df))
     
     # 'Week 1' in the UK data started on the 19th Feb 2001
     # 'Week 1' in the Miyazaki data started on the 27th April 2010
     #fullj['week'] = (fullj.day - 27)/7.
     #fulluk['week'] = (fulluk.day - 19)/7.
     
-    all_columns = np.union1d(fullj.columns, fulluk.columns)
     columns_to_plot = ['delta', 'epsilon_1', 'epsilon_2', 'gamma_1', 'gamma_2', 'phi_1', 'phi_2', \
         'phi_3', 'psi_1', 'psi_2', 'psi_3', 'xi_2', 'xi_3', 'zeta_2', 'zeta_3']
     
     times = np.array(args.weeks)
     
+    render = profiling.stage('render').start()
+    
     fig, axes = plt.subplots(ncols = args.ncols, nrows = args.nrows, frameon = False)
     fig.subplots_adjust(wspace = 0.3, hspace = 0.3, bottom = 0.1, top = 0.9, left = 0.05, right = 0.95)
     
@@ -92,25 +140,25 @@ if __name__ == "__main__":
         
         sys.stdout.write(var + ", ")
         
-        if var in fullj.columns:
-            if var in as_logged:
-                fullj[var] = np.log(fullj[var])
-            jmin = fullj[var].quantile(0.005)
-            jmax = fullj[var].quantile(0.995)
+        scale = 'log' if (var in as_logged) else 'natural'
+        
+        # Rows of the summary tables for this parameter (UK, Japan)
+        ukrows, jrows = [df.loc[(df.parameter == var) & (df.scale == scale)] for df in summaries]
+        
+        # Limits are the 0.5 and 99.5% quantiles across all weeks
+        if len(jrows) > 0:
+            jmin, jmax = jrows.loc[jrows.week == ALL_WEEKS, ['q005', 'q995']].values[0]
         
-        if var in fulluk.columns:
-            if var in as_logged:
-                fulluk[var] = np.log(fulluk[var])
-            ukmin = fulluk[var].quantile(0.005)
-            ukmax = fulluk[var].quantile(0.995)
+        if len(ukrows) > 0:
+            ukmin, ukmax = ukrows.loc[ukrows.week == ALL_WEEKS, ['q005', 'q995']].values[0]
         
         ymin = np.min([ukmin, jmin])
         ymax = np.max([ukmax, jmax])
         
-        # Calculate the mean, 2.5-th, and 97.5-th quantile.  
+        # Plot the mean, 2.5-th, and 97.5-th quantile.  
         
-        for icountry, df in enumerate([fulluk, fullj]):
-            if var in df.columns:
+        for icountry, df in enumerate([ukrows, jrows]):
+            if len(df) > 0:
                 if icountry == 0:
                     linestyle_avg = {'linestyle': "-", 
                         'c': colour_dict_country['uk']['chex']}
@@ -123,17 +171,13 @@ if __name__ == "__main__":
                     linestyle_ci = {'linestyle': "--", \
                         'c': colour_dict_country['japan']['crgba']}
                 
-                subdf = df[df.week.isin(times)]
+                grouper = df.loc[df.week.isin(times)]
                 
-                grouper = subdf.groupby('week').agg({var: functions}).reset_index()
-                
-                grouper.columns = ['week'] + function_names
-                
-                axes[axy, axx].plot(grouper.week.values, grouper.avg.values, **linestyle_avg)
+                axes[axy, axx].plot(grouper.week.values, grouper['mean'].values, **linestyle_avg)
                 
                 axes[axy, axx].fill_between(grouper.week.values, 
-                    grouper.L95.values, grouper.U95.values, 
-                    where =  grouper.L95.values <= grouper.U95.values,
+                    grouper.q025.values, grouper.q975.values, 
+                    where =  grouper.q025.values <= grouper.q975.values,
                     facecolor = linestyle_ci['c'], interpolate = True, lw = 0.0)
         
         axes[axy, axx].set_xticks([])
@@ -170,5 +214,17 @@ if __name__ == "__main__":
     
     fig.set_size_inches((args.figw, args.figh))
     
-    plt.savefig(join(".", "graphics", args.outputfilename + args.filetype), dpi = 300)
+    render.stop()
+    
+    with profiling.stage('save'):
+        plt.savefig(join(".", "graphics", args.outputfilename + args.filetype), dpi = 300)
     plt.close()
+
+
+if __name__ == "__main__":
+    
+    args = make_parser().parse_args()
+    
+    profiling.enable(args.profile)
+    
+    plot(args)
@@ -4,89 +4,36 @@ average-sized farm, integrated across a range of distances.
 
 Usage 
 
-python plot_risk_measure_individual.py <country> [--filetype <filetype>] [--outfilename=<outfile>] [--randomseed=<seed>] [--weeks 1 2 3 ...]
+python plot_risk_measure_individual.py <country> [--filetype <filetype>] [--outfilename=<outfile>] [--randomseed=<seed>] [--weeks 1 2 3 ...] [--integration <grid|exact|adaptive>] [--tolerance <tol>] [--profile [<trace file>]]
+
+By default the kernel is summed across a grid of 100 squared distances (as in figures 1 and S4).  
+With --integration=exact or --integration=adaptive the kernel is integrated instead (see 
+risk_engine.py) and the difference from the grid sum is reported.  
+
+With --profile, timings of each stage are appended to a JSON trace file (see profiling.py).  
 
 """
 
-import pandas as pd, numpy as np, argparse
+import sys, argparse
+import numpy as np
 from os.path import join
 from matplotlib import pyplot as plt
 
 from colours import *
+import profiling
+from data_cache import read_csv
+from group_index import GroupIndex
+from density import violin_stats
+from risk_engine import risk_by_week, grid_difference, INTEGRATION_METHODS, TOLERANCE
 
-
-def susceptibility(row, japan = False):
-    """
-    Calculate farm-level susceptibility for an average-sized susceptible farm.  
-    
-    Parameters
-    ----------
-    row : object
-        Object with attributes psi_1, psi_2, xi_2 for Japan and additional xi_3, psi_3 for UK.
-    japan : boolean
-        Should this calculation be for the Miyazaki model?  
-    
-    Returns
-    -------
-    Float 
-        Farm-level susceptibility
-    """
-    
-    if japan:
-        v = 1**row.psi_1 + row.xi_2*1**row.psi_2
-    else:
-        v = 1**row.psi_1 + row.xi_2*1**row.psi_2 + row.xi_3*1**row.psi_3
-    
-    return v
-
-
-def transmissibility(row, japan = False):
-    """
-    Calculate farm-level transmissibility
-    
-    Parameters
-    ----------
-    row : object
-        Object with attributes phi_1, phi_2, zeta_2 for Japan and additional zeta_3, phi_3 for UK.
-    japan : boolean
-        Should this calculation be for the Miyazaki model?  
-    
-    Returns
-    -------
-    Float 
-        Farm-level transmissibility
-    """
-    
-    if japan:
-        v = 1**row.phi_1 + row.zeta_2*1**row.phi_2
-    else:
-        v = 1**row.phi_1 + row.zeta_2*1**row.phi_2 + row.zeta_3*1**row.phi_3
-    
-    return v
+# Datasets used by plot() (keyword argument: file within the data folder)
+DATA_FILES = {'df_params': 'parameters_{country}.csv'}
 
 
-def K(Dsq, delta, omega = 1.3):
+def make_parser():
     """
-    Evaluate the distance kernel function
-    
-    Parameters
-    ----------
-    Dsq : float
-        Squared-distance at which to evaluate the kernel
-    
-    delta, omega : floats
-        Parameters of the distance kernel (see Methods appendix of the manuscript for details)
-    
-    Returns
-    -------
-    Float
-        Distance kernel with parameters `delta` and `omega` evaluated at squared-distance `Dsq`
-    
+    Parser of the command-line arguments of this script
     """
-    return delta/(delta**2 + Dsq)**omega
-
-
-if __name__=="__main__":
     
     # Process the input argument
     parser = argparse.ArgumentParser()
@@ -102,7 +49,29 @@ if __name__=="__main__":
     parser.add_argument("--outfilename", type = str, 
         help = "Output filename (excluding the filetype suffix)", default = None)
     
-    args = parser.parse_args()
+    parser.add_argument("--integration", type = str, choices = INTEGRATION_METHODS, 
+        help = "Method used to integrate the kernel across distances", default = 'grid')
+    
+    parser.add_argument("--tolerance", type = float, 
+        help = "Relative error tolerance for adaptive quadrature", default = TOLERANCE)
+    
+    profiling.add_profile_argument(parser)
+    
+    return parser
+
+
+def plot(args, df_params = None):
+    """
+    Plot the instantaneous risk of onward transmission for one country.  
+    
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Arguments as returned by make_parser().parse_args()
+    
+    df_params : pandas.DataFrame
+        Posterior parameter draws (read from the data folder if not given)
+    """
     
     colour = colour_dict_country[args.country]['chex']
     
@@ -124,44 +93,43 @@ if __name__=="__main__":
         
         ylims = range(-2, 3)
     
-    infile_params = 'parameters_' + args.country + '.csv'
-    df_params = pd.read_csv(join('.', 'data', infile_params))
+    with profiling.stage('load'):
+        if df_params is None:
+            infile_params = 'parameters_' + args.country + '.csv'
+            df_params = read_csv(join('.', 'data', infile_params))
+    
+    # Risk measures for every posterior draw of the weeks of interest, calculated in one pass
+    # (occults are disregarded)
+    with profiling.stage('compute', unit = 'posterior draws') as compute:
+        df_risk = risk_by_week(df_params, (args.country == "japan"), weeks, 
+            integration = args.integration, tolerance = args.tolerance)
+        compute.items = len(df_risk)
+    
+    if args.integration != 'grid':
+        df_grid = risk_by_week(df_params, (args.country == "japan"), weeks)
+        diff = grid_difference(df_risk.risk.values, df_grid.risk.values)
+        
+        sys.stdout.write("Difference from grid sum: " + 
+            ", ".join(k + " = " + "%.4g" % v for k, v in diff.items()) + "\n")
     
     # List container to store risk measures for each week of interest
-    risks = []
-    
-    # For each time step
-    for w in weeks:
-    
-        # Subset the dataset
-        sub = df_params[(df_params.week == w)]
-        
-        # For each point in the posterior distribution (occults are disregarded)
-        suscept = susceptibility(sub, (args.country == "japan"))
-        
-        # Calculate susceptibility and transmissibility
-        transmiss = transmissibility(sub, (args.country == "japan"))
-        
-        # Calculate full kernel
-        output = []
-        Dsq = np.linspace(0, 500, 100)
-        
-        for d in Dsq:
-            o = sub.gamma_1 * suscept * transmiss * K(d, sub.delta)
-            output.append(o.values)
-        
-        output = np.array(output).T
-        risk = output.sum(axis = 1)
-        risks.append(risk)
+    index = GroupIndex(df_risk, ['week'], ['risk'])
+    risks = [index.get('risk', w) for w in weeks]
     
     # Take log10 of the instantaneous risks
     r = [np.log10(rr) for rr in risks]
     N = len(r)
     
+    # Density curves of all weeks in one batch (read from the on-disk cache if available)
+    with profiling.stage('density', items = N, unit = 'violins'):
+        vpstats = violin_stats(r, points = 40)
+    
+    render = profiling.stage('render').start()
+    
     fig, ax = plt.subplots()
     
-    violins = ax.violinplot(r, \
-        points = 40, widths = [0.7] * N, \
+    violins = ax.violin(vpstats, np.arange(1, N + 1), \
+        widths = [0.7] * N, \
         showmeans = False, \
         showextrema = True, showmedians = True)
     
@@ -211,6 +179,18 @@ if __name__=="__main__":
     # Trim the edges of the plot
     fig.subplots_adjust(left = 0.1, bottom = 0.15, \
         right = 0.95, top = 0.95, wspace = 0.0, hspace = 0.0)
+    render.stop()
+    
     # Save figure and close figure object
-    plt.savefig(join('.', 'graphics', args.outfilename + args.filetype), dpi = 300)
+    with profiling.stage('save'):
+        plt.savefig(join('.', 'graphics', args.outfilename + args.filetype), dpi = 300)
     plt.close()
+
+
+if __name__ == "__main__":
+    
+    args = make_parser().parse_args()
+    
+    profiling.enable(args.profile)
+    
+    plot(args)
@@ -5,8 +5,13 @@ Parameters that are plotted on the log scale are gamma1, epsilon1, epsilon2.  Pa
 y-axis are taken as the limits for the parameter in question across all weeks (including those
 that are not plotted).  
 
+With --density, the draws of each week are binned into a 2D histogram (with bins shared across
+weeks, spanning the axis limits), calculated for all weeks in one pass, and drawn as an image
+with one pixel per bin (a raster layer, also within vector output such as .eps) so that rendering
+time and file size do not grow with the number of posterior draws.  
+
 Usage:
-plot_scatterplot_parameters.py --param1=<parameter1> --param2<parameter2> --weeks 1 2 3 4 5 --filetype=<.eps> --outfilename=<output_filename>
+plot_scatterplot_parameters.py --param1=<parameter1> --param2<parameter2> --weeks 1 2 3 4 5 --filetype=<.eps> --outfilename=<output_filename> [--density] [--bins <bins>]
 
 
 Parameters
@@ -25,6 +30,15 @@ country : str ("japan" or "uk")
 
 outfilename : str
     File name to use for output filetype
+
+density : flag
+    Plot the density of posterior draws (2D histogram) rather than each draw
+
+bins : int (default 100)
+    Number of bins along each axis of the 2D histogram
+
+profile : str (optional)
+    Append timings of each stage to a JSON trace file (default profile.jsonl, see profiling.py)
 """
 
 # # Set latex-related parameters for rending the axes titles (ignored if generating a png file)
@@ -32,13 +46,17 @@ outfilename : str
 # matplotlib.rcParams['font.family'] = 'serif'
 # matplotlib.rcParams['font.serif'] = 'cm'
 
-import sys, os, argparse
+import argparse
 from os.path import join
-import numpy as np, pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.colors import LinearSegmentedColormap
 
 # Import plotting default colours and styles.  
 from colours import *
+import profiling
+from data_cache import read_csv
+from group_index import GroupIndex
 
 def rounddown(x, dp = 2):
     return np.floor(x*(10**dp))/10**dp
@@ -52,7 +70,14 @@ as_logged = ['gamma_1', 'epsilon_1', 'epsilon_2']
 # Use 3 ticks for both axes
 NTICKS = 3
 
-if __name__ == "__main__":
+# Datasets used by plot() (keyword argument: file within the data folder)
+DATA_FILES = {'full': 'parameters_{country}.csv'}
+
+
+def make_parser():
+    """
+    Parser of the command-line arguments of this script
+    """
     
     # Process the input argument
     parser = argparse.ArgumentParser()
@@ -74,23 +99,53 @@ if __name__ == "__main__":
     parser.add_argument("-o", "--outfilename", type = str, 
         help = "Output filename (excluding the filetype suffix)", default = None)
     
-    args = parser.parse_args()
+    parser.add_argument("--density", action = 'store_true',
+        help = "Plot the density of posterior draws (2D histogram) rather than each draw")
+    
+    parser.add_argument("--bins", type = int, default = 100,
+        help = "Number of bins along each axis of the 2D histogram")
+    
+    profiling.add_profile_argument(parser)
+    
+    return parser
+
+
+def plot(args, full = None):
+    """
+    Plot the posterior draws of two parameters against each other for several weeks.  
+    
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Arguments as returned by make_parser().parse_args()
+    
+    full : pandas.DataFrame
+        Posterior parameter draws for the country (read from the data folder if not given)
+    """
+    
+    load = profiling.stage('load').start()
     
     # Import the data
-    if args.country == "uk":
+    if (full is None) and (args.country == "uk"):
         
-        full = pd.read_csv(join('.', 'data', 'parameters_uk.csv'))
+        full = read_csv(join('.', 'data', 'parameters_uk.csv'))
         
         # 'Week 1' in the UK data started on the 19th Feb 2001
         #full['week'] = (full.day - 19)/7.
         
-    elif args.country == "japan":
+    elif (full is None) and (args.country == "japan"):
         
-        full = pd.read_csv(join('.', 'data', 'parameters_japan.csv'))
+        full = read_csv(join('.', 'data', 'parameters_japan.csv'))
         
         # 'Week 1' in the Miyazaki data started on the 27th April 2010
         #full['week'] = (full.day - 27)/7.
     
+    load.stop()
+    compute = profiling.stage('compute').start()
+    
+    # Copy the parameters of interest (as these may be logged below)
+    full = full[list(np.unique(['week', args.param1, args.param2]))].copy()
+    
     weeks = np.array(args.weeks)
     T = len(weeks)
     
@@ -110,15 +165,46 @@ if __name__ == "__main__":
     if args.param2 in as_zero_to_one:
         param2_lims = [0, 1]
     
+    if args.density:
+        # 2D histogram of every week at once (weeks x param1 x param2), with shared bin edges
+        xedges = np.linspace(param1_lims[0], param1_lims[1], args.bins + 1)
+        yedges = np.linspace(param2_lims[0], param2_lims[1], args.bins + 1)
+        
+        week_values = np.unique(weeks)
+        subset = full.loc[full.week.isin(week_values)]
+        week_index = np.searchsorted(week_values, subset.week.values)
+        
+        hist, _ = np.histogramdd(
+            (week_index, subset[args.param1].values, subset[args.param2].values),
+            bins = (np.arange(len(week_values) + 1) - 0.5, xedges, yedges))
+        
+        # Order the histograms as the weeks are plotted, hiding empty bins
+        hist = hist[np.searchsorted(week_values, weeks)]
+        hist = np.ma.masked_equal(hist, 0)
+        
+        cmap = LinearSegmentedColormap.from_list('density',
+            ['white', colour_dict_country[args.country]["chex"]])
+        cmap.set_bad('white')
+    else:
+        # Index the posterior draws by week (once)
+        index = GroupIndex(full, ['week'], [args.param1, args.param2])
+    
+    compute.stop()
+    render = profiling.stage('render').start()
+    
     fig, ax = plt.subplots(ncols = T, nrows = 1)
     
     for axi, t in enumerate(weeks):
         
-        # Subset the dataset to the week in question
-        subset = full[full.week == t]
-        
-        ax[axi].scatter(subset[args.param1], subset[args.param2], 
-            s = 3, lw = 0, c = colour_dict_country[args.country]["crgba"])
+        if args.density:
+            # Drawn as an image (one pixel per bin, also within vector output)
+            ax[axi].imshow(hist[axi].T, cmap = cmap, vmin = 0, vmax = hist.max(),
+                extent = (xedges[0], xedges[-1], yedges[0], yedges[-1]), origin = 'lower',
+                aspect = 'auto', interpolation = 'none')
+        else:
+            # Subset the dataset to the week in question
+            ax[axi].scatter(index.get(args.param1, t), index.get(args.param2, t), 
+                s = 3, lw = 0, c = colour_dict_country[args.country]["crgba"])
         
         ax[axi].set_xlim(param1_lims)
         ax[axi].set_ylim(param2_lims)
@@ -169,5 +255,17 @@ if __name__ == "__main__":
     fig.subplots_adjust(left = 0.09, bottom = 0.2, \
         right = 0.985, top = 0.95, wspace=0.05, hspace=0.0)
     
-    plt.savefig(join('.', 'graphics', filename + args.filetype))
+    render.stop()
+    
+    with profiling.stage('save'):
+        plt.savefig(join('.', 'graphics', filename + args.filetype))
     plt.close()
+
+
+if __name__ == "__main__":
+    
+    args = make_parser().parse_args()
+    
+    profiling.enable(args.profile)
+    
+    plot(args)
@@ -26,10 +26,24 @@ Parameters
 --weeks : space delimited list of ints (i.e. "1 2 3")
     The "weeks since outbreak started" to use for plotting
 
+--objective : str (default "single")
+    Objective of the bootstrap counts shown in panel C (see bootstrap.py)
+
+--statistic : str (default "mean")
+    Statistic of total culls by which controls are ranked in panel B ('mean', 'median', 'var', 
+    'q<percentile>' such as 'q95', or 'cvar<percentile>' such as 'cvar90' for the mean of the 
+    largest 10% of simulations, see statistics_store.py)
+
+--rank_uncertainty : flag
+    Show 95% intervals of the bootstrap rank distributions (from bootstrap.py) in panel B
+
 --figw : width of the output figure
 
 --figh : height of the output figure
 
+--profile : str (optional)
+    Append timings of each stage to a JSON trace file (default profile.jsonl, see profiling.py)
+
 
 W. Probert, 2015
 """
@@ -42,12 +56,50 @@ import matplotlib.patches as mpatches
 from matplotlib.ticker import ScalarFormatter
 
 from colours import *
+import profiling
+from data_cache import read_csv
+from ranking import load_rankings
+from statistics_store import is_statistic
+from group_index import GroupIndex
+from density import violin_stats
+from bootstrap import load_rank_counts, rank_counts_filename, rank_intervals
 
 # Turn off the pandas SettingWithCopyWarning.  
 pd.options.mode.chained_assignment = None
 
+# Datasets used by plot() (keyword argument: file within the data folder)
+DATA_FILES = {'full': 'simulation_output_{country}.csv', 'counts_full': 'counts_{country}.csv'}
 
-if __name__ == "__main__":
+# Variables of the simulation output that are plotted
+VARIABLES = ["total_culls"]
+
+
+def group_index(args, full, counts_full = None):
+    """
+    Index of the simulation output by parameter set, week and control
+    """
+    return GroupIndex(full, ['params_used', 'week', 'control'], VARIABLES)
+
+
+def ranking_table(args, full, counts_full = None):
+    """
+    Ranking table of the controls by the statistic of args.statistic
+    """
+    return load_rankings(args.country, [args.statistic], full = full)
+
+
+# Objects derived from the datasets that may be shared between figures (keyword argument of 
+# plot(): function of the arguments and datasets, and the arguments on which the object depends)
+DERIVED = {
+    'index': (group_index, ['country']),
+    'ranks': (ranking_table, ['country', 'statistic'])
+}
+
+
+def make_parser():
+    """
+    Parser of the command-line arguments of this script
+    """
     
     # Process the input argument
     parser = argparse.ArgumentParser()
@@ -75,13 +127,49 @@ if __name__ == "__main__":
     parser.add_argument("--complete_xtext", type = str, 
         help = "Text on x-axis to denote columns of complete information", default = "Comp.")
     
+    parser.add_argument("--objective", type = str, 
+        help = "Objective of the bootstrap counts shown in panel C (see bootstrap.py)", 
+        default = "single")
+    
+    parser.add_argument("--statistic", type = str, default = "mean", 
+        help = "Statistic by which controls are ranked in panel B (i.e. mean, median, q95, cvar90)")
+    
+    parser.add_argument("--rank_uncertainty", action = "store_true", 
+        help = "Show intervals of the bootstrap rank distributions in panel B")
+    
     parser.add_argument('--figw', type = float, default = 7.5, #48/5.5
         help = "Figure output width")
     
     parser.add_argument('--figh', type = float, default = 4.7, #30/5.5
         help = "Figure output height")
     
-    args = parser.parse_args()
+    profiling.add_profile_argument(parser)
+    
+    return parser
+
+
+def plot(args, full = None, counts_full = None, ranks = None, rank_counts = None, index = None):
+    """
+    Generate the three-panel plot for one country.  
+    
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Arguments as returned by make_parser().parse_args()
+    
+    full, counts_full : pandas.DataFrame
+        Simulation output and bootstrap counts (read from the data folder if not given)
+    
+    ranks : pandas.DataFrame
+        Ranking table of the controls, see ranking.py (loaded or calculated if not given)
+    
+    rank_counts : dict
+        Bootstrap rank counts, see bootstrap.load_rank_counts (loaded if not given and 
+        args.rank_uncertainty is set)
+    
+    index : GroupIndex
+        Index of the simulation output, see group_index() (created if not given)
+    """
     
     sys.stdout.write("Generating plots for: " + args.country + "\n")
     sys.stdout.write("Generating plots with filetype: " + args.filetype + "\n")
@@ -90,28 +178,85 @@ if __name__ == "__main__":
     
     weeks = np.asarray(args.weeks); T = len(args.weeks)
     
-    # Functions for summarising simulation output and then generating rankings of interventions
-    # can use alternative functions - see commented code below.  
-    functions = [np.mean] #lambda x: np.percentile(x, 95)], np.median,np.var,()]
-    function_names = ['mean']#, 'median', 'var', 'q95']95 perc
+    # Statistic for summarising simulation output and then generating rankings of interventions
+    # (see statistics_store.py for alternative statistics, i.e. 'median', 'var', 'q95', 'cvar90')
+    statistic = args.statistic
+    if not is_statistic(statistic):
+        raise ValueError("Unknown statistic: " + statistic)
     
-    variables = ["total_culls"]
+    variables = VARIABLES
     vars_texts = ['Total culls (head)']
     
     # Import the data
-    full = pd.read_csv(join('.', 'data', 'simulation_output_' + args.country + '.csv'))
-    counts_full = pd.read_csv(join('.', 'data', 'counts_' + args.country + '.csv'))
+    with profiling.stage('load'):
+        if full is None:
+            full = read_csv(join('.', 'data', 'simulation_output_' + args.country + '.csv'))
+        if counts_full is None:
+            counts_full = read_csv(join('.', 'data', 'counts_' + args.country + '.csv'))
+    
+    compute = profiling.stage('compute').start()
+    
+    # Rankings of interventions (precomputed by ranking.py if available)
+    if ranks is None:
+        ranks = ranking_table(args, full)
+    ranks = ranks.loc[ranks.statistic == statistic]
+    
+    # Bootstrap counts for the objective of interest (older counts files have one objective)
+    if 'objective' in counts_full.columns:
+        available = sorted(counts_full.objective.unique())
+        counts_full = counts_full.loc[counts_full.objective == args.objective]
+        
+        if counts_full.empty:
+            raise ValueError("No bootstrap counts for objective " + args.objective + 
+                " (available: " + ", ".join(available) + ")")
+    
+    # Intervals of the bootstrap rank distributions (params_used x week x control)
+    if args.rank_uncertainty:
+        if rank_counts is None:
+            # Rank counts are not written by bootstrap.py --exact (which removes them), and rank 
+            # counts older than the counts were not generated with them
+            rankfile = rank_counts_filename(args.country)
+            if not os.path.exists(rankfile):
+                raise ValueError("No rank counts (" + rankfile + "); rerun bootstrap.py "
+                    "without --exact")
+            
+            countsfile = join('.', 'data', 'counts_' + args.country + '.csv')
+            if os.path.exists(countsfile) and \
+                    (os.stat(rankfile).st_mtime < os.stat(countsfile).st_mtime):
+                raise ValueError("Rank counts (" + rankfile + ") are "
+                    "older than the counts; rerun bootstrap.py without --exact")
+            
+            rank_counts = load_rank_counts(args.country)
+        
+        objectives = list(rank_counts['objectives'])
+        if args.objective not in objectives:
+            raise ValueError("No rank counts for objective " + args.objective + 
+                " (available: " + ", ".join(objectives) + ")")
+        io = objectives.index(args.objective)
+        
+        rank_lower, rank_upper = rank_intervals(rank_counts['rank_counts'][:, :, io])
+        rank_params_used = list(rank_counts['params_used'])
+        rank_weeks = [int(w) for w in rank_counts['weeks']]
+        rank_controls = list(rank_counts['controls'])
+    
+    # Index the simulation output and counts by parameter set, week and control (once) so that 
+    # each group is a view rather than a boolean mask across the full dataset
+    if index is None:
+        index = group_index(args, full)
+    counts_index = GroupIndex(counts_full, ['params_used', 'week'], ['control', 'counts'])
+    
+    compute.stop()
     
     # UK-specific parameters
     if args.country == "uk":
-        outbreak_start = pd.datetime(year = 2001, month = 2, day = 19)
+        outbreak_start = pd.Timestamp(year = 2001, month = 2, day = 19)
         
         ctrl_order = ['ip', 'ipdc', 'ipdccp', 'rc3', 'rc10', 'v3', 'v10']
         ctrl_names = ctrl_order
     
     # Miyazaki-specific parameters
     elif args.country == "japan":
-        outbreak_start = pd.datetime(year = 2010, month = 4, day = 20)
+        outbreak_start = pd.Timestamp(year = 2010, month = 4, day = 20)
         
         ctrl_order = ['ip', 'ipdc', 'rc3', 'rc10', 'v3', 'v10']
         ctrl_names = ctrl_order
@@ -127,6 +272,17 @@ if __name__ == "__main__":
     
     for i_p, var, ylabel in zip(range(len(variables)), variables, vars_texts):
         
+        # Density curves of all violins (params_used x week x control) in one batch 
+        # (read from the on-disk cache if these data have been plotted before)
+        groups = [(params, t, ctrl) for params in ['accrued', 'final'] 
+            for t in weeks_to_plot for ctrl in ctrl_order]
+        
+        with profiling.stage('density', items = len(groups), unit = 'violins'):
+            vpstats = dict(zip(groups, 
+                violin_stats([index.get(var, *g) for g in groups], points = 50)))
+        
+        render = profiling.stage('render').start()
+        
         # To change the relative sizing of subplots... 
         nrows = 15; ncols = T
         
@@ -152,31 +308,13 @@ if __name__ == "__main__":
             
             # Subset the data based on the type of parameters used
             # (this is used later for calculating limits of axes)
-            x = full.loc[full.params_used == params][var]
-            
-            subset = full.loc[full.params_used == params]
-            subset = subset.loc[subset.control.isin(ctrl_order)]
-            
-            subset['date'] = outbreak_start + pd.to_timedelta(full.week, unit = 'W')
-            
-            # Within each param set, and within each week, calc rank of ctrls
-            cols_of_int = ['params_used', 'date', 'control']
-            sub = subset.groupby(cols_of_int)[var].agg(functions)
-            sub.columns = function_names
-            sub.reset_index(inplace = True)
-            
-            sub_long = pd.melt(sub, id_vars = ['date', 'control'], value_vars = function_names)
+            x = index.get(var, params)
             
-            sub_long['ranking'] = sub_long.groupby(['variable', 'date'])['value'].rank(
-                ascending = False, method = 'min', na_option = 'keep')
-            
-            # Ensure the ranking of the controls is consistent with their order
-            cat_control = pd.Categorical(sub_long['control'], \
-                categories = ctrl_order, ordered = True)
-            
-            sub_long['control'] = cat_control
-            
-            sub_long = sub_long.sort_values(by = ['date', 'control'], ascending = [1, 1])
+            # Within each param set, and within each week, look up the rank of ctrls
+            rank_params = ranks.loc[ranks.params_used == params]
+            rank_params = rank_params.assign(control = rank_params.control.astype(str))
+            rank_params = rank_params.pivot(index = 'week', columns = 'control', values = 'ranking')
+            rank_params = rank_params.reindex(index = weeks, columns = ctrl_order)
             
             for ii, t in enumerate(weeks):
                 
@@ -191,19 +329,32 @@ if __name__ == "__main__":
                 #   - plot the points of rankings
                 #   - find the previous index, and the next index (within times_to_..)
                 
-                # Using np.float for conversion here cause of ongoing issue with pd.to_timedelta
-                # see here: https://github.com/pandas-dev/pandas/issues/8757
-                date_curr = outbreak_start + pd.to_timedelta(np.float(t), unit = 'W')
-                rank_curr = sub_long.loc[sub_long['date'] == date_curr]
+                # Rankings of the controls in the current week (in the order of ctrl_order)
+                rank_curr = rank_params.loc[t]
                 
                 if t not in skip_weeks:
                     # Plot circles at each forward simulation point.  
-                    rankings.append(rank_curr.ranking.values)
+                    rankings.append(rank_curr.values)
+                    
+                    # Bootstrap rank intervals (plotted with rank 1 at the top, as the rankings)
+                    if args.rank_uncertainty and (int(t) in rank_weeks):
+                        ip = rank_params_used.index(params); iw = rank_weeks.index(int(t))
+                        
+                        for i_cc, cc in enumerate(ctrl_order):
+                            ic = rank_controls.index(cc)
+                            if rank_lower[ip, iw, ic] == 0:
+                                continue
+                            
+                            x_rank = -0.5 + i_v + 0.08*(i_cc - (n - 1)/2.)
+                            axes[1,ax_i].plot([x_rank, x_rank], \
+                                [n + 1 - rank_lower[ip, iw, ic], n + 1 - rank_upper[ip, iw, ic]], \
+                                color = colour_dict_controls[cc]['chex'], linewidth = 1.0, \
+                                alpha = 0.6, solid_capstyle = 'butt')
                     
                     for i_cc, cc in enumerate(ctrl_order):
                         
                         axes[1,ax_i].plot(-0.5 + i_v, \
-                            rank_curr.loc[rank_curr.control == cc].ranking.values,\
+                            rank_curr[cc],\
                             label = cc.upper(), color = colour_dict_controls[cc]['chex'], \
                             linewidth = 0.5, marker = 'o', ms = 5, \
                             markeredgewidth = 0.0, \
@@ -228,11 +379,7 @@ if __name__ == "__main__":
                 else:
                     sys.stdout.write("week " + str(t) + "\n")
                     
-                    cond1 = (full.params_used == params)
-                    cond2 = (full.week == t)
-                    dt = full.loc[cond1 & cond2]
-                    
-                    data = [dt.loc[dt.control == ctrl][var] for ctrl in ctrl_order]
+                    data = [vpstats[(params, t, ctrl)] for ctrl in ctrl_order]
                     
                     # For controls side by side:
                     #pos = np.linspace(1, n, n)*2 + (i_v - 1)
@@ -241,8 +388,8 @@ if __name__ == "__main__":
                     gap = 2
                     pos = np.linspace(1, n, n) + i_v*n + i_v*gap
                     
-                    boxes = axes[0, ax_i].violinplot(data, pos, \
-                        points = 50, widths = [0.7]*n, showmeans = True, \
+                    boxes = axes[0, ax_i].violin(data, pos, \
+                        widths = [0.7]*n, showmeans = True, \
                         showextrema = True, showmedians = True)
                     
                     for b, cc in zip(boxes['bodies'], ctrl_order):
@@ -307,7 +454,7 @@ if __name__ == "__main__":
                     axes[1, ax_i].yaxis.set_ticks_position('left')
                     
                     for tick in axes[i_v, 0].yaxis.get_major_ticks():
-                        tick.label.set_fontsize(8)
+                        tick.label1.set_fontsize(8)
                 else:
                     axes[0, ax_i].set_yticks([])
                     axes[0, ax_i].set_yticklabels([])
@@ -335,11 +482,9 @@ if __name__ == "__main__":
                     pass
                 else:
                     # Plot the stochastic output
-                    c1 = (counts_full.week == t)
-                    c2 = (counts_full.params_used == params)
-                    sub = counts_full.loc[c1&c2]
+                    sub = counts_index.frame(params, t)
                     
-                    sub['colors'] = sub.control.map(colour_dict_controls_hex)
+                    sub['colors'] = sub.control.astype(str).map(colour_dict_controls_hex)
                     
                     sub['control'] = pd.Categorical(sub['control'], ctrl_order)
                     sub = sub.sort_values(by = 'control')
@@ -385,7 +530,7 @@ if __name__ == "__main__":
                     axes[2, ax_i].set_xticklabels([args.accrued_xtext, args.complete_xtext])
             
                 for tick in axes[2, ax_i].xaxis.get_major_ticks():
-                    tick.label.set_fontsize(8)
+                    tick.label1.set_fontsize(8)
             
                 # Add horizontal lines to designate changes in time step
                 # don't put a line on the first or last panels.  
@@ -411,14 +556,14 @@ if __name__ == "__main__":
         axes[1,0].set_yticklabels([n, 1])
         
         for tick in axes[1,0].yaxis.get_major_ticks():
-            tick.label.set_fontsize(8)
+            tick.label1.set_fontsize(8)
         
         # Set the ticks and labels on the stochastic analysis plots
         axes[2,0].set_yticks(np.linspace(0, 1, 2))
         axes[2,0].set_yticklabels(np.linspace(0, 1, 2))
         
         for tick in axes[2,0].yaxis.get_major_ticks():
-            tick.label.set_fontsize(8)
+            tick.label1.set_fontsize(8)
         
         if args.sim_legend:
             ax0 = 0
@@ -486,5 +631,17 @@ if __name__ == "__main__":
         else:
             filename = args.outfilename
         
-        plt.savefig(join('.', 'graphics', filename + args.filetype), dpi = 600)
+        render.stop()
+        
+        with profiling.stage('save'):
+            plt.savefig(join('.', 'graphics', filename + args.filetype), dpi = 600)
         plt.close()
+
+
+if __name__ == "__main__":
+    
+    args = make_parser().parse_args()
+    
+    profiling.enable(args.profile)
+    
+    plot(args)
@@ -0,0 +1,272 @@
+"""
+Summary table of the posterior distribution of every parameter in every week.
+
+The mean and the 0.5, 2.5, 97.5 and 99.5% quantiles of every parameter are calculated, on the
+natural and log scales, for every week and across all weeks (week ALL_WEEKS) in one vectorised
+pass over each parameters file: the draws of all parameters in a week are sorted once (as a
+draws x parameters matrix) and every quantile, on both scales, is interpolated from the sorted
+matrix (as the log is monotonic, the log of the sorted draws are the sorted log draws).
+Quantiles are interpolated linearly between order statistics as in pandas.
+
+The result is a tidy table with one row per (week, parameter, scale) and is cached (in
+`data/.cache/posterior_summary`) keyed by the fingerprint of the parameters file, so that
+plotting scripts only have to look up rows of the table.
+
+Usage:
+
+python posterior_summary.py --countries uk japan [--profile [<trace file>]]
+
+from posterior_summary import load_summary
+summary = load_summary('uk')
+summary.query("parameter == 'gamma_1' & scale == 'log' & week == 1")
+
+
+Parameters
+----------
+--countries : list of str (default "uk japan")
+    Countries for which to summarise the parameters
+
+--profile : str (optional)
+    Append timings of each stage to a JSON trace file (default profile.jsonl, see profiling.py)
+"""
+
+import os, sys, hashlib, argparse
+from os.path import join, exists, dirname
+import numpy as np, pandas as pd
+
+import profiling
+from data_cache import read_csv, fingerprint, CACHE_FOLDER
+from group_index import GroupIndex
+
+# Quantiles in the summary table (column name: quantile)
+QUANTILES = {'q005': 0.005, 'q025': 0.025, 'q975': 0.975, 'q995': 0.995}
+
+# Week of the rows that summarise all weeks
+ALL_WEEKS = -1
+
+# Columns of parameters files that are not parameters
+ID_COLUMNS = ['week', 'rep']
+
+# Columns of the summary table
+COLUMNS = ['week', 'parameter', 'scale', 'n', 'mean'] + list(QUANTILES.keys())
+
+# Folder in which summary tables are cached
+SUMMARY_CACHE = join('.', 'data', CACHE_FOLDER, 'posterior_summary')
+
+# Version of the summary calculation (bump to invalidate cached tables)
+SUMMARY_VERSION = 1
+
+
+def sorted_quantiles(values, n, q):
+    """
+    Quantiles of each column of a matrix whose columns are sorted (with NaN values last).
+    
+    Parameters
+    ----------
+    values : 2D numpy array
+        Sorted values (draws x parameters)
+    
+    n : 1D numpy array of ints
+        Number of values (excluding NaN) in each column
+    
+    q : list of floats
+        Quantiles (between 0 and 1)
+    
+    Returns
+    -------
+    2D numpy array
+        Quantiles (quantiles x parameters), NaN for columns with no values
+    """
+    q = np.asarray(q, dtype = np.float64)
+    
+    rank = q[:, None]*np.maximum(n - 1, 0)[None, :]
+    lower = np.floor(rank).astype(int)
+    upper = np.minimum(lower + 1, np.maximum(n - 1, 0)[None, :])
+    
+    cols = np.arange(values.shape[1])[None, :]
+    v0 = values[lower, cols]; v1 = values[upper, cols]
+    
+    with np.errstate(invalid = 'ignore'):
+        output = np.where(v0 == v1, v0, v0 + (v1 - v0)*(rank - lower))
+    
+    return np.where(n[None, :] > 0, output, np.nan)
+
+
+def summarise_draws(values):
+    """
+    Mean and quantiles of each parameter (column) of a matrix of posterior draws.
+    
+    Returns
+    -------
+    dict
+        Statistics on each scale ('natural' and 'log') as a 2D numpy array of
+        (statistics x parameters) in the order n, mean and QUANTILES.  Log-scale statistics are NaN
+        for parameters with negative values.
+    """
+    values = np.sort(np.asarray(values, dtype = np.float64), axis = 0)
+    n = np.sum(~np.isnan(values), axis = 0)
+    
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        logged = np.log(values)
+    
+    output = {}
+    for scale, x in [('natural', values), ('log', logged)]:
+        with np.errstate(invalid = 'ignore'):
+            mean = np.nansum(x, axis = 0)/n
+        
+        stats = np.vstack([n, mean, sorted_quantiles(x, n, list(QUANTILES.values()))])
+        
+        if scale == 'log':
+            stats[1:, np.nanmin(values, axis = 0) < 0] = np.nan
+        
+        output[scale] = stats
+    
+    return output
+
+
+def summary_table(params, parameters = None):
+    """
+    Summary table of the posterior draws of every parameter, by week and across all weeks.
+    
+    Parameters
+    ----------
+    params : pandas.DataFrame
+        Posterior draws (columns `week`, `rep` and one per parameter)
+    
+    parameters : list of str
+        Parameters to summarise (default is all columns other than ID_COLUMNS)
+    
+    Returns
+    -------
+    pandas.DataFrame
+        Columns `week` (ALL_WEEKS for all weeks), `parameter`, `scale` ('natural' or 'log'), `n`
+        (number of draws), `mean` and the quantiles in QUANTILES
+    """
+    if parameters is None:
+        parameters = [c for c in params.columns if c not in ID_COLUMNS]
+    
+    index = GroupIndex(params, ['week'], parameters)
+    
+    # Draws x parameters matrix, sorted by week
+    draws = np.column_stack([index.columns[p] for p in parameters])
+    
+    blocks = [(ALL_WEEKS, draws)]
+    for g, (w,) in enumerate(index.group_keys):
+        blocks.append((w, draws[index.offsets[g]:index.offsets[g + 1]]))
+    
+    output = []
+    for w, block in blocks:
+        for scale, stats in summarise_draws(block).items():
+            table = pd.DataFrame(stats.T, columns = COLUMNS[3:])
+            table.insert(0, 'scale', scale)
+            table.insert(0, 'parameter', parameters)
+            table.insert(0, 'week', w)
+            output.append(table)
+    
+    table = pd.concat(output, ignore_index = True)
+    table['n'] = table['n'].astype(int)
+    
+    return table.sort_values(['week', 'parameter', 'scale'], kind = 'mergesort').\
+        reset_index(drop = True)[COLUMNS]
+
+
+def sketch_table(summary):
+    """
+    Summary table (as from summary_table) from the sketches of a quantile_sketch.ParameterSummary
+    (i.e. of a parameters file too large to be read into memory).
+    """
+    rows = []
+    for w in [ALL_WEEKS] + summary.weeks:
+        week = None if (w == ALL_WEEKS) else w
+        for p in sorted(summary.parameters):
+            for scale in ['log', 'natural']:
+                log = (scale == 'log')
+                q = summary.quantile(p, list(QUANTILES.values()), week, log)
+                rows.append([w, p, scale, summary.count(p, week), summary.mean(p, week, log)] +
+                    list(q))
+    
+    return pd.DataFrame(rows, columns = COLUMNS)
+
+
+def summary_filename(filename, cachedir = SUMMARY_CACHE):
+    """
+    Cached summary table of a parameters file (keyed by the fingerprint of its contents).
+    """
+    key = hashlib.sha1((str(SUMMARY_VERSION) + ';' + fingerprint(filename)).encode())
+    return join(cachedir, key.hexdigest() + '.csv')
+
+
+def save_summary(table, cached):
+    """
+    Atomically write a summary table to the cache (so that an interrupted write leaves no
+    truncated table).
+    """
+    cachedir = dirname(cached)
+    if not exists(cachedir):
+        os.makedirs(cachedir, exist_ok = True)
+    tmp = cached + '.' + str(os.getpid())
+    table.to_csv(tmp, index = False)
+    os.replace(tmp, cached)
+
+
+def load_summary(country, params = None, datadir = join('.', 'data'), cache = True,
+        cachedir = SUMMARY_CACHE):
+    """
+    Load the summary table of the parameters of a country, calculating it if it is not cached.
+    
+    If `params` is given, the table is calculated from these draws (and is not cached);
+    otherwise the table of `parameters_<country>.csv` in `datadir` is read from the cache, or
+    calculated and cached.
+    
+    Returns
+    -------
+    pandas.DataFrame
+        Summary table (see summary_table)
+    """
+    if params is not None:
+        return summary_table(params)
+    
+    filename = join(datadir, 'parameters_' + country + '.csv')
+    
+    cached = summary_filename(filename, cachedir) if cache else None
+    if (cached is not None) and exists(cached):
+        return pd.read_csv(cached)
+    
+    table = summary_table(read_csv(filename))
+    
+    if cached is not None:
+        save_summary(table, cached)
+    
+    return table
+
+
+if __name__ == "__main__":
+    
+    # Process the input argument
+    parser = argparse.ArgumentParser()
+    
+    parser.add_argument("-c", "--countries", nargs = '+', type = str, default = ['uk', 'japan'],
+        help = "Countries of interest ('uk' and/or 'japan')")
+    
+    profiling.add_profile_argument(parser)
+    
+    args = parser.parse_args()
+    
+    profiling.enable(args.profile)
+    
+    for country in args.countries:
+        sys.stdout.write("Summarising parameters for: " + country + "\n")
+        
+        filename = join('.', 'data', 'parameters_' + country + '.csv')
+        
+        with profiling.stage('load'):
+            params = read_csv(filename)
+        
+        with profiling.stage('compute', items = len(params), unit = 'posterior draws'):
+            table = summary_table(params)
+        
+        with profiling.stage('save'):
+            cached = summary_filename(filename)
+            save_summary(table, cached)
+        
+        sys.stdout.write("    " + cached + "\n")
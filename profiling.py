@@ -0,0 +1,219 @@
+"""
+Stage timing and memory profiling shared by the scripts in this repository.
+
+Scripts mark named stages of their work (i.e. 'load', 'compute', 'render', 'save') and, when
+profiling is enabled (the `--profile` flag of each script), the wall time, CPU time and peak
+memory allocated (traced using tracemalloc) of each stage are appended as one JSON record per
+line to a trace file.  Stages that process a known number of items (i.e. bootstrap samples,
+posterior draws) also record the throughput (items per second).  Records from several scripts
+(i.e. a full run of run.sh) can be appended to the same trace file and summarised using
+aggregate().  When profiling is not enabled, stages do nothing.
+
+Usage:
+
+import profiling
+profiling.add_profile_argument(parser)
+args = parser.parse_args()
+profiling.enable(args.profile)
+
+with profiling.stage('load'):
+    full = read_csv(...)
+
+with profiling.stage('compute', unit = 'bootstrap samples') as s:
+    ...
+    s.items = nboot*ncells
+
+# stages can also be started and stopped explicitly
+render = profiling.stage('render').start()
+...
+render.stop()
+
+Trace files are summarised by stage using:
+
+python profiling.py <trace file> [<trace file> ...]
+"""
+
+import os, sys, time, json, argparse, tracemalloc
+from os.path import basename, splitext
+from datetime import datetime
+
+# Default trace file
+TRACE_FILE = 'profile.jsonl'
+
+# Profiling settings (trace file and script name) set by enable()
+_settings = {'filename': None, 'script': None}
+
+# Stages that have been started but not stopped (innermost last)
+_stack = []
+
+
+def add_profile_argument(parser):
+    """
+    Add the --profile argument to a script's argument parser.
+    """
+    parser.add_argument("--profile", nargs = '?', const = TRACE_FILE, default = None,
+        help = "Append stage timings to a JSON trace file (default " + TRACE_FILE + ")")
+
+
+def enable(filename = TRACE_FILE, script = None):
+    """
+    Enable profiling, appending records to `filename` (profiling is disabled if this is None).
+    
+    `script` labels the records (default is the name of the script being run).
+    """
+    _settings['filename'] = filename
+    _settings['script'] = script if script is not None else splitext(basename(sys.argv[0]))[0]
+    
+    if (filename is not None) and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def enabled():
+    return _settings['filename'] is not None
+
+
+class Stage(object):
+    """
+    A named stage of a script.
+    
+    Attributes
+    ----------
+    name : str
+        Name of the stage
+    
+    items : int
+        Number of items processed in the stage (optional, used for the throughput)
+    
+    unit : str
+        Description of the items (i.e. 'bootstrap samples')
+    
+    record : dict
+        Measurements of the stage (once stopped, if profiling is enabled)
+    """
+    def __init__(self, name, items = None, unit = None):
+        self.name = name
+        self.items = items
+        self.unit = unit
+        self.record = None
+    
+    def start(self):
+        if not enabled():
+            return self
+        
+        # Peak memory so far belongs to all stages that are already running
+        peak = tracemalloc.get_traced_memory()[1]
+        for s in _stack:
+            s._peak = max(s._peak, peak)
+        tracemalloc.reset_peak()
+        
+        self._base, self._peak = tracemalloc.get_traced_memory()
+        self._wall = time.perf_counter(); self._cpu = time.process_time()
+        
+        _stack.append(self)
+        return self
+    
+    def stop(self, items = None):
+        if items is not None:
+            self.items = items
+        
+        if (not enabled()) or (self not in _stack):
+            return self.record
+        
+        wall = time.perf_counter() - self._wall; cpu = time.process_time() - self._cpu
+        self._peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+        
+        _stack.remove(self)
+        for s in _stack:
+            s._peak = max(s._peak, self._peak)
+        
+        self.record = {
+            'script': _settings['script'],
+            'stage': self.name,
+            'depth': len(_stack),
+            'wall_s': wall,
+            'cpu_s': cpu,
+            'peak_mb': (self._peak - self._base)/2.**20,
+            'items': self.items,
+            'unit': self.unit,
+            'throughput': (self.items/wall if (self.items is not None) and (wall > 0) else None),
+            'pid': os.getpid(),
+            'timestamp': datetime.now().isoformat()
+        }
+        
+        with open(_settings['filename'], 'a') as f:
+            f.write(json.dumps(self.record) + "\n")
+        
+        return self.record
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+
+def stage(name, items = None, unit = None):
+    """
+    Stage of a script, to be used as a context manager or started and stopped explicitly.
+    """
+    return Stage(name, items, unit)
+
+
+def read_trace(filenames):
+    """
+    Read the records of one or more trace files as a pandas.DataFrame.
+    """
+    import pandas as pd
+    
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    
+    records = []
+    for filename in filenames:
+        with open(filename) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    
+    return pd.DataFrame(records)
+
+
+def aggregate(filenames):
+    """
+    Summarise the records of one or more trace files by script and stage.
+    
+    Returns
+    -------
+    pandas.DataFrame
+        Number of times each stage was run (calls), total wall and CPU time (s), largest peak
+        memory (MB), total items and throughput (total items per second of wall time)
+    """
+    trace = read_trace(filenames)
+    
+    summary = trace.groupby(['script', 'stage'], sort = False).agg(
+        calls = ('wall_s', 'size'),
+        wall_s = ('wall_s', 'sum'),
+        cpu_s = ('cpu_s', 'sum'),
+        peak_mb = ('peak_mb', 'max'),
+        items = ('items', lambda x: x.sum(min_count = 1)),
+        unit = ('unit', 'first'))
+    
+    summary['throughput'] = summary['items']/summary['wall_s']
+    
+    return summary.reset_index()
+
+
+if __name__ == "__main__":
+    
+    # Process the input argument
+    parser = argparse.ArgumentParser()
+    
+    parser.add_argument("filenames", nargs = '*', default = [TRACE_FILE],
+        help = "Trace files to summarise")
+    
+    args = parser.parse_args()
+    
+    summary = aggregate(args.filenames)
+    
+    sys.stdout.write(summary.to_string(index = False) + "\n")
+    sys.stdout.write("Total wall time (s) of top-level stages: " +
+        "%.2f" % read_trace(args.filenames).query('depth == 0').wall_s.sum() + "\n")
@@ -0,0 +1,334 @@
+"""
+Mergeable quantile sketches and running means for summarising large posterior samples.
+
+A `QuantileSketch` counts values in logarithmically spaced buckets (in the manner of DDSketch)
+so that the order statistics either side of any quantile can be recovered to within a relative
+accuracy (default 0.05%) and interpolated between as in pandas, using memory that depends on the
+range of the values rather than their number.
+Sketches of the same accuracy can be merged, so that, for instance, the sketches of each week
+can be combined to give quantiles across all weeks.
+
+A `ParameterSummary` keeps a sketch and running sums (of values and of their logs) for every
+(week, parameter) of a parameters file, and is updated one chunk of rows at a time so that files
+with millions of posterior draws per week can be summarised with bounded memory.
+
+Usage:
+
+from quantile_sketch import summarise
+summary = summarise(join('.', 'data', 'parameters_uk.csv'))
+summary.table('gamma_1', weeks = [1, 2, 3], log = True)    # week, avg, L95, U95
+summary.quantile('gamma_1', [0.005, 0.995])               # across all weeks
+"""
+
+import numpy as np, pandas as pd
+
+from group_index import GroupIndex
+
+# Default relative accuracy of quantiles
+RELATIVE_ACCURACY = 0.0005
+
+# Maximum number of buckets in each store of a sketch (buckets of the smallest magnitudes are
+# collapsed beyond this)
+MAX_BUCKETS = 2**16
+
+# Default number of rows read at once
+CHUNKSIZE = 100000
+
+# Columns of parameters files that are not parameters
+ID_COLUMNS = ['week', 'rep']
+
+
+class QuantileSketch(object):
+    """
+    Quantile sketch with logarithmically spaced buckets.
+    
+    Value x > 0 is counted in bucket ceil(log(x)/log(gamma)), where
+    gamma = (1 + relative_accuracy)/(1 - relative_accuracy), and negative values are counted in a
+    separate store by their magnitude.  Each bucket is represented by the value with the smallest
+    relative error to all values in the bucket.
+    
+    Attributes
+    ----------
+    relative_accuracy : float
+        Relative accuracy of quantiles
+    
+    count : int
+        Number of values added (excluding NaN)
+    """
+    def __init__(self, relative_accuracy = RELATIVE_ACCURACY, max_buckets = MAX_BUCKETS):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        
+        self.gamma = (1. + relative_accuracy)/(1. - relative_accuracy)
+        self._log_gamma = np.log(self.gamma)
+        
+        self.count = 0
+        self.zero_count = 0
+        
+        # Store of counts for positive (1) and negative (-1) values: [offset, counts]
+        self._stores = {1: [0, np.zeros(0, dtype = np.int64)],
+            -1: [0, np.zeros(0, dtype = np.int64)]}
+    
+    def _index(self, x):
+        return np.ceil(np.log(x)/self._log_gamma).astype(np.int64)
+    
+    def _value(self, index):
+        return 2.*self.gamma**index/(self.gamma + 1.)
+    
+    def _add_to_store(self, sign, indices, counts = None):
+        if len(indices) == 0:
+            return
+        
+        offset, store = self._stores[sign]
+        
+        lo = indices.min(); hi = indices.max()
+        if len(store) > 0:
+            lo = min(lo, offset); hi = max(hi, offset + len(store) - 1)
+        
+        # Grow the store to cover the new indices
+        if (len(store) == 0) or (lo != offset) or (hi - lo + 1 != len(store)):
+            grown = np.zeros(hi - lo + 1, dtype = np.int64)
+            grown[(offset - lo):(offset - lo + len(store))] = store
+            offset, store = lo, grown
+        
+        if counts is None:
+            store += np.bincount(indices - offset, minlength = len(store))
+        else:
+            store += np.bincount(indices - offset, weights = counts,
+                minlength = len(store)).astype(np.int64)
+        
+        # Collapse the buckets of the smallest magnitudes if there are too many
+        if len(store) > self.max_buckets:
+            k = len(store) - self.max_buckets
+            store[k] += store[:k].sum()
+            offset, store = offset + k, store[k:].copy()
+        
+        self._stores[sign] = [offset, store]
+    
+    def add(self, values):
+        """
+        Add an array of values (NaN values are ignored)
+        """
+        values = np.asarray(values, dtype = np.float64).ravel()
+        values = values[~np.isnan(values)]
+        
+        self.count += len(values)
+        self.zero_count += int(np.sum(values == 0))
+        
+        for sign in [1, -1]:
+            x = sign*values
+            x = x[x > 0]
+            self._add_to_store(sign, self._index(x))
+        
+        return self
+    
+    def merge(self, other):
+        """
+        Add the counts of another sketch (of the same relative accuracy) to this sketch
+        """
+        if other.gamma != self.gamma:
+            raise ValueError("Sketches with different relative accuracies cannot be merged")
+        
+        self.count += other.count
+        self.zero_count += other.zero_count
+        
+        for sign in [1, -1]:
+            offset, store = other._stores[sign]
+            nonzero = np.nonzero(store)[0]
+            self._add_to_store(sign, nonzero + offset, store[nonzero])
+        
+        return self
+    
+    def copy(self):
+        sketch = QuantileSketch(self.relative_accuracy, self.max_buckets)
+        return sketch.merge(self)
+    
+    def quantile(self, q):
+        """
+        Quantile(s) q (between 0 and 1) of the values added to the sketch (NaN if empty)
+        """
+        q = np.asarray(q, dtype = np.float64)
+        
+        if self.count == 0:
+            return np.full(q.shape, np.nan) if q.ndim else np.nan
+        
+        # Buckets in ascending order of value: negative, zero, positive
+        noffset, nstore = self._stores[-1]
+        poffset, pstore = self._stores[1]
+        
+        values = np.concatenate([
+            -self._value(np.arange(noffset, noffset + len(nstore)))[::-1],
+            [0.],
+            self._value(np.arange(poffset, poffset + len(pstore)))])
+        counts = np.concatenate([nstore[::-1], [self.zero_count], pstore])
+        
+        # Interpolate linearly between the order statistics either side of the rank (as pandas)
+        rank = q*(self.count - 1)
+        lower = np.floor(rank); upper = np.minimum(lower + 1, self.count - 1)
+        
+        cumulative = np.cumsum(counts)
+        v0 = values[np.searchsorted(cumulative, lower, side = 'right')]
+        v1 = values[np.searchsorted(cumulative, upper, side = 'right')]
+        
+        return v0 + (v1 - v0)*(rank - lower)
+
+
+class ParameterSummary(object):
+    """
+    Running means and quantile sketches of every parameter for every week of a parameters file.
+    
+    Attributes
+    ----------
+    parameters : list of str
+        Parameters summarised (in the order in which they were first seen)
+    
+    weeks : list of ints
+        Weeks summarised (sorted)
+    """
+    def __init__(self, relative_accuracy = RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.parameters = []
+        
+        # (week, parameter): sketch, and [count, sum, sum of logs]
+        self._sketches = {}
+        self._sums = {}
+    
+    @property
+    def weeks(self):
+        return sorted(set(w for w, p in self._sketches.keys()))
+    
+    def update(self, df, parameters = None):
+        """
+        Add the rows of a DataFrame (i.e. one chunk of a parameters file) to the summary
+        """
+        if parameters is None:
+            parameters = [c for c in df.columns if c not in ID_COLUMNS]
+        
+        for p in parameters:
+            if p not in self.parameters:
+                self.parameters.append(p)
+        
+        index = GroupIndex(df, ['week'], parameters)
+        
+        for (w,) in index.group_keys:
+            for p in parameters:
+                x = np.asarray(index.get(p, w), dtype = np.float64)
+                x = x[~np.isnan(x)]
+                
+                key = (w, p)
+                if key not in self._sketches:
+                    self._sketches[key] = QuantileSketch(self.relative_accuracy)
+                    self._sums[key] = np.zeros(3)
+                
+                self._sketches[key].add(x)
+                
+                with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                    self._sums[key] += [len(x), x.sum(), np.log(x).sum()]
+        
+        return self
+    
+    def merge(self, other):
+        """
+        Add another summary (i.e. of another part of the same file) to this summary
+        """
+        for p in other.parameters:
+            if p not in self.parameters:
+                self.parameters.append(p)
+        
+        for key, sketch in other._sketches.items():
+            if key in self._sketches:
+                self._sketches[key].merge(sketch)
+                self._sums[key] += other._sums[key]
+            else:
+                self._sketches[key] = sketch.copy()
+                self._sums[key] = other._sums[key].copy()
+        
+        return self
+    
+    def _totals(self, parameter, week = None):
+        if week is not None:
+            return self._sums[(week, parameter)]
+        
+        return np.sum([s for (w, p), s in self._sums.items() if p == parameter], axis = 0)
+    
+    def count(self, parameter, week = None):
+        return int(self._totals(parameter, week)[0])
+    
+    def mean(self, parameter, week = None, log = False):
+        """
+        Mean of a parameter (or of its log) in a week (or across all weeks if week is None)
+        """
+        n, total, total_log = self._totals(parameter, week)
+        return (total_log if log else total)/n if n > 0 else np.nan
+    
+    def sketch(self, parameter, week = None):
+        """
+        Quantile sketch of a parameter in a week (or across all weeks if week is None)
+        """
+        if week is not None:
+            return self._sketches[(week, parameter)]
+        
+        sketch = QuantileSketch(self.relative_accuracy)
+        for (w, p), s in self._sketches.items():
+            if p == parameter:
+                sketch.merge(s)
+        return sketch
+    
+    def quantile(self, parameter, q, week = None, log = False):
+        """
+        Quantile(s) of a parameter (or of its log) in a week (or across all weeks).
+        
+        Quantiles of the log are accurate to within an absolute error of log(1 + relative
+        accuracy) (about the relative accuracy itself) rather than a relative error.
+        """
+        value = self.sketch(parameter, week).quantile(q)
+        if log:
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                value = np.log(value)
+        return value
+    
+    def table(self, parameter, weeks = None, log = False, lower = 0.025, upper = 0.975):
+        """
+        Mean and quantiles of a parameter (or of its log) by week.
+        
+        Returns
+        -------
+        pandas.DataFrame
+            Columns `week`, `avg`, `L95` and `U95` (the `lower` and `upper` quantiles), for the
+            weeks in `weeks` that have been summarised
+        """
+        if weeks is None:
+            weeks = self.weeks
+        weeks = [int(w) for w in weeks if (int(w), parameter) in self._sketches]
+        
+        rows = []
+        for w in weeks:
+            L, U = self.quantile(parameter, [lower, upper], w, log)
+            rows.append((w, self.mean(parameter, w, log), L, U))
+        
+        return pd.DataFrame(rows, columns = ['week', 'avg', 'L95', 'U95'])
+
+
+def summarise(source, chunksize = CHUNKSIZE, relative_accuracy = RELATIVE_ACCURACY):
+    """
+    Summarise a parameters file (read in chunks of `chunksize` rows) or DataFrame.
+    
+    Parameters
+    ----------
+    source : str or pandas.DataFrame
+        File name of a parameters CSV file, or parameters already in memory
+    
+    Returns
+    -------
+    ParameterSummary
+    """
+    summary = ParameterSummary(relative_accuracy)
+    
+    if isinstance(source, pd.DataFrame):
+        for start in range(0, len(source), chunksize):
+            summary.update(source.iloc[start:(start + chunksize)])
+    else:
+        for chunk in pd.read_csv(source, chunksize = chunksize):
+            summary.update(chunk)
+    
+    return summary
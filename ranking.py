@@ -0,0 +1,170 @@
+"""
+Rank control interventions within each parameter set and week.
+
+Simulation output is summarised by one or more statistics (i.e. the mean total culls) for every
+(params_used, week, control) cell and the controls are ranked within each (params_used, week)
+in a single vectorised pass over the simulation tensor.  The simulations of each cell are sorted
+once (see statistics_store.py), after which the mean, any quantile (i.e. 'q95') and the CVaR at
+any level (i.e. 'cvar90') of every cell are lookups, so that ranking by several statistics costs
+little more than ranking by one.  Rankings follow those in panel B of
+the three-panel plots: controls are ranked in descending order of the statistic (the control
+with the largest statistic has rank 1) with ties given the minimum rank.
+
+The ranking table is saved alongside the bootstrap counts as `rankings_<country>.csv` so that
+plotting only has to look up rankings.
+
+Usage:
+
+python ranking.py --country <country> [--statistics mean median ...] [--profile [<trace file>]]
+
+
+Parameters
+----------
+--country : str ("japan" or "uk")
+
+--statistics : list of str (default "mean")
+    Statistics by which to rank the controls ('mean', 'median', 'var', 'q<percentile>' or 
+    'cvar<percentile>', see statistics_store.py)
+
+--profile : str (optional)
+    Append timings of each stage to a JSON trace file (default profile.jsonl, see profiling.py)
+"""
+
+import os, sys, argparse
+from os.path import join, exists
+import numpy as np, pandas as pd
+
+import profiling
+from data_cache import read_csv
+from simulation_tensor import SimulationTensor, CTRL_ORDER
+from statistics_store import StatisticsStore, is_statistic
+
+def rank_descending(values):
+    """
+    Rank values along the final axis in descending order, with ties given the minimum rank.
+    
+    Parameters
+    ----------
+    values : numpy array
+        Values to rank (NaN values are given a rank of NaN)
+    
+    Returns
+    -------
+    numpy array of floats
+        Rankings (1 is the largest value) with the same shape as `values`
+    """
+    greater = (values[..., None, :] > values[..., :, None]).sum(axis = -1)
+    
+    return np.where(np.isnan(values), np.nan, greater + 1.)
+
+
+def rank_table(tensor, statistics = ['mean'], store = None):
+    """
+    Summary statistics and rankings of controls for every parameter set and week.
+    
+    Parameters
+    ----------
+    tensor : SimulationTensor
+        Simulation output
+    
+    statistics : list of str
+        Names of the statistics by which to rank the controls (see statistics_store.py)
+    
+    store : StatisticsStore
+        Sorted simulation output of `tensor` (created if not given)
+    
+    Returns
+    -------
+    pandas.DataFrame
+        Columns `params_used`, `week`, `control`, `statistic`, `value` and `ranking`, sorted by
+        statistic, parameter set, week and control (in the order of the controls in `tensor`)
+    """
+    P, W, C, R = tensor.shape
+    
+    if store is None:
+        store = StatisticsStore.from_tensor(tensor)
+    
+    output = []
+    for name in statistics:
+        value = store.statistic(name)
+        value[~tensor.mask] = np.nan
+        
+        output.append(pd.DataFrame({
+            'params_used': np.repeat(tensor.params_used, W*C),
+            'week': np.tile(np.repeat(tensor.weeks, C), P),
+            'control': np.tile(tensor.controls, P*W),
+            'statistic': name,
+            'value': value.ravel(),
+            'ranking': rank_descending(value).ravel()}))
+    
+    table = pd.concat(output, ignore_index = True)
+    
+    return table.loc[table.value.notnull()].reset_index(drop = True)
+
+
+def rankings_filename(country, datadir = join('.', 'data')):
+    return join(datadir, 'rankings_' + country + '.csv')
+
+
+def load_rankings(country, statistics = ['mean'], full = None, datadir = join('.', 'data')):
+    """
+    Load the ranking table for a country, calculating it if it is missing or out of date.
+    
+    The saved table (`rankings_<country>.csv`) is used if it is newer than the simulation output
+    and contains all requested statistics; otherwise rankings are calculated from `full` (or
+    from the simulation output in the data folder if `full` is not given).
+    
+    Returns
+    -------
+    pandas.DataFrame
+        Ranking table (see rank_table) for the requested statistics
+    """
+    filename = rankings_filename(country, datadir)
+    simfile = join(datadir, 'simulation_output_' + country + '.csv')
+    
+    if exists(filename) and \
+            ((not exists(simfile)) or (os.stat(filename).st_mtime >= os.stat(simfile).st_mtime)):
+        table = read_csv(filename)
+        if np.all(np.isin(statistics, table.statistic.astype(str).unique())):
+            return table.loc[table.statistic.isin(statistics)]
+    
+    if full is None:
+        tensor = SimulationTensor.load(country, datadir = datadir)
+    else:
+        tensor = SimulationTensor.from_frame(full, CTRL_ORDER[country])
+    
+    return rank_table(tensor, statistics)
+
+
+if __name__ == "__main__":
+    
+    # Process the input argument
+    parser = argparse.ArgumentParser()
+    
+    parser.add_argument("-c", "--country", type = str, required = True,
+        help = "Country of interest ('uk' or 'japan')")
+    
+    parser.add_argument("--statistics", nargs = '+', type = str, default = ['mean'],
+        help = "Statistics by which to rank the controls (i.e. mean median q95 cvar90)")
+    
+    profiling.add_profile_argument(parser)
+    
+    args = parser.parse_args()
+    
+    for name in args.statistics:
+        if not is_statistic(name):
+            parser.error("unknown statistic: " + name)
+    
+    profiling.enable(args.profile)
+    
+    sys.stdout.write("Ranking controls for: " + args.country + "\n")
+    
+    with profiling.stage('load'):
+        tensor = SimulationTensor.load(args.country)
+    
+    with profiling.stage('compute', unit = 'cells') as compute:
+        table = rank_table(tensor, args.statistics)
+        compute.items = len(table)
+    
+    with profiling.stage('save'):
+        table.to_csv(rankings_filename(args.country), index = False)
@@ -0,0 +1,404 @@
+"""
+Calculate the instantaneous risk of onward spread for an average-sized farm to an average-sized
+farm, integrated across a range of distances, for every draw of the posterior distribution.
+
+Susceptibility, transmissibility and the distance kernel are evaluated for all posterior draws
+(across all weeks) and all distances as a single broadcast (draws x distances) array
+calculation.  Draws are processed in chunks of `chunksize` to cap memory use.  
+
+By default (--integration=grid) the kernel is summed across 100 squared distances between 0 and 
+500, as in figures 1 and S4.  Alternatively the kernel can be integrated across the same range of 
+squared distances, either using the closed-form antiderivative of the kernel (--integration=exact) 
+or using adaptive quadrature to within a relative error of --tolerance (--integration=adaptive, 
+which can be used for other kernels).  Integrals are divided by the spacing of the grid so that 
+they are on the same scale as the grid sum, and the difference from the grid sum is reported.  
+
+Usage:
+
+python risk_engine.py [--countries uk japan] [--weeks 1 2 3 ...] [--chunksize <n>] [--outfilename <file>] [--integration <grid|exact|adaptive>] [--tolerance <tol>] [--profile [<trace file>]]
+
+or from Python:
+
+from risk_engine import risk_by_week
+risks = risk_by_week(df_params, japan = False)
+
+
+Parameters
+----------
+--countries : list of str (default "uk japan")
+    Countries for which to calculate the risk of onward transmission
+
+--weeks : space delimited list of ints (i.e. "1 2 3")
+    The "weeks since outbreak started" to use (default is all weeks)
+
+--chunksize : int (default 50000)
+    Maximum number of posterior draws processed at once
+
+--outfilename : str
+    Output CSV file (default "./data/risk_onward_transmission.csv")
+
+--integration : str ("grid", "exact" or "adaptive"; default "grid")
+    Method used to integrate the kernel across distances
+
+--tolerance : float (default 1e-8)
+    Relative error tolerance for adaptive quadrature
+
+--profile : str (optional)
+    Append timings of each stage to a JSON trace file (default profile.jsonl, see profiling.py)
+"""
+
+import sys, argparse, warnings
+from os.path import join
+import numpy as np, pandas as pd
+
+import profiling
+from data_cache import read_csv
+
+# Squared distances across which the kernel is summed
+DSQ = np.linspace(0, 500, 100)
+
+# Default number of posterior draws processed at once
+CHUNKSIZE = 50000
+
+# Methods for integrating the kernel across distances
+INTEGRATION_METHODS = ['grid', 'exact', 'adaptive']
+
+# Default relative error tolerance, and maximum number of panels, for adaptive quadrature
+TOLERANCE = 1e-8
+MAX_PANELS = 2**14
+
+
+def susceptibility(row, japan = False):
+    """
+    Calculate farm-level susceptibility for an average-sized susceptible farm.
+    
+    Parameters
+    ----------
+    row : object
+        Object with attributes psi_1, psi_2, xi_2 for Japan and additional xi_3, psi_3 for UK.
+    japan : boolean
+        Should this calculation be for the Miyazaki model?
+    
+    Returns
+    -------
+    Float
+        Farm-level susceptibility
+    """
+    
+    if japan:
+        v = 1**row.psi_1 + row.xi_2*1**row.psi_2
+    else:
+        v = 1**row.psi_1 + row.xi_2*1**row.psi_2 + row.xi_3*1**row.psi_3
+    
+    return v
+
+
+def transmissibility(row, japan = False):
+    """
+    Calculate farm-level transmissibility
+    
+    Parameters
+    ----------
+    row : object
+        Object with attributes phi_1, phi_2, zeta_2 for Japan and additional zeta_3, phi_3 for UK.
+    japan : boolean
+        Should this calculation be for the Miyazaki model?
+    
+    Returns
+    -------
+    Float
+        Farm-level transmissibility
+    """
+    
+    if japan:
+        v = 1**row.phi_1 + row.zeta_2*1**row.phi_2
+    else:
+        v = 1**row.phi_1 + row.zeta_2*1**row.phi_2 + row.zeta_3*1**row.phi_3
+    
+    return v
+
+
+def K(Dsq, delta, omega = 1.3):
+    """
+    Evaluate the distance kernel function
+    
+    Parameters
+    ----------
+    Dsq : float
+        Squared-distance at which to evaluate the kernel
+    
+    delta, omega : floats
+        Parameters of the distance kernel (see Methods appendix of the manuscript for details)
+    
+    Returns
+    -------
+    Float
+        Distance kernel with parameters `delta` and `omega` evaluated at squared-distance `Dsq`
+    
+    """
+    return delta/(delta**2 + Dsq)**omega
+
+
+def K_integral(a, b, delta, omega = 1.3):
+    """
+    Closed-form integral of the distance kernel across squared distances from `a` to `b`
+    
+    Parameters
+    ----------
+    a, b : floats
+        Limits of integration (squared distances)
+    
+    delta, omega : floats (or numpy arrays)
+        Parameters of the distance kernel
+    
+    Returns
+    -------
+    Float
+        Integral of `K(Dsq, delta, omega)` with respect to `Dsq` from `a` to `b`
+    """
+    if omega == 1:
+        return delta*(np.log(delta**2 + b) - np.log(delta**2 + a))
+    
+    return delta/(1. - omega)*((delta**2 + b)**(1. - omega) - (delta**2 + a)**(1. - omega))
+
+
+def adaptive_integral(kernel, a, b, delta, tolerance = TOLERANCE, max_panels = MAX_PANELS):
+    """
+    Integrate a kernel across squared distances for many kernel parameters at once.  
+    
+    Composite Simpson's rule is applied after substituting Dsq = a + (b - a) t^3, which places 
+    more nodes at short distances where distance kernels are peaked.  The number of panels is 
+    doubled for those parameters that have not converged until the change in the estimate is 
+    within `tolerance` (relative) or `max_panels` is reached, in which case a RuntimeWarning 
+    gives the largest remaining error estimate.  
+    
+    Parameters
+    ----------
+    kernel : function
+        Kernel with signature kernel(Dsq, delta), vectorised over numpy arrays
+    
+    a, b : floats
+        Limits of integration (squared distances)
+    
+    delta : 1D numpy array
+        Kernel parameter for each posterior draw
+    
+    tolerance : float
+        Relative error tolerance
+    
+    max_panels : int
+        Maximum number of Simpson panels (more than the 16 panels of the first estimate)
+    
+    Returns
+    -------
+    1D numpy array
+        Integral of the kernel for each value of `delta`
+    """
+    def simpson(d, n):
+        t = np.linspace(0, 1, n + 1)
+        w = np.ones(n + 1); w[1:-1:2] = 4; w[2:-1:2] = 2
+        w *= 3.*(b - a)*t**2/(3.*n)
+        return np.dot(kernel(a + (b - a)*t**3, d[:, None]), w)
+    
+    if max_panels <= 16:
+        raise ValueError("max_panels must be more than 16 (the panels of the first estimate): " + 
+            str(max_panels))
+    
+    delta = np.asarray(delta, dtype = np.float64)
+    
+    n = 16
+    result = simpson(delta, n)
+    todo = np.arange(len(delta))
+    
+    while (len(todo) > 0) and (n < max_panels):
+        n *= 2
+        estimate = simpson(delta[todo], n)
+        
+        # Richardson estimate of the error of Simpson's rule
+        error = np.abs(estimate - result[todo])/15.
+        result[todo] = estimate
+        
+        unconverged = (error > tolerance*np.abs(estimate))
+        todo = todo[unconverged]
+        error = error[unconverged]/np.abs(estimate[unconverged])
+    
+    if len(todo) > 0:
+        warnings.warn("Kernel integral did not converge within " + str(max_panels) + 
+            " panels for " + str(len(todo)) + " of " + str(len(delta)) + 
+            " parameter values (largest relative error estimate %.3g, tolerance %.3g)" % 
+            (np.max(error), tolerance), RuntimeWarning)
+    
+    return result
+
+
+def grid_difference(risk, risk_grid):
+    """
+    Summarise the difference between risks and those calculated by summing across the grid
+    
+    Returns
+    -------
+    dict
+        Median and maximum absolute difference on the log10 scale, and median relative difference
+    """
+    diff = np.log10(risk) - np.log10(risk_grid)
+    
+    return {'median_abs_log10_diff': np.median(np.abs(diff)), 
+        'max_abs_log10_diff': np.max(np.abs(diff)), 
+        'median_relative_diff': np.median(risk/risk_grid - 1.)}
+
+
+def onward_risk(params, japan = False, Dsq = DSQ, chunksize = CHUNKSIZE, 
+        integration = 'grid', tolerance = TOLERANCE, kernel = K):
+    """
+    Instantaneous risk of onward transmission for each posterior draw.
+    
+    Parameters
+    ----------
+    params : pandas.DataFrame
+        Posterior draws with one row per draw (columns as in `parameters_<country>.csv`)
+    
+    japan : boolean
+        Should this calculation be for the Miyazaki model?
+    
+    Dsq : 1D numpy array
+        Squared distances across which the kernel is summed (evenly spaced)
+    
+    chunksize : int
+        Maximum number of draws processed at once
+    
+    integration : str ("grid", "exact" or "adaptive")
+        Sum the kernel across `Dsq` ("grid") or integrate it from the first to the last value of 
+        `Dsq` in closed form ("exact") or by adaptive quadrature ("adaptive").  Integrals are 
+        divided by the spacing of `Dsq` so that they are on the same scale as the grid sum.  
+    
+    tolerance : float
+        Relative error tolerance for adaptive quadrature
+    
+    kernel : function
+        Distance kernel with signature kernel(Dsq, delta) (the closed-form integral is only 
+        available for `K`)
+    
+    Returns
+    -------
+    1D numpy array
+        Risk of onward transmission for each row of `params`
+    """
+    if integration not in INTEGRATION_METHODS:
+        raise ValueError("Unknown integration method: " + str(integration))
+    
+    if (integration == 'exact') and (kernel is not K):
+        raise ValueError("Closed-form integration is only available for the kernel K")
+    
+    Dsq = np.asarray(Dsq, dtype = np.float64)
+    spacing = (Dsq[-1] - Dsq[0])/(len(Dsq) - 1.)
+    
+    risk = np.empty(len(params))
+    
+    for start in range(0, len(params), chunksize):
+        chunk = params.iloc[start:(start + chunksize)].astype(np.float64)
+        
+        scale = chunk.gamma_1 * susceptibility(chunk, japan) * transmissibility(chunk, japan)
+        
+        delta = chunk.delta.values
+        
+        if integration == 'exact':
+            total = K_integral(Dsq[0], Dsq[-1], delta)/spacing
+        elif integration == 'adaptive':
+            total = adaptive_integral(kernel, Dsq[0], Dsq[-1], delta, tolerance)/spacing
+        else:
+            # (draws x distances) array of the kernel, summed across distances
+            total = kernel(Dsq[None, :], delta[:, None]).sum(axis = 1)
+        
+        risk[start:(start + chunksize)] = scale.values * total
+    
+    return risk
+
+
+def risk_by_week(params, japan = False, weeks = None, **kwargs):
+    """
+    Risk of onward transmission for each posterior draw of each week, calculated in one pass.
+    
+    Parameters
+    ----------
+    params : pandas.DataFrame
+        Posterior draws (columns as in `parameters_<country>.csv`)
+    
+    japan : boolean
+        Should this calculation be for the Miyazaki model?
+    
+    weeks : list of int
+        Weeks for which to calculate the risk (default is all weeks)
+    
+    kwargs
+        Passed to `onward_risk`
+    
+    Returns
+    -------
+    pandas.DataFrame
+        Columns `week`, `rep` and `risk`
+    """
+    if weeks is not None:
+        params = params.loc[params.week.isin(weeks)]
+    
+    return pd.DataFrame({
+        'week': params.week.values,
+        'rep': params.rep.values,
+        'risk': onward_risk(params, japan, **kwargs)})
+
+
+if __name__ == "__main__":
+    
+    # Process the input argument
+    parser = argparse.ArgumentParser()
+    
+    parser.add_argument("-c", "--countries", nargs = '+', type = str, default = ['uk', 'japan'],
+        help = "Countries of interest ('uk' and/or 'japan')")
+    
+    parser.add_argument('-w','--weeks', nargs = '+', type = int, default = None)
+    
+    parser.add_argument("--chunksize", type = int,
+        help = "Maximum number of posterior draws processed at once", default = CHUNKSIZE)
+    
+    parser.add_argument("--outfilename", type = str,
+        help = "Output CSV file", default = join('.', 'data', 'risk_onward_transmission.csv'))
+    
+    parser.add_argument("--integration", type = str, choices = INTEGRATION_METHODS,
+        help = "Method used to integrate the kernel across distances", default = 'grid')
+    
+    parser.add_argument("--tolerance", type = float,
+        help = "Relative error tolerance for adaptive quadrature", default = TOLERANCE)
+    
+    profiling.add_profile_argument(parser)
+    
+    args = parser.parse_args()
+    
+    profiling.enable(args.profile)
+    
+    output = []
+    for country in args.countries:
+        sys.stdout.write("Calculating risk of onward transmission for: " + country + "\n")
+        
+        with profiling.stage('load'):
+            df_params = read_csv(join('.', 'data', 'parameters_' + country + '.csv'))
+        
+        with profiling.stage('compute', unit = 'posterior draws') as compute:
+            risks = risk_by_week(df_params, (country == "japan"), args.weeks,
+                chunksize = args.chunksize, integration = args.integration, 
+                tolerance = args.tolerance)
+            compute.items = len(risks)
+        
+        if args.integration != 'grid':
+            with profiling.stage('compute_grid', unit = 'posterior draws') as compute:
+                risks['risk_grid'] = risk_by_week(df_params, (country == "japan"), args.weeks,
+                    chunksize = args.chunksize).risk.values
+                compute.items = len(risks)
+            
+            diff = grid_difference(risks.risk.values, risks.risk_grid.values)
+            sys.stdout.write("Difference from grid sum (" + country + "): " + 
+                ", ".join(k + " = " + "%.4g" % v for k, v in diff.items()) + "\n")
+        
+        risks.insert(0, 'country', country)
+        output.append(risks)
+    
+    with profiling.stage('save'):
+        pd.concat(output).to_csv(args.outfilename, index = False)
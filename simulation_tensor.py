@@ -0,0 +1,169 @@
+"""
+Dense tensor representation of simulation output.
+
+Simulation output has a regular shape: parameter set ('final' or 'accrued') x week x control x
+simulation repetition.  The `SimulationTensor` class stores one variable (i.e. `total_culls`) of
+`simulation_output_<country>.csv` as a contiguous array with these four axes so that any
+(params_used, week) or (params_used, week, control) slice is a view rather than a scan of the
+full dataset.  Repetitions are the final (contiguous) axis.  Cells with fewer repetitions than
+the largest cell (or that are missing, i.e. skipped weeks) are padded with NaN and the number
+of repetitions in each cell is stored in `nreps`.
+
+Usage:
+
+from simulation_tensor import SimulationTensor
+tensor = SimulationTensor.load('uk')
+tensor.cell('accrued', 5)            # (controls x reps) array for week 5
+tensor.control('final', 5, 'rc3')    # 1D array of total culls under rc3
+"""
+
+from os.path import join
+import numpy as np, pandas as pd
+
+from data_cache import read_csv
+
+# Parameter sets used to generate the simulations
+PARAMS_USED = ['final', 'accrued']
+
+# Order of control interventions within each country
+CTRL_ORDER = {
+    'uk': ['ip', 'ipdc', 'ipdccp', 'rc3', 'rc10', 'v3', 'v10'],
+    'japan': ['ip', 'ipdc', 'rc3', 'rc10', 'v3', 'v10']
+}
+
+
+def tie_order(controls):
+    """
+    Position of each control in the order in which ties for the optimal control are won: 
+    alphabetical, as in the published counts (for which the simulations of each cell were sorted 
+    by control before taking idxmin), so that i.e. rc10 wins a tie with rc3.  
+    """
+    return np.argsort(np.argsort(np.asarray(controls), kind = 'stable'), kind = 'stable')
+
+
+class SimulationTensor(object):
+    """
+    Simulation output stored as a (params_used x week x control x rep) array.
+    
+    Attributes
+    ----------
+    values : 4D numpy array of floats
+        Simulation output, padded with NaN where a cell has fewer repetitions than the largest cell
+    
+    nreps : 3D numpy array of ints
+        Number of repetitions in each (params_used, week, control) cell
+    
+    params_used, weeks, controls : lists
+        Labels of the first three axes of `values`
+    """
+    def __init__(self, values, nreps, params_used, weeks, controls):
+        self.values = values
+        self.nreps = nreps
+        self.params_used = list(params_used)
+        self.weeks = [int(w) for w in weeks]
+        self.controls = list(controls)
+        
+        self._params_index = dict((p, i) for i, p in enumerate(self.params_used))
+        self._week_index = dict((w, i) for i, w in enumerate(self.weeks))
+        self._control_index = dict((c, i) for i, c in enumerate(self.controls))
+    
+    @property
+    def shape(self):
+        return self.values.shape
+    
+    @property
+    def mask(self):
+        """
+        Boolean array (params_used x week x control) of cells that contain simulations
+        """
+        return self.nreps > 0
+    
+    @classmethod
+    def from_frame(cls, df, controls, params_used = PARAMS_USED, var = 'total_culls'):
+        """
+        Build a tensor from a long dataset of simulation output.
+        
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            Dataset with columns `week`, `params_used`, `control` and `var` (and optionally
+            `rep`, which sets the order of the repetitions within each cell)
+        
+        controls : list of str
+            Controls to include, in the order in which they are stored
+        
+        params_used : list of str
+            Parameter sets to include, in the order in which they are stored
+        
+        var : str
+            Variable to store in the tensor
+        """
+        df = df.loc[df.params_used.isin(params_used) & df.control.isin(controls)]
+        
+        weeks = np.unique(df.week.values)
+        
+        p = pd.Categorical(df.params_used, categories = params_used).codes.astype(np.intp)
+        w = np.searchsorted(weeks, df.week.values)
+        c = pd.Categorical(df.control, categories = controls).codes.astype(np.intp)
+        
+        # Position of each row within its cell (in order of rep, if available)
+        cell = (p*len(weeks) + w)*len(controls) + c
+        if 'rep' in df.columns:
+            order = np.lexsort((df.rep.values, cell))
+        else:
+            order = np.argsort(cell, kind = 'mergesort')
+        
+        cell_sorted = cell[order]
+        ncells = len(params_used)*len(weeks)*len(controls)
+        nreps = np.bincount(cell_sorted, minlength = ncells)
+        starts = np.concatenate(([0], np.cumsum(nreps)[:-1]))
+        position = np.arange(len(cell_sorted)) - starts[cell_sorted]
+        
+        R = nreps.max() if len(nreps) else 0
+        values = np.full(ncells*R, np.nan)
+        values[cell_sorted*R + position] = df[var].values[order]
+        
+        shape = (len(params_used), len(weeks), len(controls))
+        return cls(values.reshape(shape + (R,)), nreps.reshape(shape),
+            params_used, weeks, controls)
+    
+    @classmethod
+    def load(cls, country, var = 'total_culls', datadir = join('.', 'data')):
+        """
+        Load the tensor of simulation output for a country ('uk' or 'japan').
+        """
+        df = read_csv(join(datadir, 'simulation_output_' + country + '.csv'))
+        return cls.from_frame(df, CTRL_ORDER[country], var = var)
+    
+    def params_index(self, params_used):
+        return self._params_index[params_used]
+    
+    def week_index(self, week):
+        return self._week_index[int(week)]
+    
+    def control_index(self, control):
+        return self._control_index[control]
+    
+    def has_week(self, week):
+        return int(week) in self._week_index
+    
+    def cell(self, params_used, week):
+        """
+        (control x rep) view of the simulation output for one parameter set and week
+        """
+        return self.values[self.params_index(params_used), self.week_index(week)]
+    
+    def cell_nreps(self, params_used, week):
+        """
+        Number of repetitions of each control for one parameter set and week
+        """
+        return self.nreps[self.params_index(params_used), self.week_index(week)]
+    
+    def control(self, params_used, week, control):
+        """
+        1D view of the simulation output for one parameter set, week and control
+        """
+        i = self.params_index(params_used)
+        j = self.week_index(week)
+        k = self.control_index(control)
+        return self.values[i, j, k, :self.nreps[i, j, k]]
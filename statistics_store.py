@@ -0,0 +1,167 @@
+"""
+Sorted store of simulation output for summary statistics of every group in constant time.
+
+A `StatisticsStore` sorts the simulations of each (params_used, week, control) group of a
+SimulationTensor once and stores the prefix sums of the sorted values.  Any statistic of every
+group is then a lookup rather than another reduction over the simulation output: the mean is a
+prefix sum, any quantile is an interpolation between two sorted values and the conditional value
+at risk (CVaR, the mean of the largest (1 - alpha) fraction of simulations) at any level is a
+difference of two prefix sums.  Rankings of the controls under many statistics and risk-aversion
+levels are therefore calculated from one sort of the simulation output.
+
+Statistics are named as follows (see `statistic`):
+
+* 'mean', 'median' and 'var' (variance, with zero degrees of freedom as numpy.var)
+* 'q<percentile>' : percentile of total culls (i.e. 'q95', 'q99.5'), interpolated linearly as
+  numpy.percentile
+* 'cvar<percentile>' : mean of the total culls above the percentile (i.e. 'cvar90' is the mean of
+  the largest 10% of simulations, as the 'cvar' objective of bootstrap.py); 'cvar' uses the level
+  CVAR_ALPHA (also used by bootstrap.py)
+
+Usage:
+
+from statistics_store import StatisticsStore
+store = StatisticsStore.from_tensor(tensor)
+store.statistic('q95')          # (params_used x week x control) array
+store.cvar(0.99)                # mean of the largest 1% of simulations of each group
+"""
+
+import re
+import numpy as np
+
+# Fraction of simulations below the tail averaged by 'cvar'
+CVAR_ALPHA = 0.9
+
+# Statistics with a level (percentile) appended to the name
+_LEVEL_STATISTIC = re.compile(r'^(q|cvar)(\d+(\.\d*)?)$')
+
+
+def parse_statistic(name):
+    """
+    Kind and level of a statistic name (i.e. ('q', 0.95) for 'q95', ('mean', None) for 'mean').
+    """
+    if name in ['mean', 'median', 'var']:
+        return name, None
+    
+    if name == 'cvar':
+        return 'cvar', CVAR_ALPHA
+    
+    match = _LEVEL_STATISTIC.match(name)
+    if (match is None) or (float(match.group(2)) > 100.):
+        raise ValueError("Unknown statistic: " + str(name))
+    
+    return match.group(1), float(match.group(2))/100.
+
+
+def tail_size(alpha, n):
+    """
+    Number of the largest of `n` values in the (1 - alpha) tail, at least one (rounded before 
+    taking the ceiling so that i.e. (1 - 0.95)*2000 = 100.00000000000009 gives 100)
+    """
+    return np.maximum(1, np.ceil(np.round((1. - alpha)*np.asarray(n), 9)).astype(int))
+
+
+def is_statistic(name):
+    try:
+        parse_statistic(name)
+    except ValueError:
+        return False
+    return True
+
+
+class StatisticsStore(object):
+    """
+    Simulation output sorted within each group, with prefix sums.
+    
+    Attributes
+    ----------
+    sorted : numpy array of floats
+        Simulation output sorted along the final axis (... x reps), padded with NaN
+    
+    nreps : numpy array of ints
+        Number of simulations of each group
+    
+    prefix : numpy array of floats
+        Sums of the smallest 0, 1, ..., reps simulations of each group (... x reps + 1)
+    """
+    def __init__(self, values, nreps):
+        self.nreps = np.asarray(nreps)
+        
+        # NaN padding is sorted to the end of each group
+        self.sorted = np.sort(values, axis = -1)
+        
+        R = values.shape[-1]
+        self.prefix = np.zeros(values.shape[:-1] + (R + 1,))
+        np.cumsum(np.where(np.isnan(self.sorted), 0., self.sorted), axis = -1,
+            out = self.prefix[..., 1:])
+        
+        # Sum of squared deviations from the mean of each group (for the variance)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            deviation = self.sorted - self.mean()[..., None]
+        self._sumsq = np.nansum(deviation**2, axis = -1)
+    
+    @classmethod
+    def from_tensor(cls, tensor):
+        """
+        Store of the (params_used x week x control) groups of a SimulationTensor.
+        """
+        return cls(tensor.values, tensor.nreps)
+    
+    def _at(self, array, index):
+        """
+        Value of each group of `array` at the position `index` of the group (... x positions)
+        """
+        return np.take_along_axis(array, index[..., None], axis = -1)[..., 0]
+    
+    def _empty(self, value):
+        return np.where(self.nreps > 0, value, np.nan)
+    
+    def mean(self):
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return self._empty(self._at(self.prefix, self.nreps)/self.nreps)
+    
+    def var(self, ddof = 0):
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return np.where(self.nreps > ddof, self._sumsq/(self.nreps - ddof), np.nan)
+    
+    def quantile(self, q):
+        """
+        Quantile `q` (between 0 and 1) of each group, interpolated linearly between the
+        simulations either side (as numpy.percentile)
+        """
+        h = np.maximum(self.nreps - 1, 0)*q
+        lower = np.floor(h).astype(int)
+        upper = np.minimum(lower + 1, np.maximum(self.nreps - 1, 0))
+        
+        low = self._at(self.sorted, lower)
+        high = self._at(self.sorted, upper)
+        
+        return self._empty(low + (h - lower)*(high - low))
+    
+    def cvar(self, alpha = CVAR_ALPHA):
+        """
+        Mean of the largest (1 - alpha) fraction of simulations (at least one) of each group
+        """
+        m = np.minimum(tail_size(alpha, self.nreps), np.maximum(self.nreps, 1))
+        
+        total = self._at(self.prefix, self.nreps) - \
+            self._at(self.prefix, np.maximum(self.nreps - m, 0))
+        
+        return self._empty(total/m)
+    
+    def statistic(self, name):
+        """
+        Statistic of each group by name (see the module docstring)
+        """
+        kind, level = parse_statistic(name)
+        
+        if kind == 'mean':
+            return self.mean()
+        elif kind == 'median':
+            return self.quantile(0.5)
+        elif kind == 'var':
+            return self.var()
+        elif kind == 'q':
+            return self.quantile(level)
+        else:
+            return self.cvar(level)
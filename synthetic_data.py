@@ -0,0 +1,252 @@
+"""
+Generate synthetic datasets with the schemas of the datasets in the `data` folder.
+
+Synthetic versions of `simulation_output_<country>.csv`, `parameters_<country>.csv` and
+`counts_<country>.csv` (see data/README.md) are generated for testing and benchmarking the
+analysis pipeline when the published data are not available, or at a multiple of the published
+size.  Values are not meant to resemble the published results: total culls are drawn from a
+log-normal distribution for each control that shifts over the weeks of the outbreak, parameters
+from log-normal posteriors that narrow over the weeks of the outbreak, and counts from a
+multinomial distribution with random proportions.  Simulation output is written one
+(params_used, week) cell at a time so that memory use does not grow with the number of
+repetitions.
+
+Usage:
+
+python synthetic_data.py [--countries uk japan] [--scale <scale>] [--reps <n>] [--weeks 1 2 3 ...] [--controls ip ipdc ...] [--datadir <folder>] [--randomseed <seed>] [--profile [<trace file>]]
+
+
+Parameters
+----------
+--countries : list of str (default "uk japan")
+    Countries for which to generate datasets
+
+--scale : float (default 1)
+    Multiple of the published number of repetitions (simulations and parameter draws)
+
+--reps : int (default 2000)
+    Number of repetitions at a scale of 1
+
+--weeks : space delimited list of ints
+    Weeks to generate (default is the weeks of the published data for each country)
+
+--controls : list of str
+    Control interventions to simulate (default is the controls of each country)
+
+--datadir : str (default "./data")
+    Folder in which to write the datasets
+
+--randomseed : int (default 100)
+    Random seed
+
+--profile : str (optional)
+    Append timings of each stage to a JSON trace file (default profile.jsonl, see profiling.py)
+"""
+
+import os, sys, argparse
+from os.path import join, exists
+import numpy as np, pandas as pd
+
+import profiling
+from simulation_tensor import PARAMS_USED, CTRL_ORDER
+from bootstrap import standard_error
+
+# Number of repetitions (simulations per control, parameter draws per week) in the published data
+REPS = 2000
+
+# Weeks of the published simulation output of each country
+WEEKS = {
+    'uk': list(range(1, 17)) + [20, 24, 28],
+    'japan': list(range(1, 12))
+}
+
+# Parameters of each country (those with a third species are only estimated for the UK), with
+# the median of the synthetic posterior distribution
+PARAMETERS = {
+    'epsilon_1': 1e-5, 'epsilon_2': 1e-5, 'gamma_1': 5e-5, 'gamma_2': 1.5,
+    'xi_2': 2.0, 'xi_3': 0.5, 'psi_1': 0.4, 'psi_2': 0.3, 'psi_3': 0.3,
+    'zeta_2': 1.5, 'zeta_3': 0.3, 'phi_1': 0.4, 'phi_2': 0.4, 'phi_3': 0.3, 'delta': 1.0
+}
+
+COUNTRY_PARAMETERS = {
+    'uk': list(PARAMETERS.keys()),
+    'japan': [p for p in PARAMETERS.keys() if not p.endswith('_3')]
+}
+
+
+def simulation_cell(params_used, week, reps, controls, rng):
+    """
+    Synthetic simulation output of one (params_used, week) cell (columns week, rep, params_used,
+    control, total_culls).
+    
+    Total culls of control i in week w are log-normal with a log-scale median of
+    10 + 0.1 i - 0.05 w (plus a random offset for each cell) and are rounded to whole animals.
+    """
+    offset = rng.normal(0, 0.05, len(controls))
+    
+    return pd.DataFrame({
+        'week': week,
+        'rep': np.tile(np.arange(reps), len(controls)),
+        'params_used': params_used,
+        'control': np.repeat(controls, reps),
+        'total_culls': np.round(rng.lognormal(
+            np.repeat(10 + 0.1*np.arange(len(controls)) - 0.05*week + offset, reps),
+            0.5)).astype(float)})
+
+
+def simulation_batch(week, reps, controls, rng, params_used = PARAMS_USED):
+    """
+    Synthetic simulation output of one week for every parameter set (i.e. a batch of new
+    simulations as posted to decision_service.py).
+    """
+    return pd.concat([simulation_cell(par, week, reps, controls, rng) for par in params_used],
+        ignore_index = True)
+
+
+def simulation_output(filename, reps, weeks, controls, rng, params_used = PARAMS_USED):
+    """
+    Write synthetic simulation output (columns week, rep, params_used, control, total_culls).
+    
+    Cells are generated (see simulation_cell) and written one at a time.
+    """
+    with open(filename, 'w') as f:
+        f.write('week,rep,params_used,control,total_culls\n')
+        
+        for par in params_used:
+            for w in weeks:
+                cell = simulation_cell(par, w, reps, controls, rng)
+                cell.to_csv(f, header = False, index = False)
+
+
+def parameters(filename, country, reps, weeks, rng):
+    """
+    Write synthetic posterior draws of the parameters (columns week, rep and one per parameter).
+    
+    Each parameter is log-normal about its value in PARAMETERS with a log-scale standard deviation
+    of 1/sqrt(w) in week w, so that the posterior narrows as the outbreak progresses.
+    """
+    names = COUNTRY_PARAMETERS[country]
+    
+    output = []
+    for w in weeks:
+        df = pd.DataFrame({'week': w, 'rep': np.arange(reps)})
+        for p in names:
+            df[p] = PARAMETERS[p]*rng.lognormal(0, 1./np.sqrt(w), reps)
+        output.append(df)
+    
+    pd.concat(output).to_csv(filename, index = False)
+
+
+def counts(filename, weeks, controls, rng, nboot = 1000, params_used = PARAMS_USED):
+    """
+    Write synthetic bootstrap counts (as output by bootstrap.py for the 'single' objective).
+    """
+    output = []
+    for par in params_used:
+        for w in weeks:
+            c = rng.multinomial(nboot, rng.dirichlet(np.ones(len(controls))))
+            
+            output.append(pd.DataFrame({
+                'week': w,
+                'params_used': par,
+                'objective': 'single',
+                'control': controls,
+                'counts': c,
+                'nboot': nboot,
+                'se': standard_error(c, nboot).max()}))
+    
+    pd.concat(output).to_csv(filename, index = False)
+
+
+def generate(country, datadir = join('.', 'data'), scale = 1, reps = REPS, weeks = None,
+        controls = None, randomseed = 100):
+    """
+    Generate the synthetic simulation output, parameters and counts of one country.
+    
+    Parameters
+    ----------
+    country : str
+        Country ('uk' or 'japan'), which determines the default weeks and controls
+    
+    datadir : str
+        Folder in which to write the datasets
+    
+    scale : float
+        Multiple of `reps`
+    
+    reps : int
+        Number of repetitions (simulations per control, parameter draws per week) at a scale of 1
+    
+    weeks, controls : lists
+        Weeks and controls to generate (default is those of the published data)
+    
+    randomseed : int
+        Random seed
+    
+    Returns
+    -------
+    dict
+        File names of the datasets (keys 'simulation_output', 'parameters' and 'counts')
+    """
+    if weeks is None:
+        weeks = WEEKS[country]
+    if controls is None:
+        controls = CTRL_ORDER[country]
+    
+    n = max(1, int(round(scale*reps)))
+    rng = np.random.default_rng(randomseed)
+    
+    if not exists(datadir):
+        os.makedirs(datadir)
+    
+    filenames = dict((k, join(datadir, k + '_' + country + '.csv'))
+        for k in ['simulation_output', 'parameters', 'counts'])
+    
+    simulation_output(filenames['simulation_output'], n, weeks, controls, rng)
+    parameters(filenames['parameters'], country, n, weeks, rng)
+    counts(filenames['counts'], weeks, controls, rng)
+    
+    return filenames
+
+
+if __name__ == "__main__":
+    
+    # Process the input argument
+    parser = argparse.ArgumentParser()
+    
+    parser.add_argument("-c", "--countries", nargs = '+', type = str, default = ['uk', 'japan'],
+        help = "Countries of interest ('uk' and/or 'japan')")
+    
+    parser.add_argument("--scale", type = float, default = 1,
+        help = "Multiple of the published number of repetitions")
+    
+    parser.add_argument("--reps", type = int, default = REPS,
+        help = "Number of repetitions at a scale of 1")
+    
+    parser.add_argument("-w", "--weeks", nargs = '+', type = int, default = None,
+        help = "Weeks to generate (default is the published weeks)")
+    
+    parser.add_argument("--controls", nargs = '+', type = str, default = None,
+        help = "Control interventions to simulate (default is those of each country)")
+    
+    parser.add_argument("--datadir", type = str, default = join('.', 'data'),
+        help = "Folder in which to write the datasets")
+    
+    parser.add_argument("--randomseed", type = int, default = 100,
+        help = "Random seed")
+    
+    profiling.add_profile_argument(parser)
+    
+    args = parser.parse_args()
+    
+    profiling.enable(args.profile)
+    
+    for country in args.countries:
+        sys.stdout.write("Generating synthetic data for: " + country + "\n")
+        
+        with profiling.stage('generate'):
+            filenames = generate(country, args.datadir, args.scale, args.reps, args.weeks,
+                args.controls, args.randomseed)
+        
+        for f in filenames.values():
+            sys.stdout.write("    " + f + "\n")
@@ -0,0 +1,168 @@
+"""
+Tests of bootstrap.py: exact probabilities of optimal controls and checkpointing and resuming 
+runs (on small synthetic datasets).
+"""
+
+import os, sys, json, shutil, subprocess
+from os.path import join, dirname, abspath
+import numpy as np, pandas as pd
+
+import pytest
+
+REPO = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import synthetic_data
+from simulation_tensor import CTRL_ORDER, tie_order
+from bootstrap import checkpoint_path, objective_counts, exact_optimal_probabilities, \
+    standard_error
+
+ARGS = ['--country', 'uk', '--nboot', '200', '--objectives', 'single', 'mean', '--ndraws', '5']
+
+
+def test_exact_matches_monte_carlo():
+    # Small integer-valued cell (so ties are common) with unequal numbers of simulations
+    rng = np.random.default_rng(1)
+    samples = rng.integers(0, 4, size = (4, 12)).astype(float)
+    nreps = np.array([12, 7, 10, 12])
+    
+    exact = exact_optimal_probabilities(samples, nreps)
+    assert np.isclose(exact.sum(), 1.)
+    
+    nboot = 200000
+    counts = objective_counts(samples, nboot, nreps = nreps, rng = np.random.default_rng(2))[0]
+    assert counts.sum() == nboot
+    
+    se = standard_error(nboot*exact, nboot)
+    assert np.all(np.abs(counts/nboot - exact) < 5*se + 1e-12)
+
+
+def test_ties_are_won_as_in_the_baseline():
+    # One simulation per control, so that each cell has one outcome with ties
+    controls = CTRL_ORDER['uk']
+    order = tie_order(controls)
+    rng = np.random.default_rng(5)
+    
+    for values in rng.integers(0, 3, size = (50, len(controls))).astype(float):
+        # Winner of the baseline bootstrap: idxmin of the cell sorted by control
+        df = pd.DataFrame({'control': controls, 'total_culls': values}).sort_values('control')
+        winner = controls.index(df.loc[df.total_culls.idxmin(), 'control'])
+        
+        samples = values[:, None]
+        expected = np.eye(len(controls))[winner]
+        
+        rank_counts = np.zeros((1, len(controls), len(controls)), dtype = int)
+        counts = objective_counts(samples, 3, rng = np.random.default_rng(0), 
+            rank_counts = rank_counts, order = order)[0]
+        assert np.array_equal(counts, 3*expected)
+        assert np.array_equal(rank_counts[0, :, 0], counts)
+        assert np.array_equal(exact_optimal_probabilities(samples, order = order), expected)
+
+
+def test_single_counts_do_not_depend_on_objectives():
+    rng = np.random.default_rng(3)
+    samples = rng.normal(size = (5, 30))
+    
+    def counts(objectives, ndraws):
+        rank_counts = np.zeros((len(objectives), 5, 5), dtype = int)
+        result = objective_counts(samples, 1000, objectives, ndraws, batchsize = 300, 
+            rng = np.random.default_rng(4), rank_counts = rank_counts)
+        return result[0], rank_counts[0]
+    
+    single = counts(['single'], 1)
+    for objectives, ndraws in [(['single', 'mean'], 5), (['single', 'cvar', 'q95'], 20)]:
+        other = counts(objectives, ndraws)
+        assert np.array_equal(single[0], other[0])
+        assert np.array_equal(single[1], other[1])
+
+
+def run_bootstrap(cwd, *extra):
+    result = subprocess.run([sys.executable, join(REPO, 'bootstrap.py')] + ARGS + list(extra),
+        cwd = cwd, stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+def outputs(cwd):
+    """
+    Contents of the counts and the rank counts written by bootstrap.py
+    """
+    with open(join(cwd, 'data', 'counts_uk.csv')) as f:
+        counts = f.read()
+    with np.load(join(cwd, 'data', 'rank_counts_uk.npz')) as data:
+        ranks = data['rank_counts'].copy()
+    return counts, ranks
+
+
+@pytest.fixture
+def workdir(tmp_path):
+    synthetic_data.generate('uk', str(tmp_path / 'data'), reps = 30, weeks = [1, 2, 3, 4])
+    return str(tmp_path)
+
+
+def test_counts_do_not_depend_on_workers(workdir):
+    run_bootstrap(workdir, '--workers', '1')
+    expected = outputs(workdir)
+    
+    shutil.rmtree(checkpoint_path('uk', join(workdir, 'data')))
+    run_bootstrap(workdir, '--workers', '2')
+    
+    counts, ranks = outputs(workdir)
+    assert counts == expected[0]
+    assert np.array_equal(ranks, expected[1])
+
+
+def test_resume_without_checkpoint(workdir):
+    run_bootstrap(workdir)
+    expected = outputs(workdir)
+    
+    shutil.rmtree(checkpoint_path('uk', join(workdir, 'data')))
+    os.remove(join(workdir, 'data', 'counts_uk.csv'))
+    
+    stdout = run_bootstrap(workdir, '--resume')
+    assert "No checkpoint found" in stdout
+    
+    counts, ranks = outputs(workdir)
+    assert counts == expected[0]
+    assert np.array_equal(ranks, expected[1])
+
+
+@pytest.mark.parametrize('workers', ['1', '2'])
+def test_resume_after_interruption(workdir, workers):
+    run_bootstrap(workdir, '--workers', workers)
+    expected = outputs(workdir)
+    
+    # Rewind the checkpoint to the state of a run killed while appending its fourth cell
+    path = checkpoint_path('uk', join(workdir, 'data'))
+    with open(join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    
+    ncells = 3
+    with open(join(workdir, 'data', 'counts_uk.csv')) as f:
+        lines = f.readlines()
+    rows = (len(lines) - 1)//len(manifest['cells'])
+    
+    manifest['cells'] = manifest['cells'][:ncells]
+    manifest['size'] = len("".join(lines[:1 + ncells*rows]))
+    with open(join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+    
+    with open(join(workdir, 'data', 'counts_uk.csv'), 'w') as f:
+        f.write("".join(lines[:1 + (ncells + 1)*rows]) + "final,5,sin")
+    
+    stdout = run_bootstrap(workdir, '--workers', workers, '--resume')
+    assert "Resuming from 3 finished cells" in stdout
+    
+    counts, ranks = outputs(workdir)
+    assert counts == expected[0]
+    assert np.array_equal(ranks, expected[1])
+
+
+def test_resume_with_different_settings(workdir):
+    run_bootstrap(workdir)
+    
+    result = subprocess.run([sys.executable, join(REPO, 'bootstrap.py')] + ARGS +
+        ['--randomseed', '1', '--resume'], cwd = workdir, stdout = subprocess.PIPE,
+        stderr = subprocess.PIPE, universal_newlines = True)
+    assert result.returncode != 0
+    assert "differ" in result.stderr
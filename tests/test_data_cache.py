@@ -0,0 +1,62 @@
+"""
+Tests of the columnar cache of data_cache.py against parsing the CSV files with pandas.
+"""
+
+import os, sys
+from os.path import dirname, abspath
+import numpy as np, pandas as pd
+
+REPO = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from data_cache import read_csv, cached_manifest, cache_path
+
+
+def assert_matches_csv(df, filename):
+    expected = pd.read_csv(filename)
+    assert list(df.columns) == list(expected.columns)
+    for c in expected.columns:
+        if pd.api.types.is_numeric_dtype(expected[c]):
+            assert np.allclose(df[c].values.astype(float), expected[c].values, rtol = 1e-6)
+        else:
+            assert list(df[c].astype(str)) == list(expected[c])
+
+
+def test_cache_round_trip(tmp_path):
+    rng = np.random.default_rng(1)
+    filename = str(tmp_path / 'simulation_output_uk.csv')
+    pd.DataFrame({'week': np.repeat([1, 2, 3], 20), 'rep': np.tile(np.arange(20), 3),
+        'control': rng.choice(['ip', 'rc3', 'v10'], 60), 'total_culls': rng.poisson(50., 60),
+        'duration': rng.gamma(2., 10., 60)}).to_csv(filename, index = False)
+    
+    first = read_csv(filename)
+    assert os.path.exists(os.path.join(cache_path(filename), 'manifest.json'))
+    assert_matches_csv(first, filename)
+    
+    # Compact types, and the same data when read from the cache
+    assert first.week.dtype == np.int16
+    assert first.control.dtype.name == 'category'
+    assert first.duration.dtype == np.float32
+    
+    second = read_csv(filename)
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_cache_invalidation(tmp_path):
+    filename = str(tmp_path / 'counts_uk.csv')
+    pd.DataFrame({'week': [1, 2], 'count': [10, 20]}).to_csv(filename, index = False)
+    sha1 = cached_manifest(filename)['sha1']
+    read_csv(filename)
+    
+    # Touching the file without changing it keeps the cache
+    os.utime(filename, ns = (0, 0))
+    assert cached_manifest(filename)['sha1'] == sha1
+    
+    # Changing the file (to one of the same size) rebuilds the cache
+    pd.DataFrame({'week': [1, 2], 'count': [10, 30]}).to_csv(filename, index = False)
+    assert cached_manifest(filename)['sha1'] != sha1
+    assert list(read_csv(filename)['count']) == [10, 30]
+    
+    # Only the columns of the current cache are kept
+    files = [f for f in os.listdir(cache_path(filename)) if f.endswith('.npy')]
+    assert len(files) == 2
@@ -0,0 +1,128 @@
+"""
+Tests of the decision service (decision_service.py) on localhost.
+"""
+
+import sys, socket, asyncio, threading
+from os.path import dirname, abspath
+import numpy as np
+
+import pytest
+
+REPO = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import synthetic_data
+from simulation_tensor import CTRL_ORDER
+from bootstrap import exact_optimal_probabilities
+from decision_service import DecisionState, DecisionService, post_batch, query
+
+CONTROLS = CTRL_ORDER['uk']
+
+
+@pytest.fixture
+def url():
+    """
+    URL of a service with no simulations, run in an event loop in another thread
+    """
+    service = DecisionService(DecisionState(CONTROLS), 'uk')
+    
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target = loop.run_forever, daemon = True)
+    thread.start()
+    
+    server = asyncio.run_coroutine_threadsafe(service.start('127.0.0.1', 0), loop).result()
+    port = server.sockets[0].getsockname()[1]
+    
+    yield 'http://127.0.0.1:' + str(port)
+    
+    async def stop():
+        server.close()
+        await server.wait_closed()
+    
+    asyncio.run_coroutine_threadsafe(stop(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def raw_request(url, data):
+    host, port = url.split('//')[1].split(':')
+    with socket.create_connection((host, int(port)), timeout = 10) as s:
+        s.sendall(data)
+        return s.recv(65536).decode('latin-1')
+
+
+def test_batches_update_queries(url):
+    rng = np.random.default_rng(1)
+    
+    with pytest.raises(ValueError):
+        query(url, 'optimal', week = 3, params_used = 'accrued')
+    
+    batch = synthetic_data.simulation_batch(3, 50, CONTROLS, rng)
+    posted = post_batch(url, batch)
+    assert {'params_used': 'accrued', 'week': 3} in posted['updated']
+    assert query(url, 'health')['weeks'] == [3]
+    
+    cell = batch.loc[batch.params_used == 'accrued']
+    samples = np.array([cell.total_culls.values[(cell.control == c).values] for c in CONTROLS])
+    
+    optimal = query(url, 'optimal', week = 3, params_used = 'accrued')
+    proportions = [optimal['proportions'][c] for c in CONTROLS]
+    assert np.allclose(proportions, exact_optimal_probabilities(samples))
+    
+    ranking = query(url, 'ranking', week = 3, params_used = 'accrued', statistic = 'mean')
+    assert [c['nreps'] for c in ranking['controls']] == [50]*len(CONTROLS)
+    
+    # Replace the cell with one in which v10 always has the fewest culls
+    batch = batch.assign(total_culls = np.where(batch.control == 'v10', 0.,
+        batch.total_culls + 1.))
+    post_batch(url, batch, replace = True)
+    
+    optimal = query(url, 'optimal', week = 3, params_used = 'accrued')
+    assert optimal['optimal'] == 'v10'
+    assert optimal['proportions']['v10'] == 1.
+    
+    # Rank 1 is the largest mean, so v10 is ranked last
+    ranking = query(url, 'ranking', week = 3, params_used = 'accrued', statistic = 'mean')
+    ranks = dict((c['control'], c['ranking']) for c in ranking['controls'])
+    assert ranks['v10'] == len(CONTROLS)
+    
+    # Added (rather than replaced) simulations are appended to the cell
+    post_batch(url, synthetic_data.simulation_batch(3, 10, CONTROLS, rng))
+    ranking = query(url, 'ranking', week = 3, params_used = 'accrued', statistic = 'mean')
+    assert [c['nreps'] for c in ranking['controls']] == [60]*len(CONTROLS)
+
+
+def test_cells_are_published_once_summarised():
+    rng = np.random.default_rng(2)
+    
+    # Queries made while a cell is summarised (i.e. from the event loop while a batch is added
+    # in a worker thread) see the previous simulations, rankings and proportions of the cell
+    seen = []
+    class State(DecisionState):
+        def summarise_cell(self, params_used, week, simulations):
+            if (params_used, week) in self.cells:
+                seen.append((self.ranking(week, params_used, 'mean'),
+                    self.optimal_control(week, params_used)))
+            return DecisionState.summarise_cell(self, params_used, week, simulations)
+    
+    state = State(CONTROLS)
+    state.add_batch(synthetic_data.simulation_batch(3, 20, CONTROLS, rng))
+    before = (state.ranking(3, 'accrued', 'mean'), state.optimal_control(3, 'accrued'))
+    
+    state.add_batch(synthetic_data.simulation_batch(3, 30, CONTROLS, rng), replace = True)
+    assert seen[0] == before
+    assert [c['nreps'] for c in state.ranking(3, 'accrued', 'mean')['controls']] == \
+        [30]*len(CONTROLS)
+
+
+@pytest.mark.parametrize('data', [b'GARBAGE\r\n\r\n',
+    b'POST /batch HTTP/1.1\r\nContent-Length: abc\r\n\r\n',
+    b'GET /health HTTP/1.1\r\nno colon\r\n\r\n'])
+def test_malformed_request(url, data):
+    response = raw_request(url, data)
+    assert response.startswith('HTTP/1.1 400 Bad Request')
+    assert 'Malformed request' in response
+    
+    # The service is still answering
+    assert query(url, 'health')['status'] == 'ok'
@@ -0,0 +1,58 @@
+"""
+Tests of the binned kernel density estimates of density.py against an exact Gaussian KDE.
+"""
+
+import sys
+from os.path import dirname, abspath
+import numpy as np
+
+REPO = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from density import kde_curves, violin_stats
+
+
+def exact_kde(x, coords):
+    """
+    Gaussian KDE with Scott's rule bandwidth (as matplotlib) summed over every sample
+    """
+    bw = x.std(ddof = 1)*len(x)**(-1./5)
+    z = (coords[:, None] - x[None, :])/bw
+    return np.exp(-0.5*z**2).sum(axis = 1)/(len(x)*bw*np.sqrt(2*np.pi))
+
+
+def test_binned_kde_matches_exact_kde():
+    rng = np.random.default_rng(1)
+    groups = [rng.normal(5., 2., 50), rng.lognormal(8., 1., 2000),
+        np.concatenate([rng.normal(0., 1., 300), rng.normal(10., 0.5, 100)]),
+        rng.integers(0, 20, 500).astype(float)]
+    
+    coords, vals = kde_curves(groups, points = 100)
+    
+    for x, c, v in zip(groups, coords, vals):
+        assert np.allclose(c, np.linspace(x.min(), x.max(), 100))
+        
+        exact = exact_kde(x, c)
+        assert np.max(np.abs(v - exact)) < 0.005*exact.max()
+
+
+def test_violin_stats(tmp_path):
+    rng = np.random.default_rng(2)
+    groups = [rng.normal(size = 100), np.full(10, 3.), np.array([np.nan]), rng.normal(size = 40)]
+    
+    vpstats = violin_stats(groups, cachedir = str(tmp_path))
+    
+    # Groups without spread have a flat density, and empty groups have none
+    assert np.all(vpstats[1]['vals'] == 1.)
+    assert len(vpstats[2]['vals']) == 0
+    
+    for x, stats in zip([groups[0], groups[3]], [vpstats[0], vpstats[3]]):
+        assert np.isclose(stats['median'], np.median(x))
+        assert np.max(np.abs(stats['vals'] - exact_kde(x, stats['coords']))) < \
+            0.005*stats['vals'].max()
+    
+    # Curves read from the cache are those calculated
+    cached = violin_stats(groups, cachedir = str(tmp_path))
+    assert len(list(tmp_path.iterdir())) == 1
+    for a, b in zip(vpstats, cached):
+        assert np.array_equal(a['vals'], b['vals'])
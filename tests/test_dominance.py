@@ -0,0 +1,50 @@
+"""
+Tests of dominance.py against all pairwise comparisons of simulations.
+"""
+
+import sys
+from os.path import dirname, abspath
+import numpy as np
+
+REPO = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from dominance import dominance_matrix
+
+
+def pairwise_dominance(x, y):
+    """
+    P(X < Y) + P(X = Y)/2 from all len(x) x len(y) pairs
+    """
+    return ((x[:, None] < y[None, :]) + 0.5*(x[:, None] == y[None, :])).mean()
+
+
+def test_dominance_matches_pairwise_comparisons():
+    rng = np.random.default_rng(1)
+    
+    # (cells x controls x reps) of integer values (so that ties are common), with unequal
+    # numbers of simulations and a control without simulations
+    values = rng.integers(0, 6, size = (3, 4, 15)).astype(float)
+    nreps = rng.integers(1, 16, size = (3, 4))
+    nreps[2, 1] = 0
+    
+    D = dominance_matrix(values, nreps)
+    
+    for n in range(3):
+        for i in range(4):
+            for j in range(4):
+                x = values[n, i, :nreps[n, i]]; y = values[n, j, :nreps[n, j]]
+                
+                if (len(x) == 0) or (len(y) == 0):
+                    assert np.isnan(D[n, i, j])
+                else:
+                    assert np.isclose(D[n, i, j], pairwise_dominance(x, y))
+    
+    # Continuous values without padding
+    values = rng.normal(size = (2, 5, 40))
+    D = dominance_matrix(values)
+    
+    expected = np.array([[[pairwise_dominance(values[n, i], values[n, j]) for j in range(5)]
+        for i in range(5)] for n in range(2)])
+    assert np.allclose(D, expected)
+    assert np.allclose(D + np.swapaxes(D, 1, 2), 1.)
@@ -0,0 +1,42 @@
+"""
+Tests of the summary table of posterior_summary.py against pandas means and quantiles.
+"""
+
+import sys
+from os.path import dirname, abspath
+import numpy as np, pandas as pd
+
+REPO = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from posterior_summary import summary_table, QUANTILES, ALL_WEEKS
+
+
+def test_summary_table_matches_pandas():
+    rng = np.random.default_rng(1)
+    
+    # Weeks with different numbers of draws, a parameter with negative values (so without 
+    # log-scale statistics) and missing draws
+    weeks = np.repeat([1, 2, 4], [50, 200, 7])
+    params = pd.DataFrame({'week': weeks, 'rep': np.arange(len(weeks)),
+        'gamma_1': rng.lognormal(0., 2., len(weeks)), 'delta': rng.gamma(2., 1., len(weeks)),
+        'shift': rng.normal(size = len(weeks))})
+    params.loc[[3, 60], 'delta'] = np.nan
+    
+    table = summary_table(params)
+    assert set(table.week) == set([ALL_WEEKS, 1, 2, 4])
+    
+    for row in table.itertuples():
+        draws = params if row.week == ALL_WEEKS else params.loc[params.week == row.week]
+        x = draws[row.parameter].dropna()
+        
+        if row.scale == 'log':
+            if (x < 0).any():
+                assert np.isnan(row.mean)
+                continue
+            x = np.log(x)
+        
+        assert row.n == len(x)
+        assert np.isclose(row.mean, x.mean())
+        for name, q in QUANTILES.items():
+            assert np.isclose(getattr(row, name), x.quantile(q))
@@ -0,0 +1,72 @@
+"""
+Tests of quantile_sketch.py against exact quantiles (numpy.quantile).
+"""
+
+import sys
+from os.path import dirname, abspath
+import numpy as np, pandas as pd
+
+REPO = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from quantile_sketch import QuantileSketch, RELATIVE_ACCURACY, summarise
+
+Q = np.array([0., 0.005, 0.025, 0.1, 0.5, 0.9, 0.975, 0.995, 1.])
+
+
+def within_accuracy(estimate, exact, accuracy = RELATIVE_ACCURACY):
+    # Small allowance for rounding of the bucket values
+    return np.all(np.abs(estimate - exact) <= accuracy*np.abs(exact)*(1. + 1e-9) + 1e-300)
+
+
+def test_quantiles_within_relative_accuracy():
+    rng = np.random.default_rng(1)
+    
+    # Values of the same sign (positive over many orders of magnitude, and negative)
+    for x in [rng.lognormal(0., 3., 20001), -rng.gamma(2., 5., 5001)]:
+        sketch = QuantileSketch().add(x)
+        assert sketch.count == len(x)
+        assert within_accuracy(sketch.quantile(Q), np.quantile(x, Q))
+    
+    # Values of both signs (and zeros) at the order statistics themselves
+    x = np.concatenate([rng.normal(0., 10., 4000), np.zeros(1), [np.nan]])
+    sketch = QuantileSketch().add(x)
+    x = x[~np.isnan(x)]
+    q = np.array([0, 1, 40, 2000, 3999, 4000])/4000.
+    assert within_accuracy(sketch.quantile(q), np.quantile(x, q))
+
+
+def test_merged_sketches_match_one_sketch():
+    rng = np.random.default_rng(2)
+    parts = [rng.lognormal(w, 1., 1000) for w in range(4)]
+    
+    merged = QuantileSketch()
+    for x in parts:
+        merged.merge(QuantileSketch().add(x))
+    
+    x = np.concatenate(parts)
+    assert np.array_equal(merged.quantile(Q), QuantileSketch().add(x).quantile(Q))
+    assert within_accuracy(merged.quantile(Q), np.quantile(x, Q))
+
+
+def test_summary_of_chunks():
+    rng = np.random.default_rng(3)
+    df = pd.DataFrame({'week': np.repeat([1, 2], 3000), 'rep': np.tile(np.arange(3000), 2),
+        'gamma_1': rng.lognormal(0., 1., 6000)})
+    
+    summary = summarise(df, chunksize = 700)
+    table = summary.table('gamma_1')
+    
+    for w, row in zip([1, 2], table.itertuples()):
+        x = df.gamma_1.values[df.week.values == w]
+        assert np.isclose(row.avg, x.mean())
+        assert within_accuracy(np.array([row.L95, row.U95]), np.quantile(x, [0.025, 0.975]))
+    
+    # Quantiles of the log are within an absolute error of log(1 + RELATIVE_ACCURACY)
+    table = summary.table('gamma_1', log = True)
+    for w, row in zip([1, 2], table.itertuples()):
+        x = df.gamma_1.values[df.week.values == w]
+        assert np.isclose(row.avg, np.log(x).mean())
+        exact = np.log(np.quantile(x, [0.025, 0.975]))
+        assert np.all(np.abs(np.array([row.L95, row.U95]) - exact) <=
+            np.log1p(RELATIVE_ACCURACY)*(1. + 1e-9))
@@ -0,0 +1,49 @@
+"""
+Tests of the ranking table of ranking.py against ranking summaries with pandas (as the baseline
+three-panel plot did).
+"""
+
+import sys
+from os.path import dirname, abspath
+import numpy as np, pandas as pd
+
+REPO = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from simulation_tensor import SimulationTensor
+from ranking import rank_table
+
+CONTROLS = ['ip', 'ipdc', 'rc3', 'rc10', 'v3']
+
+# Statistics and the equivalent pandas aggregations
+STATISTICS = {'mean': 'mean', 'median': 'median', 'var': lambda x: x.var(ddof = 0),
+    'q95': lambda x: x.quantile(0.95)}
+
+
+def test_rank_table_matches_pandas():
+    rng = np.random.default_rng(1)
+    
+    # Integer total culls (so that ties in the statistics occur) with unequal numbers of 
+    # simulations and a control without simulations in one week
+    rows = [(p, w, c, rng.poisson(3.)) for p in ['final', 'accrued'] for w in [1, 2, 3] 
+        for c in CONTROLS for r in range(int(rng.integers(1, 6))) if (w, c) != (2, 'rc10')]
+    df = pd.DataFrame(rows, columns = ['params_used', 'week', 'control', 'total_culls'])
+    df['total_culls'] = df.total_culls.astype(float)
+    
+    tensor = SimulationTensor.from_frame(df, CONTROLS)
+    table = rank_table(tensor, list(STATISTICS))
+    
+    for name, func in STATISTICS.items():
+        # Baseline: statistic of each cell, ranked within each (params_used, week) in 
+        # descending order with ties given the minimum rank
+        expected = df.groupby(['params_used', 'week', 'control']).total_culls.agg(func).\
+            rename('value').reset_index()
+        expected['ranking'] = expected.groupby(['params_used', 'week']).value.rank(
+            ascending = False, method = 'min')
+        
+        result = table.loc[table.statistic == name]
+        merged = expected.merge(result, on = ['params_used', 'week', 'control'], how = 'outer')
+        
+        assert len(merged) == len(expected) == len(result)
+        assert np.allclose(merged.value_x, merged.value_y)
+        assert np.array_equal(merged.ranking_x, merged.ranking_y)
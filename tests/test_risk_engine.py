@@ -0,0 +1,35 @@
+"""
+Tests of the adaptive quadrature of risk_engine.py against the closed-form kernel integral.
+"""
+
+import sys, warnings
+from os.path import dirname, abspath
+import numpy as np
+
+import pytest
+
+REPO = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from risk_engine import K, K_integral, adaptive_integral
+
+
+def test_adaptive_integral_matches_closed_form():
+    delta = np.array([0.01, 0.1, 0.5, 1., 3.])
+    
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        integral = adaptive_integral(K, 0., 4., delta, tolerance = 1e-10)
+    
+    assert np.allclose(integral, K_integral(0., 4., delta), rtol = 1e-8)
+
+
+def test_adaptive_integral_panels():
+    delta = np.array([0.01, 1.])
+    
+    # Too few panels to converge gives a warning, and too few to refine raises an error
+    with pytest.warns(RuntimeWarning, match = "did not converge within 32 panels"):
+        adaptive_integral(K, 0., 4., delta, max_panels = 32)
+    
+    with pytest.raises(ValueError):
+        adaptive_integral(K, 0., 4., delta, max_panels = 16)
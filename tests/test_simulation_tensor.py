@@ -0,0 +1,55 @@
+"""
+Tests of the padding and repetition counts of simulation_tensor.py.
+"""
+
+import sys
+from os.path import dirname, abspath
+import numpy as np, pandas as pd
+
+REPO = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from simulation_tensor import SimulationTensor, tie_order
+
+CONTROLS = ['ip', 'rc3', 'rc10', 'v3']
+
+
+def test_padding_and_nreps():
+    rng = np.random.default_rng(1)
+    
+    # Unequal numbers of simulations per cell, a control without simulations in one week and a 
+    # week with only one parameter set; rows shuffled and reps out of order
+    rows = []
+    for p in ['final', 'accrued']:
+        for w in [2, 5, 9]:
+            for c in CONTROLS:
+                n = 0 if (w == 5 and c == 'rc10') or (w == 9 and p == 'final') else \
+                    int(rng.integers(1, 8))
+                rows.extend((p, w, c, r, rng.normal()) for r in rng.permutation(n))
+    df = pd.DataFrame(rows, columns = ['params_used', 'week', 'control', 'rep', 'total_culls'])
+    df = df.sample(frac = 1., random_state = 2)
+    
+    tensor = SimulationTensor.from_frame(df, CONTROLS)
+    assert tensor.shape[:3] == (2, 3, len(CONTROLS))
+    assert tensor.weeks == [2, 5, 9]
+    
+    counts = df.groupby(['params_used', 'week', 'control']).size()
+    assert tensor.shape[3] == counts.max()
+    
+    for p in tensor.params_used:
+        for w in tensor.weeks:
+            nreps = tensor.cell_nreps(p, w)
+            for i, c in enumerate(CONTROLS):
+                expected = df.loc[(df.params_used == p) & (df.week == w) & (df.control == c)].\
+                    sort_values('rep').total_culls.values
+                assert nreps[i] == len(expected)
+                assert tensor.mask[tensor.params_index(p), tensor.week_index(w), i] == \
+                    (len(expected) > 0)
+                
+                # Simulations in order of rep, padded with NaN
+                assert np.array_equal(tensor.control(p, w, c), expected)
+                assert np.all(np.isnan(tensor.cell(p, w)[i, len(expected):]))
+
+
+def test_tie_order_is_alphabetical():
+    assert list(tie_order(CONTROLS)) == [0, 2, 1, 3]
@@ -0,0 +1,55 @@
+"""
+Tests of the statistics of statistics_store.py against numpy, one group at a time.
+"""
+
+import sys
+from os.path import dirname, abspath
+import numpy as np
+
+REPO = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from statistics_store import StatisticsStore, CVAR_ALPHA, tail_size
+
+
+def test_statistics_match_numpy():
+    rng = np.random.default_rng(1)
+    
+    # (groups x reps) of integer values (so that ties occur) padded with NaN, with groups of one 
+    # simulation and a group without simulations
+    values = rng.integers(0, 50, size = (2, 6, 40)).astype(float)
+    nreps = rng.integers(1, 41, size = (2, 6))
+    nreps[0, 1] = 1; nreps[1, 3] = 0; nreps[1, 4] = 40
+    for index in np.ndindex(nreps.shape):
+        values[index][nreps[index]:] = np.nan
+    
+    store = StatisticsStore(values, nreps)
+    
+    for index in np.ndindex(nreps.shape):
+        x = values[index][:nreps[index]]
+        
+        if len(x) == 0:
+            assert np.isnan(store.mean()[index]) and np.isnan(store.var()[index])
+            assert np.isnan(store.quantile(0.5)[index]) and np.isnan(store.cvar()[index])
+            continue
+        
+        assert np.isclose(store.mean()[index], x.mean())
+        assert np.isclose(store.var()[index], np.var(x))
+        assert np.isclose(store.statistic('median')[index], np.median(x))
+        
+        for q in [0., 0.05, 0.5, 0.95, 1.]:
+            assert np.isclose(store.quantile(q)[index], np.quantile(x, q))
+        
+        # Mean of the largest ceil((1 - alpha) n) simulations (at least one)
+        for alpha in [0.5, CVAR_ALPHA, 0.95, 0.99]:
+            tail = np.sort(x)[len(x) - tail_size(alpha, len(x)):]
+            assert np.isclose(store.cvar(alpha)[index], tail.mean())
+        
+        assert np.isclose(store.statistic('cvar')[index], store.cvar(CVAR_ALPHA)[index])
+        assert np.isclose(store.statistic('q95')[index], np.percentile(x, 95))
+
+
+def test_tail_size():
+    assert tail_size(0.95, 2000) == 100
+    assert tail_size(0.9, 25) == 3
+    assert tail_size(0.99, 10) == 1
@@ -0,0 +1,82 @@
+"""
+Tests of value_of_information.py against explicit resampling of the simulations.
+"""
+
+import sys
+from os.path import dirname, abspath
+import numpy as np, pandas as pd
+
+REPO = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from simulation_tensor import SimulationTensor
+from value_of_information import value_of_information, MEASURES
+
+CONTROLS = ['ip', 'ipdc', 'rc3', 'v3']
+WEEKS = [1, 2, 3]
+REPS = 15
+
+
+def brute_force(df, index_accrued, index_final):
+    """
+    Optimal controls and MEASURES of each week from the simulations of the repetitions
+    `index_accrued` and `index_final` (with repeats), one week and control at a time
+    """
+    output = []
+    for w in WEEKS:
+        cell = dict(((p, c), g.sort_values('rep').total_culls.values)
+            for (p, c), g in df.loc[df.week == w].groupby(['params_used', 'control']))
+        
+        accrued = [cell[('accrued', c)][index_accrued].mean() for c in CONTROLS]
+        final = [cell[('final', c)][index_final].mean() for c in CONTROLS]
+        best = np.min([cell[('final', c)][index_final] for c in CONTROLS], axis = 0).mean()
+        
+        a = int(np.argmin(accrued)); f = int(np.argmin(final))
+        output.append({'accrued': a, 'final': f, 'voi': final[a] - final[f],
+            'evpi': final[f] - best, 'regret': final[a] - best})
+    
+    return output
+
+
+def test_value_of_information_matches_explicit_resampling():
+    rng = np.random.default_rng(1)
+    
+    # Integer total culls, so that the optimal controls of some resamples differ
+    rows = [(w, r, p, c, rng.poisson(20 + 5*i + 10*(p == 'final')))
+        for w in WEEKS for r in range(REPS) for p in ['accrued', 'final']
+        for i, c in enumerate(CONTROLS)]
+    df = pd.DataFrame(rows, columns = ['week', 'rep', 'params_used', 'control', 'total_culls'])
+    df['total_culls'] = df.total_culls.astype(float)
+    
+    tensor = SimulationTensor.from_frame(df, CONTROLS)
+    
+    nboot = 20
+    output = value_of_information(tensor, nboot, level = 0.9, batchsize = 7,
+        rng = np.random.default_rng(2))
+    
+    # Estimates use every simulation once
+    estimate = brute_force(df, np.arange(REPS), np.arange(REPS))
+    for m in MEASURES:
+        assert np.allclose(output[m], [e[m] for e in estimate])
+    assert list(output.accrued_optimal) == [CONTROLS[e['accrued']] for e in estimate]
+    assert list(output.final_optimal) == [CONTROLS[e['final']] for e in estimate]
+    
+    # Resamples drawn with the same multinomial weights (in batches of 7), as repeated indices
+    draws = np.random.default_rng(2)
+    pvals = np.full(REPS, 1./REPS)
+    boot = []
+    for start in range(0, nboot, 7):
+        size = min(7, nboot - start)
+        weights = [draws.multinomial(REPS, pvals, size = size) for k in range(2)]
+        for b in range(size):
+            boot.append(brute_force(df, np.repeat(np.arange(REPS), weights[0][b]),
+                np.repeat(np.arange(REPS), weights[1][b])))
+    
+    for iw in range(len(WEEKS)):
+        agreement = np.mean([r[iw]['accrued'] == r[iw]['final'] for r in boot])
+        assert np.isclose(output.agreement[iw], agreement)
+        
+        for m in MEASURES:
+            x = [r[iw][m] for r in boot]
+            assert np.isclose(output[m + '_lower'][iw], np.percentile(x, 5.))
+            assert np.isclose(output[m + '_upper'][iw], np.percentile(x, 95.))
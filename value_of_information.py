@@ -0,0 +1,247 @@
+"""
+Expected value of information: decisions made with accrued rather than complete parameters.
+
+For every week, the control with the smallest mean total culls is chosen using the simulations of
+the parameters estimated from the data accrued up to that week ('accrued', the accrued-optimal
+control) and using the simulations of the parameters estimated from the complete outbreak
+('final', the complete-optimal control).  All expectations are then taken over the 'final'
+simulations:
+
+* voi : value of complete information, the expected extra total culls from choosing the
+  accrued-optimal control rather than the complete-optimal control (zero if they agree)
+* evpi : expected value of perfect information given complete parameters, the expected extra
+  total culls of the complete-optimal control over the best control of each simulation
+  (simulations of each control are paired by repetition)
+* regret : expected regret of the accrued-optimal control over the best control of each
+  simulation (voi + evpi)
+
+Bootstrap confidence intervals resample the repetitions of each parameter set with replacement
+(as multinomial weights on the repetitions, shared across weeks and controls so that the
+pairing of repetitions is kept).  Resampled means of every (week, control) are evaluated for all
+resamples at once as a matrix product, so that the (weeks x controls x resamples) tensor is
+calculated in one pass over the simulation output, in batches of `batchsize` resamples.  The
+proportion of resamples in which the accrued-optimal and complete-optimal controls agree is also
+reported.
+
+Output is saved as `data/value_of_information_<country>.csv` (see data/README.md).
+
+Usage:
+
+python value_of_information.py --country <country> [--nboot <n>] [--level <level>] [--batchsize <size>] [--randomseed <seed>] [--profile [<trace file>]]
+
+
+Parameters
+----------
+--country : str ("japan" or "uk")
+
+--nboot : int (default 1000)
+    Number of bootstrap resamples
+
+--level : float (default 0.95)
+    Level of the bootstrap (percentile) confidence intervals
+
+--batchsize : int (default 100)
+    Number of resamples evaluated at once
+
+--randomseed : int (default 100)
+    Random seed for the bootstrap
+
+--profile : str (optional)
+    Append timings of each stage to a JSON trace file (default profile.jsonl, see profiling.py)
+"""
+
+import sys, argparse, warnings
+from os.path import join
+import numpy as np, pandas as pd
+
+import profiling
+from simulation_tensor import SimulationTensor
+
+# Measures of the value of information (each reported with lower and upper bounds)
+MEASURES = ['voi', 'evpi', 'regret']
+
+# Default number of resamples evaluated at once
+BATCHSIZE = 100
+
+
+def weighted_means(values, weights):
+    """
+    Means of each row of `values` (ignoring NaN) under each row of repetition weights.
+    
+    Parameters
+    ----------
+    values : 2D numpy array
+        Values (rows x repetitions), NaN where a row has fewer repetitions
+    
+    weights : 2D numpy array
+        Weights of each repetition (resamples x repetitions)
+    
+    Returns
+    -------
+    2D numpy array
+        Weighted means (rows x resamples)
+    """
+    valid = ~np.isnan(values)
+    
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return np.where(valid, values, 0.).dot(weights.T)/valid.astype(float).dot(weights.T)
+
+
+def measures(accrued, final, best):
+    """
+    Optimal controls and value of information from the mean total culls of each control.
+    
+    Parameters
+    ----------
+    accrued, final : 3D numpy arrays
+        Mean total culls (weeks x controls x resamples) under accrued and final parameters
+    
+    best : 2D numpy array
+        Mean of the smallest total culls across controls of each simulation (weeks x resamples)
+        under final parameters
+    
+    Returns
+    -------
+    dict
+        Accrued-optimal and complete-optimal control indices ('accrued', 'final') and each of
+        MEASURES (weeks x resamples)
+    """
+    a = np.where(np.isnan(accrued), np.inf, accrued).argmin(axis = 1)
+    c = np.where(np.isnan(final), np.inf, final).argmin(axis = 1)
+    
+    fa = np.take_along_axis(final, a[:, None, :], axis = 1)[:, 0]
+    fc = np.take_along_axis(final, c[:, None, :], axis = 1)[:, 0]
+    
+    return {'accrued': a, 'final': c, 'voi': fa - fc, 'evpi': fc - best, 'regret': fa - best}
+
+
+def value_of_information(tensor, nboot = 1000, level = 0.95, batchsize = BATCHSIZE,
+        rng = None):
+    """
+    Value of complete information, expected value of perfect information and expected regret
+    of the accrued-optimal control for every week, with bootstrap confidence intervals.
+    
+    Parameters
+    ----------
+    tensor : SimulationTensor
+        Simulation output (with 'accrued' and 'final' parameter sets)
+    
+    nboot : int
+        Number of bootstrap resamples
+    
+    level : float
+        Level of the (percentile) confidence intervals
+    
+    batchsize : int
+        Number of resamples evaluated at once
+    
+    rng : numpy.random.Generator
+        Random number generator used for resampling
+    
+    Returns
+    -------
+    pandas.DataFrame
+        Columns `week`, `accrued_optimal`, `final_optimal`, `agreement` (proportion of resamples
+        in which the optimal controls agree) and, for each of MEASURES, the estimate and the
+        lower and upper bounds (i.e. `voi`, `voi_lower`, `voi_upper`); weeks without simulations
+        of both parameter sets are omitted
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    
+    P, W, C, R = tensor.shape
+    accrued = tensor.values[tensor.params_index('accrued')].reshape(W*C, R)
+    final = tensor.values[tensor.params_index('final')].reshape(W*C, R)
+    
+    # Smallest total culls across controls of each simulation (repetitions paired)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        best = np.nanmin(final.reshape(W, C, R), axis = 1)
+    
+    def evaluate(weights_accrued, weights_final):
+        B = len(weights_final)
+        return measures(weighted_means(accrued, weights_accrued).reshape(W, C, B),
+            weighted_means(final, weights_final).reshape(W, C, B),
+            weighted_means(best, weights_final))
+    
+    # Estimates use every simulation once
+    ones = np.ones((1, R))
+    estimate = evaluate(ones, ones)
+    
+    # Resample in batches (accrued and final simulations are resampled independently)
+    boot = dict((k, []) for k in estimate.keys())
+    pvals = np.full(R, 1./R)
+    for start in range(0, nboot, batchsize):
+        size = min(batchsize, nboot - start)
+        
+        result = evaluate(rng.multinomial(R, pvals, size = size).astype(float),
+            rng.multinomial(R, pvals, size = size).astype(float))
+        
+        for k, v in result.items():
+            boot[k].append(v)
+    
+    boot = dict((k, np.concatenate(v, axis = 1)) for k, v in boot.items())
+    
+    tail = 100.*(1. - level)/2.
+    present = tensor.mask.any(axis = 2).all(axis = 0)
+    
+    output = pd.DataFrame({
+        'week': tensor.weeks,
+        'accrued_optimal': np.array(tensor.controls)[estimate['accrued'][:, 0]],
+        'final_optimal': np.array(tensor.controls)[estimate['final'][:, 0]],
+        'agreement': (boot['accrued'] == boot['final']).mean(axis = 1)})
+    
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for m in MEASURES:
+            output[m] = estimate[m][:, 0]
+            output[m + '_lower'] = np.nanpercentile(boot[m], tail, axis = 1)
+            output[m + '_upper'] = np.nanpercentile(boot[m], 100. - tail, axis = 1)
+    
+    return output.loc[present].reset_index(drop = True)
+
+
+def voi_filename(country, datadir = join('.', 'data')):
+    return join(datadir, 'value_of_information_' + country + '.csv')
+
+
+if __name__ == "__main__":
+    
+    # Process the input argument
+    parser = argparse.ArgumentParser()
+    
+    parser.add_argument("-c", "--country", type = str, required = True,
+        help = "Country of interest ('uk' or 'japan')")
+    
+    parser.add_argument("--nboot", type = int, default = 1000,
+        help = "Number of bootstrap resamples")
+    
+    parser.add_argument("--level", type = float, default = 0.95,
+        help = "Level of the bootstrap confidence intervals")
+    
+    parser.add_argument("--batchsize", type = int, default = BATCHSIZE,
+        help = "Number of resamples evaluated at once")
+    
+    parser.add_argument("--randomseed", type = int, default = 100,
+        help = "Random seed for the bootstrap")
+    
+    profiling.add_profile_argument(parser)
+    
+    args = parser.parse_args()
+    
+    profiling.enable(args.profile)
+    
+    sys.stdout.write("Calculating the value of information for: " + args.country + "\n")
+    
+    with profiling.stage('load'):
+        tensor = SimulationTensor.load(args.country)
+    
+    with profiling.stage('compute', items = args.nboot, unit = 'bootstrap samples'):
+        output = value_of_information(tensor, args.nboot, args.level, args.batchsize,
+            np.random.default_rng(args.randomseed))
+    
+    with profiling.stage('save'):
+        output.to_csv(voi_filename(args.country), index = False)
+    
+    sys.stdout.write(output[['week', 'accrued_optimal', 'final_optimal', 'agreement', 'voi',
+        'voi_lower', 'voi_upper']].to_string(index = False) + "\n")